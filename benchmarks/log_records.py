@@ -0,0 +1,32 @@
+"""Measures the records listing throughput of the log backend.
+
+Usage::
+
+    $ python benchmarks/log_records.py [nb_records]
+"""
+import shutil
+import sys
+import tempfile
+from uuid import uuid4
+
+import six
+
+from daybed.backends.log.database import Database
+from daybed.backends.log.store import LogStore
+from memory_records import fill_database, run
+
+
+def main(nb_records=100000):
+    path = tempfile.mkdtemp()
+    store = LogStore(path)
+    try:
+        db = Database(store,
+                      lambda: six.text_type(uuid4()).replace('-', ''))
+        run(fill_database(db, nb_records), nb_records)
+    finally:
+        store.close()
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,79 @@
+"""Measures the records listing throughput of the memory backend.
+
+Usage::
+
+    $ python benchmarks/memory_records.py [nb_records]
+"""
+import sys
+import time
+from uuid import uuid4
+
+import six
+
+from daybed.backends.memory.database import Database
+
+
+def build_database(nb_records):
+    empty = {
+        'models': {},
+        'data': {},
+        'index': {},
+        'users': {},
+        'policies': {}
+    }
+    db = Database(empty, lambda: six.text_type(uuid4()).replace('-', ''))
+    return fill_database(db, nb_records)
+
+
+def fill_database(db, nb_records):
+    db.set_policy('read-only', {})
+    definition = {'title': 'benchmark',
+                  'description': 'A few fields',
+                  'fields': [{'name': 'age', 'type': 'int'},
+                             {'name': 'name', 'type': 'string'},
+                             {'name': 'tags', 'type': 'choices',
+                              'choices': ['a', 'b', 'c']},
+                             {'name': 'location', 'type': 'point'}]}
+    db.put_model(definition, {'admins': ['Alexis']}, 'read-only', 'bench')
+    for i in range(nb_records):
+        record = {'age': i,
+                  'name': u'Record %s' % i,
+                  'tags': ['a', 'c'],
+                  'location': [i % 180, i % 90]}
+        db.put_record('bench', record, ['Alexis'])
+    return db
+
+
+def measure(name, func, nb_items, unit='records', repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    print('%-30s %12.0f %s/sec' % (name, nb_items / best, unit))
+
+
+def run(db, nb_records):
+    measure('get_records()',
+            lambda: db.get_records('bench'),
+            nb_records)
+    if hasattr(db, 'iter_records'):
+        measure('iter_records()',
+                lambda: list(db.iter_records('bench')),
+                nb_records)
+    measure('get_model_definition() x1000',
+            lambda: [db.get_model_definition('bench') for i in range(1000)],
+            1000, unit='calls')
+    record_id = db.get_records('bench', limit=1)[0]['id']
+    measure('get_record() x1000',
+            lambda: [db.get_record('bench', record_id) for i in range(1000)],
+            1000, unit='calls')
+
+
+def main(nb_records=100000):
+    run(build_database(nb_records), nb_records)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
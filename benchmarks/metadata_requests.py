@@ -0,0 +1,32 @@
+"""Measures the throughput of the endpoints which do not use the backend,
+and the number of database objects built for them.
+
+Usage::
+
+    $ python benchmarks/metadata_requests.py [nb_requests] [config]
+"""
+import sys
+
+import mock
+import webtest
+
+from memory_records import measure
+
+
+def main(nb_requests=1000, config='conf/tests.ini'):
+    app = webtest.TestApp('config:%s' % config, relative_to='.')
+    backend = app.app.registry.backend
+    for path in ('/', '/fields', '/spore'):
+        with mock.patch.object(backend, 'db', wraps=backend.db) as db:
+            measure('GET %s' % path,
+                    lambda: [app.get(path) for i in range(nb_requests)],
+                    nb_requests, unit='requests')
+        print('%-30s %12d' % ('  databases built', db.call_count))
+    backend.delete_db()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args:
+        args[0] = int(args[0])
+    main(*args)
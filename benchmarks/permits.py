@@ -0,0 +1,37 @@
+"""Measures the number of authorization checks per second.
+
+Usage::
+
+    $ python benchmarks/permits.py [nb_checks]
+"""
+import sys
+
+from pyramid.security import Authenticated
+
+from daybed.acl import (DaybedAuthorizationPolicy, compile_policy,
+                        POLICY_READONLY)
+from memory_records import measure
+
+
+def main(nb_checks=20000):
+    permits = DaybedAuthorizationPolicy().permits
+    masks = compile_policy(POLICY_READONLY)
+
+    class Context(object):
+        model_id = 'modelname'
+
+        class db(object):
+            @staticmethod
+            def get_model_policy_masks(model_id):
+                return masks
+
+    context = Context()
+    principals = ['Alexis', Authenticated, 'group:admins', 'role:admins']
+    measure('permits()',
+            lambda: [permits(context, principals, 'put_record')
+                     for i in range(nb_checks)],
+            nb_checks, unit='checks')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
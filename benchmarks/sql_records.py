@@ -0,0 +1,33 @@
+"""Measures the records listing throughput of the SQL backend.
+
+Usage::
+
+    $ python benchmarks/sql_records.py [nb_records] [db_url]
+
+The database is an in-memory SQLite one by default.
+"""
+import sys
+
+from pyramid import testing
+
+from daybed.backends.sql import SQLBackend
+from memory_records import fill_database, run
+
+
+def main(nb_records=100000, db_url='sqlite://:memory:'):
+    config = testing.setUp(settings={
+        'backend.db_url': db_url,
+        'daybed.id_generator': 'daybed.backends.id_generators.UUID4Generator'
+    })
+    backend = SQLBackend(config)
+    backend.delete_db()
+    db = fill_database(backend.db(), nb_records)
+    run(db, nb_records)
+    backend.delete_db()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args:
+        args[0] = int(args[0])
+    main(*args)
@@ -16,8 +16,6 @@ import json
 import six
 from cornice import Service
 from pyramid.config import Configurator
-from pyramid.events import NewRequest
-from pyramid.renderers import JSONP
 from pyramid.authentication import (
     AuthTktAuthenticationPolicy, BasicAuthAuthenticationPolicy
 )
@@ -37,9 +35,12 @@ from daybed.acl import (
     check_api_token,
     POLICY_READONLY, POLICY_ANONYMOUS, POLICY_ADMINONLY
 )
+from daybed.backends.cached import CachedDatabase
 from daybed.backends.exceptions import PolicyAlreadyExist, UserNotFound
 from daybed.views.errors import unauthorized_view
-from daybed.renderers import GeoJSON
+from daybed.renderers import GeoJSON, JSONP
+from daybed.schemas.validators import RecordValidatorCache
+from daybed.views.cache import TilesCache
 
 
 def home(request):
@@ -50,6 +51,14 @@ def home(request):
     return {'user': user}
 
 
+def get_db(request):
+    """Returns the database of the request, built when first used."""
+    backend = request.registry.backend
+    db = backend.db()
+    backend.policies.refresh(db)
+    return CachedDatabase(db, backend.policies)
+
+
 def get_user(request):
     userid = unauthenticated_userid(request)
     return request.db.get_user(userid)
@@ -137,9 +146,7 @@ def main(global_config, **settings):
     backend_class = config.maybe_dotted(settings['daybed.backend'])
     config.registry.backend = backend = backend_class(config)
 
-    def add_db_to_request(event):
-        event.request.db = config.registry.backend.db()
-    config.add_subscriber(add_db_to_request, NewRequest)
+    config.add_request_method(get_db, 'db', reify=True)
 
     config.add_renderer('jsonp', JSONP(param_name='callback'))
 
@@ -156,5 +163,13 @@ def main(global_config, **settings):
     config.registry.default_policy = settings.get('daybed.default_policy',
                                                   'read-only')
 
+    # Compiled record schemas cache
+    cache_size = settings.get('daybed.validators_cache_size', 128)
+    config.registry.record_validators = RecordValidatorCache(int(cache_size))
+
+    # Rendered map tiles cache
+    tiles_cache_size = settings.get('daybed.tiles_cache_size', 512)
+    config.registry.tiles_cache = TilesCache(int(tiles_cache_size))
+
     config.add_renderer('geojson', GeoJSON())
     return config.make_wsgi_app()
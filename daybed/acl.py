@@ -78,29 +78,16 @@ class DaybedAuthorizationPolicy(object):
         """Returns True or False depending if the user with the specified
         principals has access to the given permission.
         """
-        allowed = 0
-        permissions_required = VIEWS_PERMISSIONS_REQUIRED[permission]
-        mask = get_binary_mask(permissions_required)
-
         if context.model_id:
             try:
-                policy = context.db.get_model_policy(context.model_id)
+                masks = context.db.get_model_policy_masks(context.model_id)
             except ModelNotFound:
                 #  In case the model doesn't exist, you have access to it.
                 return True
         else:
-            policy = context.db.get_policy(context.default_policy)
-
-        for role, permissions_given in policy.items():
-            permissions = get_binary_mask(permissions_given)
-            if role in principals:
-                allowed |= permissions
+            masks = context.db.get_policy_masks(context.default_policy)
 
-        logger.debug("(%s, %s) => %x & %x = %x" % (permission, principals,
-                                                   allowed, mask,
-                                                   allowed & mask))
-        result = (allowed & mask) == mask
-        return result
+        return is_permitted(permission, principals, masks)
 
     def principals_allowed_by_permission(self, context, permission):
         raise NotImplementedError()  # PRAGMA NOCOVER
@@ -135,15 +122,64 @@ def get_binary_mask(permission):
     return result
 
 
+def compile_policy(policy):
+    """Returns the binary mask of each role of the specified policy, as a
+    ``dict``.
+    """
+    return dict((role, get_binary_mask(permissions))
+                for role, permissions in policy.items()
+                if isinstance(permissions, dict))
+
+
+#: Binary mask of the permissions required by each view.
+VIEWS_PERMISSIONS_MASKS = compile_policy(VIEWS_PERMISSIONS_REQUIRED)
+
+
+def is_permitted(permission, principals, masks):
+    """Returns True if the specified principals are given the permission by
+    the roles binary masks of a policy (see :func:`compile_policy`).
+    """
+    allowed = 0
+    mask = VIEWS_PERMISSIONS_MASKS[permission]
+
+    for role in set(principals).intersection(masks):
+        allowed |= masks[role]
+
+    logger.debug("(%s, %s) => %x & %x = %x", permission, principals,
+                 allowed, mask, allowed & mask)
+    return (allowed & mask) == mask
+
+
+def role_principals(user, groups, roles):
+    """Returns the ``role:<name>`` principals of the user, from the roles
+    of a model.
+
+    :param groups: the ``group:<name>`` principals of the user.
+    """
+    principals = set()
+    for role_name, accredited in roles.items():
+        for acc in accredited:
+            if acc.startswith('group:'):
+                if acc in groups:
+                    principals.add(u'role:%s' % role_name)
+            elif user == acc:
+                principals.add(u'role:%s' % role_name)
+    return principals
+
+
 class RootFactory(object):
     def __init__(self, request):
-        self.db = request.db
         self.default_policy = request.registry.default_policy
         matchdict = request.matchdict or {}
         self.model_id = matchdict.get('model_id')
         self.record_id = matchdict.get('record_id')
         self.request = request
 
+    @property
+    def db(self):
+        # The database is only built if a permission is checked.
+        return self.request.db
+
 
 def build_user_principals(user, request):
     """Returns the principals for an user.
@@ -168,16 +204,7 @@ def build_user_principals(user, request):
             roles = request.db.get_roles(model_id)
         except ModelNotFound:
             roles = {}
-
-        for role_name, accredited in roles.items():
-            for acc in accredited:
-                if acc.startswith('group:'):
-                    for group in groups:
-                        if group == acc:
-                            principals.add(u'role:%s' % role_name)
-                else:
-                    if user == acc:
-                        principals.add(u'role:%s' % role_name)
+        principals |= role_principals(user, groups, roles)
 
     if record_id is not None:
         try:
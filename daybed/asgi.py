@@ -0,0 +1,350 @@
+"""ASGI entry point, requiring Python 3.6.
+
+Records, single records and models definitions are read with the
+asynchronous database of the backend (see :mod:`daybed.backends.aio`), so
+that a single process can keep many backend requests in flight. Those
+requests are served without the WSGI application, as long as their
+response is a plain success (anonymous or Basic authenticated user, no
+query string, no CORS...), with the ``ETag`` of the WSGI response.
+
+Every other request is handed to the WSGI application, in a thread pool::
+
+    $ DAYBED_INI=conf/production.ini uvicorn --factory daybed.asgi:from_environ
+"""
+import asyncio
+import base64
+import binascii
+import io
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from pyramid.paster import get_appsettings, setup_logging
+from pyramid.security import Authenticated, Everyone
+
+import daybed
+from daybed.acl import is_permitted, role_principals
+from daybed.backends.aio import async_database
+from daybed.backends.exceptions import (
+    ModelNotFound, RecordNotFound, UserNotFound, PolicyNotFound
+)
+from daybed.views.cache import revision_etag
+
+
+ROUTE = re.compile(r'^/models/(?P<model_id>[^/]+)/'
+                   r'(?:(?P<definition>definition)|records'
+                   r'(?:/(?P<record_id>[^/]+))?)$')
+
+# Headers which can change the WSGI response of a read.
+FALLBACK_HEADERS = (b'cookie', b'origin', b'if-none-match',
+                    b'if-modified-since')
+
+
+class Fallback(Exception):
+    """Raised when a request has to be served by the WSGI application."""
+
+
+class DaybedASGI(object):
+    """ASGI application serving the reads natively, and the other requests
+    with the WSGI application.
+
+    :param chunk_size: number of records sent per chunk in listings.
+    """
+    chunk_size = 100
+
+    def __init__(self, wsgi_app, threads=20):
+        self.wsgi_app = wsgi_app
+        registry = wsgi_app.registry
+        self.backend = registry.backend
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.db = async_database(self.backend, self.executor)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            try:
+                await self.handle(scope, send)
+            except Fallback:
+                await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.db.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, send):
+        """Serves the reads of records and definitions, or raises
+        :class:`Fallback`.
+        """
+        match = ROUTE.match(scope['path'])
+        headers = dict(scope['headers'])
+        if (scope['method'] != 'GET' or match is None or
+                scope.get('root_path') or scope.get('query_string') or
+                any(name in headers for name in FALLBACK_HEADERS)):
+            raise Fallback()
+
+        model_id, record_id = match.group('model_id', 'record_id')
+        if match.group('definition'):
+            permission = 'get_definition'
+        elif record_id is not None:
+            permission = 'get_record'
+        else:
+            # Without an explicit Accept header, records are GeoJSON.
+            if headers.get(b'accept') != b'application/json':
+                raise Fallback()
+            permission = 'get_records'
+
+        try:
+            model = await self.db.get_model(model_id)
+            record = None
+            if record_id is not None:
+                # A single document gives the data, authors and revision.
+                record = await self.db.get_record_document(model_id,
+                                                           record_id)
+            principals = await self.principals(headers, model['roles'],
+                                               record)
+            masks = await self.policy_masks(model['policy_id'])
+            if not is_permitted(permission, principals, masks):
+                raise Fallback()
+
+            # The revision is read first, as by the WSGI views.
+            if permission == 'get_record':
+                revision = record['revision']
+            else:
+                revision = await self.db.get_model_revision(model_id)
+            etag = revision_etag(
+                revision, u'', headers.get(b'accept', b'').decode('latin-1'))
+
+            if permission == 'get_definition':
+                await self.send_json(send, model['definition'], etag)
+            elif permission == 'get_record':
+                await self.send_json(send, record['data'], etag)
+            else:
+                await self.send_records(send, model_id, etag)
+        except (ModelNotFound, RecordNotFound, UserNotFound,
+                PolicyNotFound):
+            raise Fallback()
+
+    async def principals(self, headers, roles, record):
+        """Returns the principals of the user, as built by
+        :func:`daybed.acl.check_api_token`.
+
+        Requests with other authentications, or with wrong credentials,
+        are left to the WSGI application.
+        """
+        authorization = headers.get(b'authorization')
+        if authorization is None:
+            return set([Everyone])
+
+        try:
+            scheme, credentials = authorization.split(b' ', 1)
+            if scheme.lower() != b'basic':
+                raise ValueError(scheme)
+            credentials = base64.b64decode(credentials.strip())
+            username, password = credentials.decode('utf-8').split(':', 1)
+        except (ValueError, binascii.Error):
+            raise Fallback()
+
+        user = await self.db.get_user(username)
+        if user['apitoken'] != password:
+            raise Fallback()
+
+        groups = [u'group:%s' % g for g in user['groups']]
+        principals = set([Everyone, Authenticated, username])
+        principals |= set(groups)
+        principals |= role_principals(username, groups, roles)
+        if record is not None:
+            if username in record['authors']:
+                principals.add('authors:')
+        return principals
+
+    async def policy_masks(self, policy_id):
+        """Returns the compiled policy, from the backend policies cache."""
+        policies = self.backend.policies
+        if policies.shared:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self.executor, policies.refresh,
+                                       self.backend.db())
+        generation = policies.generation
+        cached = policies.peek(policy_id)
+        if cached is None:
+            policy = await self.db.get_policy(policy_id)
+            cached = policies.add(policy_id, policy, generation)
+        return cached[1]
+
+    async def send_json(self, send, value, etag):
+        body = json.dumps(value).encode('utf-8')
+        headers = [(b'content-type', b'application/json'),
+                   (b'content-length', b'%d' % len(body))]
+        await send({'type': 'http.response.start',
+                    'status': 200,
+                    'headers': headers + cache_headers(etag)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def send_records(self, send, model_id, etag):
+        """Streams the records, in the format of the ``jsonp`` renderer."""
+        headers = [(b'content-type', b'application/json')]
+        await send({'type': 'http.response.start',
+                    'status': 200,
+                    'headers': headers + cache_headers(etag)})
+        chunk = ['{"data": [']
+        separator = ''
+        i = 0
+        async for record in self.db.iter_records(model_id):
+            chunk.append(separator)
+            chunk.append(json.dumps(record))
+            separator = ', '
+            i += 1
+            if i % self.chunk_size == 0:
+                await send({'type': 'http.response.body',
+                            'body': ''.join(chunk).encode('utf-8'),
+                            'more_body': True})
+                chunk = []
+        chunk.append(']}')
+        await send({'type': 'http.response.body',
+                    'body': ''.join(chunk).encode('utf-8')})
+
+    async def call_wsgi(self, scope, receive, send):
+        """Runs the WSGI application in the thread pool, and sends its body
+        chunk by chunk as it is produced (e.g. streamed listings).
+        """
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        environ = wsgi_environ(scope, b''.join(body))
+        loop = asyncio.get_event_loop()
+        status, headers, body, chunk = await loop.run_in_executor(
+            self.executor, start_wsgi, self.wsgi_app, environ)
+        try:
+            await send({'type': 'http.response.start',
+                        'status': int(status.split(' ', 1)[0]),
+                        'headers': [(name.lower().encode('latin-1'),
+                                     value.encode('latin-1'))
+                                    for name, value in headers]})
+            while chunk is not None:
+                await send({'type': 'http.response.body',
+                            'body': chunk,
+                            'more_body': True})
+                chunk = await loop.run_in_executor(self.executor, body.next)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await loop.run_in_executor(self.executor, body.close)
+
+
+def cache_headers(etag):
+    """Returns the caching headers of a response, as set by
+    :func:`daybed.views.cache.not_modified`.
+    """
+    return [(b'etag', b'"%s"' % etag.encode('ascii')),
+            (b'cache-control', b'no-cache')]
+
+
+def wsgi_environ(scope, body):
+    """Builds the WSGI environ of an ASGI HTTP request."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else 'HTTP_%s' % name
+        if key in environ:
+            value = '%s,%s' % (environ[key], value)
+        environ[key] = value
+    return environ
+
+
+class WSGIBody(object):
+    """Body of a WSGI response, read chunk by chunk. Its methods block:
+    they are run in the thread pool.
+    """
+
+    def __init__(self, app_iter):
+        self._app_iter = app_iter
+        self._chunks = iter(app_iter)
+
+    def next(self):
+        """Returns the next non-empty chunk, or ``None`` at the end."""
+        for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return None
+
+    def close(self):
+        if hasattr(self._app_iter, 'close'):
+            self._app_iter.close()
+
+
+def start_wsgi(app, environ):
+    """Calls the WSGI application and returns its status, headers, body and
+    the first chunk of the body (``None`` if it is empty).
+
+    The first chunk is read before returning, since an application may
+    call ``start_response`` only once its body is iterated.
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = headers
+
+    body = WSGIBody(app(environ, start_response))
+    try:
+        chunk = body.next()
+    except Exception:
+        body.close()
+        raise
+    return response['status'], response['headers'], body, chunk
+
+
+def main(global_config, **settings):
+    """Returns the ASGI application, configured like :func:`daybed.main`.
+
+    The size of the thread pool is specified by the ``daybed.asgi_threads``
+    setting.
+    """
+    threads = int(settings.get('daybed.asgi_threads', 20))
+    return DaybedASGI(daybed.main(global_config, **settings), threads)
+
+
+def from_environ():
+    """Returns the ASGI application of the configuration file specified by
+    the ``DAYBED_INI`` environment variable.
+    """
+    config_uri = os.environ.get('DAYBED_INI', 'conf/production.ini')
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    return main(settings.global_conf, **settings)
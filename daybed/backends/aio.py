@@ -0,0 +1,88 @@
+"""Asynchronous variant of the backends ``Database`` interface.
+
+Every method of a database is available as a coroutine, and records can be
+iterated asynchronously::
+
+    db = async_database(backend, executor)
+    definition = await db.get_model_definition(model_id)
+    async for record in db.iter_records(model_id):
+        ...
+
+This module requires Python 3.6.
+"""
+import asyncio
+import functools
+
+
+class DirectDatabase(object):
+    """Wraps a database which never blocks (e.g. the memory one): its
+    methods are called directly by the coroutines.
+    """
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        method = getattr(self._db, name)
+
+        @functools.wraps(method)
+        async def coroutine(*args, **kwargs):
+            return method(*args, **kwargs)
+        return coroutine
+
+    async def iter_records(self, model_id):
+        """Yields the records of a model one by one, ordered by id."""
+        for record in self._db.iter_records(model_id):
+            yield record
+
+    async def close(self):
+        pass
+
+
+class ThreadedDatabase(object):
+    """Wraps a blocking database: its methods are run by the threads of
+    the specified ``concurrent.futures`` executor.
+    """
+    def __init__(self, db, executor=None):
+        self._db = db
+        self._executor = executor
+
+    def __getattr__(self, name):
+        method = getattr(self._db, name)
+
+        @functools.wraps(method)
+        async def coroutine(*args, **kwargs):
+            loop = asyncio.get_event_loop()
+            call = functools.partial(method, *args, **kwargs)
+            return await loop.run_in_executor(self._executor, call)
+        return coroutine
+
+    async def iter_records(self, model_id, batch_size=None):
+        """Yields the records of a model one by one, ordered by id.
+
+        Records are fetched by batches of ``batch_size``, in the executor.
+        """
+        batch_size = batch_size or getattr(self._db, 'batch_size', 1000)
+        start = None
+        while True:
+            records = await self.get_records(model_id, limit=batch_size,
+                                             start=start)
+            for record in records:
+                yield record
+            if len(records) < batch_size:
+                break
+            start = records[-1]['id']
+
+    async def close(self):
+        pass
+
+
+def async_database(backend, executor=None):
+    """Returns the asynchronous database of the specified backend.
+
+    Backends providing an ``async_db(executor)`` method use their own
+    implementation, the blocking database of the other ones is run in the
+    executor.
+    """
+    if hasattr(backend, 'async_db'):
+        return backend.async_db(executor)
+    return ThreadedDatabase(backend.db(), executor)
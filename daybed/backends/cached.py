@@ -0,0 +1,203 @@
+import threading
+
+from daybed.acl import compile_policy
+from daybed.backends.exceptions import (
+    UserNotFound, ModelNotFound, PolicyNotFound, RecordNotFound
+)
+
+
+class PoliciesCache(object):
+    """Process-wide cache of policies, along with the binary mask of each of
+    their roles.
+
+    Policies almost never change: it is shared by all requests, and emptied
+    when a policy is modified (see :class:`CachedDatabase`) or when the
+    backend notifies a change.
+
+    Each invalidation starts a new generation of the cache: policies fetched
+    during a previous generation may be outdated, and are not cached.
+
+    :param shared: whether the backend is shared by several processes, its
+                   databases giving the revision of the policies, which
+                   changes whenever a process modifies them (see
+                   :meth:`refresh`).
+    """
+
+    def __init__(self, shared=False):
+        self._policies = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.shared = shared
+        self._revision = None
+
+    def refresh(self, db):
+        """Empties the cache if the policies were modified by another
+        process since the previous call, according to the specified
+        database. Called once per request.
+        """
+        if not self.shared:
+            return
+        revision = db.get_policies_revision()
+        if revision != self._revision:
+            self.invalidate()
+            self._revision = revision
+
+    def get(self, policy_name, fetch):
+        """Returns the ``(policy, masks)`` tuple of the specified policy.
+
+        :param fetch: function returning the policy if it is not cached.
+        """
+        generation = self.generation
+        cached = self.peek(policy_name)
+        if cached is None:
+            cached = self.add(policy_name, fetch(policy_name), generation)
+        return cached
+
+    def peek(self, policy_name):
+        """Returns the ``(policy, masks)`` tuple of the specified policy, or
+        ``None`` if it is not cached.
+        """
+        return self._policies.get(policy_name)
+
+    def add(self, policy_name, policy, generation=None):
+        """Caches the specified policy, and returns its ``(policy, masks)``
+        tuple.
+
+        :param generation: the :attr:`generation` of the cache when the
+                           policy was fetched: it is not cached if the cache
+                           was invalidated since.
+        """
+        cached = (policy, compile_policy(policy))
+        with self._lock:
+            if generation is None or generation == self.generation:
+                self._policies[policy_name] = cached
+        return cached
+
+    def invalidate(self, policy_name=None):
+        """Removes the specified policy from the cache, or all of them."""
+        with self._lock:
+            self.generation += 1
+            if policy_name is None:
+                self._policies.clear()
+            else:
+                self._policies.pop(policy_name, None)
+
+
+def _invalidates(name):
+    """Returns a method which empties the cache before calling the wrapped
+    database method of the specified name.
+    """
+    def method(self, *args, **kwargs):
+        self._cache.clear()
+        return getattr(self._db, name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+class CachedDatabase(object):
+    """Wraps a backend database, and memoizes the lookups of models and
+    their revisions, policies, users and records.
+
+    It is meant to live as long as a request: the model document is fetched
+    only once, even though it is used by authorization, validation and views,
+    and so is the record document, which gives its data, authors and
+    revision.
+    Any write empties the cache. Other methods are delegated as is.
+
+    :param policies: optional :class:`PoliciesCache`, shared by all
+                     requests, for the lookups of policies.
+    """
+
+    def __init__(self, db, policies=None):
+        self._db = db
+        self._cache = {}
+        self._policies = policies or PoliciesCache()
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def _cached(self, name, *args):
+        key = (name,) + args
+        try:
+            result = self._cache[key]
+        except KeyError:
+            try:
+                result = getattr(self._db, name)(*args)
+            except (UserNotFound, ModelNotFound, PolicyNotFound,
+                    RecordNotFound) as e:
+                result = e
+            self._cache[key] = result
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_model(self, model_id):
+        return self._cached('get_model', model_id)
+
+    def get_model_definition(self, model_id):
+        return self.get_model(model_id)['definition']
+
+    def get_roles(self, model_id):
+        return self.get_model(model_id)['roles']
+
+    def get_model_revision(self, model_id):
+        return self._cached('get_model_revision', model_id)
+
+    def get_model_policy_id(self, model_id):
+        return self.get_model(model_id)['policy_id']
+
+    def get_model_policy(self, model_id):
+        return self.get_policy(self.get_model_policy_id(model_id))
+
+    def get_policy(self, policy_name):
+        return self._policies.get(policy_name, self._db.get_policy)[0]
+
+    def get_policy_masks(self, policy_name):
+        """Returns the binary mask of each role of the specified policy."""
+        return self._policies.get(policy_name, self._db.get_policy)[1]
+
+    def get_model_policy_masks(self, model_id):
+        """Returns the binary mask of each role of the model policy."""
+        return self.get_policy_masks(self.get_model_policy_id(model_id))
+
+    def get_user(self, username):
+        return self._cached('get_user', username)
+
+    def get_groups(self, username):
+        return self.get_user(username)['groups']
+
+    def get_record_document(self, model_id, record_id):
+        return self._cached('get_record_document', model_id, record_id)
+
+    def get_record(self, model_id, record_id):
+        return self.get_record_document(model_id, record_id)['data']
+
+    def get_record_authors(self, model_id, record_id):
+        return self.get_record_document(model_id, record_id)['authors']
+
+    def get_record_revision(self, model_id, record_id):
+        return self.get_record_document(model_id, record_id)['revision']
+
+    put_model = _invalidates('put_model')
+    delete_model = _invalidates('delete_model')
+    put_roles = _invalidates('put_roles')
+    add_role = _invalidates('add_role')
+    put_record = _invalidates('put_record')
+    put_records = _invalidates('put_records')
+    replace_records = _invalidates('replace_records')
+    delete_record = _invalidates('delete_record')
+    delete_records = _invalidates('delete_records')
+    add_user = _invalidates('add_user')
+    add_group = _invalidates('add_group')
+
+    def set_policy(self, policy_name, policy):
+        try:
+            return self._db.set_policy(policy_name, policy)
+        finally:
+            self._policies.invalidate(policy_name)
+
+    def delete_policy(self, policy_name):
+        try:
+            return self._db.delete_policy(policy_name)
+        finally:
+            self._policies.invalidate(policy_name)
@@ -0,0 +1,288 @@
+"""Asynchronous CouchDB database, using aiohttp.
+
+Reads and records writes are sent with non-blocking HTTP requests, the
+other (rare) operations are delegated to the blocking database.
+"""
+import json
+from urllib.parse import quote
+
+import aiohttp
+
+from daybed import logger
+from daybed.backends.exceptions import (
+    UserNotFound, ModelNotFound, PolicyNotFound, RecordNotFound
+)
+from .database import user_id, policy_id
+from .views import model_revision
+
+
+RECORDS_VIEW = '_design/records/_view/by_model'
+REVISIONS_VIEW = '_design/revisions/_view/by_model'
+
+
+class CouchDBError(Exception):
+    pass
+
+
+class AsyncDatabase(object):
+    """Object handling the asynchronous connections to the couchdb server.
+
+    :param url: the URL of the database.
+    :param fallback: the asynchronous wrapper of the blocking database,
+                     used for the methods not implemented here.
+    """
+    def __init__(self, url, generate_id, fallback, batch_size=1000):
+        self.url = url.rstrip('/') + '/'
+        self.generate_id = generate_id
+        self.batch_size = batch_size
+        self._fallback = fallback
+        self._session = None
+
+    def __getattr__(self, name):
+        return getattr(self._fallback, name)
+
+    @property
+    def session(self):
+        # Sessions must be created within the event loop.
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                json_serialize=json.dumps)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, path, params=None, body=None,
+                       allowed=(404,)):
+        """Sends a request to the database and returns the status and the
+        decoded body of the response.
+
+        :param allowed: error statuses returned instead of raising.
+        """
+        if params:
+            # View parameters are JSON values.
+            params = dict((key, json.dumps(value))
+                          for key, value in params.items())
+        async with self.session.request(method, self.url + path,
+                                        params=params,
+                                        json=body) as response:
+            data = await response.json(content_type=None)
+            if response.status >= 400 and response.status not in allowed:
+                raise CouchDBError('%s %s: %s %s' % (method, path,
+                                                     response.status, data))
+            return response.status, data
+
+    async def _get_doc(self, doc_id, doc_type):
+        """Returns the document of the specified id and type, or ``None``.
+        """
+        status, doc = await self._request('GET', quote(doc_id, safe=''))
+        if status == 200 and doc.get('type') == doc_type:
+            return doc
+
+    async def _bulk_docs(self, docs):
+        """Sends the documents with a single ``_bulk_docs`` request, and
+        returns the ids of the stored ones (``None`` for the others).
+        """
+        status, results = await self._request('POST', '_bulk_docs',
+                                              body={'docs': docs})
+        ids = []
+        for result in results:
+            if 'error' in result:
+                logger.error('Record %s could not be saved: %s' % (
+                    result.get('id'), result['error']))
+                ids.append(None)
+            else:
+                ids.append(result['id'])
+        return ids
+
+    async def _get_model(self, model_id):
+        doc = await self._get_doc(model_id, 'definition')
+        if doc is None:
+            raise ModelNotFound(model_id)
+        return doc
+
+    async def get_model(self, model_id):
+        """Returns the model document (definition, roles and policy id)."""
+        return await self._get_model(model_id)
+
+    async def get_model_definition(self, model_id):
+        return (await self._get_model(model_id))['definition']
+
+    async def get_model_revision(self, model_id):
+        """Returns the revision of the model, which changes whenever the
+        model or its records are modified.
+        """
+        status, result = await self._request('GET', REVISIONS_VIEW,
+                                             params={'key': model_id})
+        if not result['rows']:
+            raise ModelNotFound(model_id)
+        return model_revision(result['rows'][0]['value'])
+
+    async def get_roles(self, model_id):
+        return (await self._get_model(model_id))['roles']
+
+    async def get_model_policy_id(self, model_id):
+        return (await self._get_model(model_id))['policy_id']
+
+    async def get_model_policy(self, model_id):
+        return await self.get_policy(await self.get_model_policy_id(model_id))
+
+    async def get_records(self, model_id, limit=None, start=None):
+        """Returns the records of a model, ordered by id.
+
+        :param limit: maximum number of records to return.
+        :param start: if specified, only records whose id follow this one
+                      are returned.
+        """
+        params = dict(startkey=model_id, endkey=model_id, include_docs=True)
+        start_docid = None
+        if start is not None:
+            # The start record is included by CouchDB, if it still exists.
+            start_docid = u'-'.join((model_id, start))
+            params['startkey_docid'] = start_docid
+        if limit is not None:
+            params['limit'] = limit + 1
+
+        status, result = await self._request('GET', RECORDS_VIEW,
+                                             params=params)
+        records = []
+        for row in result['rows']:
+            if row['id'] == start_docid:
+                continue
+            record = row['doc']['data']
+            record['id'] = row['id'][len(model_id) + 1:]
+            records.append(record)
+        return records[:limit]
+
+    async def iter_records(self, model_id, batch_size=None):
+        """Yields the records of a model one by one, ordered by id.
+
+        Records are fetched from the view by batches of ``batch_size``.
+        """
+        batch_size = batch_size or self.batch_size
+        start = None
+        while True:
+            records = await self.get_records(model_id, limit=batch_size,
+                                             start=start)
+            for record in records:
+                yield record
+            if len(records) < batch_size:
+                break
+            start = records[-1]['id']
+
+    async def _get_record(self, model_id, record_id):
+        doc = await self._get_doc(u'-'.join((model_id, record_id)), 'data')
+        if doc is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return doc
+
+    async def get_record(self, model_id, record_id):
+        return (await self._get_record(model_id, record_id))['data']
+
+    async def get_record_authors(self, model_id, record_id):
+        return (await self._get_record(model_id, record_id))['authors']
+
+    async def get_record_revision(self, model_id, record_id):
+        """Returns the revision of the record document."""
+        return (await self._get_record(model_id, record_id))['_rev']
+
+    async def get_record_document(self, model_id, record_id):
+        """Returns the record document (data, authors and revision)."""
+        doc = await self._get_record(model_id, record_id)
+        return {'data': doc['data'], 'authors': doc['authors'],
+                'revision': doc['_rev']}
+
+    async def put_record(self, model_id, record, authors, record_id=None):
+        doc = {
+            'type': 'data',
+            'authors': authors,
+            'model_id': model_id,
+            'data': record}
+
+        if record_id is not None:
+            try:
+                old_doc = await self._get_record(model_id, record_id)
+            except RecordNotFound:
+                pass
+            else:
+                doc['authors'] = list(set(authors) | set(old_doc['authors']))
+                doc['_rev'] = old_doc['_rev']
+        else:
+            record_id = self.generate_id()
+        doc['_id'] = u'-'.join((model_id, record_id))
+
+        await self._request('PUT', quote(doc['_id'], safe=''), body=doc)
+        return record_id
+
+    async def put_records(self, model_id, records, authors):
+        """Creates several records at once, using a single ``_bulk_docs``
+        request, and returns their ids.
+
+        The id of a record which could not be stored is ``None``.
+        """
+        if not records:
+            return []
+
+        created = [self.generate_id() for record in records]
+        docs = [{'_id': u'-'.join((model_id, record_id)),
+                 'type': 'data',
+                 'authors': authors,
+                 'model_id': model_id,
+                 'data': record}
+                for record_id, record in zip(created, records)]
+        stored = await self._bulk_docs(docs)
+        return [record_id if docid is not None else None
+                for record_id, docid in zip(created, stored)]
+
+    async def delete_record(self, model_id, record_id):
+        doc = await self._get_record(model_id, record_id)
+        await self._request('DELETE', quote(doc['_id'], safe=''),
+                            params={'rev': doc['_rev']})
+        return doc
+
+    async def delete_records(self, model_id):
+        """Deletes all the records of a model, by batches of ``batch_size``
+        documents sent in a single ``_bulk_docs`` request.
+
+        Returns the number of deleted records.
+        """
+        params = dict(startkey=model_id, endkey=model_id,
+                      limit=self.batch_size)
+        deleted = 0
+        while True:
+            status, result = await self._request('GET', RECORDS_VIEW,
+                                                 params=params)
+            rows = result['rows']
+            docs = [{'_id': row['id'], '_rev': row['value'],
+                     '_deleted': True}
+                    for row in rows
+                    if row['id'] != params.get('startkey_docid')]
+            if docs:
+                stored = await self._bulk_docs(docs)
+                deleted += len([docid for docid in stored if docid])
+            if len(rows) < self.batch_size or not docs:
+                break
+            params['startkey_docid'] = rows[-1]['id']
+        return deleted
+
+    async def _get_user(self, username):
+        doc = await self._get_doc(user_id(username), 'user')
+        if doc is None:
+            raise UserNotFound(username)
+        return doc
+
+    async def get_user(self, username):
+        """Returns the information associated with an user"""
+        return (await self._get_user(username))['user']
+
+    async def get_groups(self, username):
+        """Return the groups for a specific user"""
+        return (await self.get_user(username))['groups']
+
+    async def get_policy(self, policy_name):
+        doc = await self._get_doc(policy_id(policy_name), 'policy')
+        if doc is None:
+            raise PolicyNotFound(policy_name)
+        return doc['policy']
@@ -1,13 +1,22 @@
 import os
 import socket
+import threading
+import time
 
 from couchdb.client import Server
 from couchdb.http import PreconditionFailed
 from couchdb.design import ViewDefinition
+from pyramid.settings import asbool
+from six.moves.urllib.parse import quote
 
 from daybed import logger
-from .views import docs
-from .database import Database
+from daybed.backends.cached import PoliciesCache
+from . import pool
+from .views import docs, policy_definitions, sync_model_indexes
+from .database import Database, policy_id
+
+
+POLICY_PREFIX = policy_id('')
 
 
 class CouchDBBackendConnectionError(Exception):
@@ -16,19 +25,40 @@ class CouchDBBackendConnectionError(Exception):
 
 class CouchDBBackend(object):
     def db(self):
-        return Database(self.server[self.db_name], self._generate_id)
+        # The database handle is thread-safe, and shared by the requests.
+        return self._db
+
+    def async_db(self, executor=None):
+        """Returns an asynchronous database (requires aiohttp)."""
+        from daybed.backends.aio import ThreadedDatabase
+        from .aio import AsyncDatabase
+        host = self.config.registry.settings['backend.db_host']
+        url = '%s/%s' % (host.rstrip('/'), quote(self.db_name, safe=''))
+        return AsyncDatabase(url, self._generate_id,
+                             ThreadedDatabase(self.db(), executor),
+                             batch_size=self.batch_size)
 
     def __init__(self, config):
         settings = config.registry.settings
 
         self.config = config
-        self.server = Server(settings['backend.db_host'])
+        timeout = settings.get('backend.timeout')
+        session = pool.session(
+            timeout=float(timeout) if timeout else None,
+            pool_size=int(settings.get('backend.pool_size', 10)),
+            keep_alive=asbool(settings.get('backend.keep_alive', 'true')),
+            retries=int(settings.get('backend.retries', 1)),
+            retry_delay=float(settings.get('backend.retry_delay', 0)))
+        self.server = Server(settings['backend.db_host'], session=session)
         self.db_name = os.environ.get('DB_NAME', settings['backend.db_name'])
+        self.batch_size = int(settings.get('backend.batch_size', 1000))
 
         # model id generator
         generator = config.maybe_dotted(settings['daybed.id_generator'])
         self._generate_id = generator(config)
 
+        self.policies = PoliciesCache()
+
         try:
             self.create_db_if_not_exist()
         except socket.error as e:
@@ -37,9 +67,45 @@ class CouchDBBackend(object):
                     settings['backend.db_host'], e))
 
         self.sync_views()
+        self._db = Database(self.server[self.db_name], self._generate_id,
+                            batch_size=self.batch_size)
+
+        follow = settings.get('backend.follow_changes', 'true')
+        if asbool(follow):
+            thread = threading.Thread(target=self.follow_changes,
+                                      name='daybed-changes')
+            thread.daemon = True
+            thread.start()
+
+    def pool_stats(self):
+        """Returns the utilization of the HTTP connections pool (see
+        :meth:`daybed.backends.couchdb.pool.ConnectionPool.stats`).
+        """
+        return self.server.resource.session.connection_pool.stats()
 
     def delete_db(self):
         del self.server[self.db_name]
+        self.policies.invalidate()
+
+    def follow_changes(self, retry_delay=5):
+        """Follows the database changes feed, in order to empty the policies
+        cache when policies are modified by other processes.
+        """
+        since = 'now'
+        while True:
+            try:
+                db = self.server[self.db_name]
+                changes = db.changes(feed='continuous', since=since,
+                                     heartbeat=30000)
+                for change in changes:
+                    since = change.get('seq', since)
+                    doc_id = change.get('id', '')
+                    if doc_id.startswith(POLICY_PREFIX):
+                        policy_name = doc_id[len(POLICY_PREFIX):]
+                        self.policies.invalidate(policy_name)
+            except Exception as e:
+                logger.error('Changes feed interrupted: %s' % e)
+                time.sleep(retry_delay)
 
     def create_db_if_not_exist(self):
         try:
@@ -49,4 +115,10 @@ class CouchDBBackend(object):
             logger.info('Using db "%s".' % self.db_name)
 
     def sync_views(self):
-        ViewDefinition.sync_many(self.server[self.db_name], docs)
+        db = self.server[self.db_name]
+        ViewDefinition.sync_many(db, docs)
+        # Secondary indexes declared by the models definitions.
+        for row in policy_definitions(db, reduce=False, include_docs=True):
+            definition = row.doc['definition']
+            if definition.get('indexes'):
+                sync_model_indexes(db, row.id, definition)
@@ -1,43 +1,297 @@
+from couchdb.http import ResourceConflict
+
+from daybed import logger
 from . import views
 from daybed.backends.exceptions import (
     UserAlreadyExist, UserNotFound, ModelNotFound,
     PolicyNotFound, PolicyAlreadyExist, RecordNotFound
 )
+from daybed.backends.filters import (choose_index, filter_records,
+                                     index_ranges, matches)
+from daybed.backends.sorting import project, sort_index, sort_records
+from daybed.backends.spatial import (cells_range, nearest_records,
+                                     search_nearest, spatial_indexes)
+
+
+# Users and policies ids contain a slash, which models and records ids
+# cannot contain (they are segments of the URLs paths): they cannot be the
+# ids of models or records documents.
+
+def user_id(username):
+    """Returns the document id of the specified user."""
+    return u'user/%s' % username
+
+
+def policy_id(policy_name):
+    """Returns the document id of the specified policy."""
+    return u'policy/%s' % policy_name
 
 
 class Database(object):
     """Object handling all the connections to the couchdb server."""
 
-    def __init__(self, db, generate_id):
+    def __init__(self, db, generate_id, batch_size=1000):
         self._db = db
         self.generate_id = generate_id
+        self.batch_size = batch_size
+
+    def __get_doc(self, doc_id, doc_type):
+        """Returns the document of the specified id and type, or ``None``.
+        """
+        doc = self._db.get(doc_id)
+        if doc is not None and doc.get('type') == doc_type:
+            return doc
 
     def __get_model(self, model_id):
-        try:
-            doc = views.model_definitions(self._db)[model_id].rows[0]
-            return doc.value
-        except IndexError:
+        doc = self.__get_doc(model_id, 'definition')
+        if doc is None:
             raise ModelNotFound(model_id)
+        return doc
+
+    def get_model(self, model_id):
+        """Returns the model document (definition, roles and policy id)."""
+        return self.__get_model(model_id)
 
     def get_model_definition(self, model_id):
         return self.__get_model(model_id)['definition']
 
-    def __get_records(self, model_id):
-        return views.records(self._db)[model_id]
+    def get_model_revision(self, model_id):
+        """Returns the revision of the model, which changes whenever the
+        model or its records are modified.
+
+        It is read from the reduced :data:`views.revisions` view: writes
+        do not have to update any document.
+        """
+        rows = list(views.revisions(self._db, key=model_id))
+        if not rows:
+            raise ModelNotFound(model_id)
+        return views.model_revision(rows[0].value)
+
+    def get_records(self, model_id, limit=None, start=None, filters=None,
+                    fields=None):
+        """Returns the records of a model, ordered by id.
+
+        :param limit: maximum number of records to return.
+        :param start: if specified, only records whose id follow this one
+                      are returned.
+        :param filters: if specified, only records matching them are
+                        returned (see :mod:`daybed.backends.filters`).
+        :param fields: if specified, only these fields of the records are
+                       returned, with their id.
+        """
+        if filters:
+            records = self.__indexed_records(model_id, filters)
+            if records is None:
+                records = filter_records(self.get_records, model_id,
+                                         filters, limit, start,
+                                         self.batch_size)
+            else:
+                records = [record for record in records
+                           if (start is None or record['id'] > start) and
+                           matches(record, filters)][:limit]
+            return [project(record, fields) for record in records]
+
+        options = dict(startkey=model_id, endkey=model_id, include_docs=True)
+        start_docid = None
+        if start is not None:
+            # The start record is included by CouchDB, if it still exists.
+            start_docid = u'-'.join((model_id, start))
+            options['startkey_docid'] = start_docid
+        if limit is not None:
+            options['limit'] = limit + 1
 
-    def get_records(self, model_id):
         records = []
-        for item in self.__get_records(model_id):
-            item.value['data']['id'] = item.value['_id'].split('-')[1]
-            records.append(item.value['data'])
+        for item in views.records(self._db, **options):
+            if item.id == start_docid:
+                continue
+            item.doc['data']['id'] = item.id[len(model_id) + 1:]
+            records.append(project(item.doc['data'], fields))
+        return records[:limit]
+
+    def __indexed_records(self, model_id, filters):
+        """Returns the records which may match the filters, read from a
+        secondary index of the model and ordered by id, or ``None`` if none
+        of the indexes of the model can be used.
+
+        Without a declared index, the records are read from the fields
+        index of the model (see :meth:`__field_docs`).
+        """
+        definition = self.__get_model(model_id)['definition']
+        geometries = spatial_indexes(definition)
+        for field, operator, box in filters:
+            if operator == 'bbox' and field in geometries:
+                docs = self.__spatial_docs(model_id, field, box)
+                break
+        else:
+            indexes = [fields for fields in definition.get('indexes', [])
+                       if len(fields) > 1 or fields[0] not in geometries]
+            fields, ranges = choose_index(indexes, filters)
+            if fields is None:
+                docs = self.__field_docs(model_id, definition, filters)
+                if docs is None:
+                    return None
+            else:
+                index = views.model_index(model_id, fields)
+                docs = {}
+                for start, end in ranges:
+                    # Keys are arrays: {} follows all the keys beginning
+                    # with end.
+                    for row in index(self._db, startkey=list(start),
+                                     endkey=list(end) + [{}],
+                                     include_docs=True):
+                        docs[row.id] = row.doc
+        records = []
+        for docid in sorted(docs):
+            record = docs[docid]['data']
+            record['id'] = docid[len(model_id) + 1:]
+            records.append(record)
         return records
 
+    def __field_docs(self, model_id, definition, filters):
+        """Returns the records documents which may match the filters, read
+        from the fields index of the model with the most selective filter,
+        by document id, or ``None`` if no filter can use it.
+        """
+        fields = views.indexed_fields(definition)
+        # Operators from the most selective.
+        for operators in (('eq', 'contains'), ('in',), ('prefix',),
+                          ('gt', 'lt')):
+            conditions = [condition for condition in filters
+                          if condition[1] in operators and
+                          condition[0] in fields]
+            if conditions:
+                break
+        else:
+            return None
+
+        field, operator, value = conditions[0]
+        if operator == 'contains':
+            ranges = [((value,), (value,))]
+        else:
+            ranges = index_ranges([field], [condition
+                                            for condition in conditions
+                                            if condition[0] == field])
+
+        index = views.fields_index(model_id, fields)
+        docs = {}
+        for start, end in ranges:
+            for row in index(self._db, startkey=[field] + list(start),
+                             endkey=[field] + list(end) + [{}],
+                             include_docs=True):
+                docs[row.id] = row.doc
+        return docs
+
+    def __spatial_docs(self, model_id, field, box):
+        """Returns the records documents referenced by the cells of the
+        spatial index of a field covered by a box, by document id.
+        """
+        index = views.spatial_index(model_id, field)
+        (x0, y0), (x1, y1) = cells_range(box)
+        # Rows of the columns between the first and last cells.
+        rows = [row for row in index(self._db, startkey=[x0, y0],
+                                     endkey=[x1, y1], include_docs=True)
+                if y0 <= row.key[1] <= y1]
+        rows.extend(index(self._db, key=None, include_docs=True))
+        return dict((row.id, row.doc) for row in rows)
+
+    def iter_records(self, model_id, batch_size=None, filters=None,
+                     fields=None):
+        """Yields the records of a model one by one, ordered by id.
+
+        Records are fetched from the view by batches of ``batch_size``,
+        or from a secondary index if the filters can use one.
+        """
+        if filters:
+            records = self.__indexed_records(model_id, filters)
+            if records is not None:
+                for record in records:
+                    if matches(record, filters):
+                        yield project(record, fields)
+                return
+
+        batch_size = batch_size or self.batch_size
+        start = None
+        while True:
+            records = self.get_records(model_id, limit=batch_size,
+                                       start=start)
+            for record in records:
+                if not filters or matches(record, filters):
+                    yield project(record, fields)
+            if len(records) < batch_size:
+                break
+            start = records[-1]['id']
+
+    def get_sorted_records(self, model_id, sort, limit=None, offset=0,
+                           filters=None, fields=None):
+        """Returns the records of a model in the specified sort (see
+        :mod:`daybed.backends.sorting`), skipping the first ``offset`` ones.
+
+        Records are read in order from the secondary index of the sorted
+        fields if it is declared, unless the filters can use an index.
+        """
+        definition = self.__get_model(model_id)['definition']
+        index = sort_index(definition.get('indexes', []), sort)
+        records = None
+        if filters:
+            records = self.__indexed_records(model_id, filters)
+            if records is not None:
+                records = [record for record in records
+                           if matches(record, filters)]
+        if records is None and index is None:
+            records = self.iter_records(model_id, filters=filters)
+        if records is not None:
+            records = sort_records(records, sort, limit, offset)
+            return [project(record, fields) for record in records]
+
+        view = views.model_index(model_id, index)
+        batch_size = self.batch_size
+        options = dict(include_docs=True, descending=sort[0][1])
+        if not filters:
+            # Records are skipped and counted by CouchDB.
+            options['skip'] = offset
+            offset = 0
+            if limit is not None:
+                batch_size = min(limit, batch_size)
+        records = []
+        while True:
+            rows = list(view(self._db, limit=batch_size, **options))
+            for row in rows:
+                record = row.doc['data']
+                record['id'] = row.id[len(model_id) + 1:]
+                if filters and not matches(record, filters):
+                    continue
+                if offset:
+                    offset -= 1
+                    continue
+                records.append(project(record, fields))
+                if len(records) == limit:
+                    return records
+            if len(rows) < batch_size:
+                return records
+            # The next batch starts after the last row.
+            options.update(startkey=rows[-1].key,
+                           startkey_docid=rows[-1].id, skip=1)
+
+    def get_nearest_records(self, model_id, field, point, limit=None,
+                            filters=None):
+        """Returns the records of a model the nearest to a point, by the
+        distance to the bounding box of their ``field`` geometry.
+
+        The spatial index of the field is used if it is declared and the
+        number of records is limited.
+        """
+        definition = self.__get_model(model_id)['definition']
+        if limit is not None and field in spatial_indexes(definition):
+            return search_nearest(self.get_records, model_id, field, point,
+                                  limit, filters)
+        return nearest_records(self.iter_records(model_id, filters=filters),
+                               field, point, limit)
+
     def __get_record(self, model_id, record_id):
-        key = u'-'.join((model_id, record_id))
-        try:
-            return views.records_all(self._db)[key].rows[0].value
-        except IndexError:
+        doc = self.__get_doc(u'-'.join((model_id, record_id)), 'data')
+        if doc is None:
             raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return doc
 
     def get_record(self, model_id, record_id):
         doc = self.__get_record(model_id, record_id)
@@ -47,6 +301,16 @@ class Database(object):
         doc = self.__get_record(model_id, record_id)
         return doc['authors']
 
+    def get_record_revision(self, model_id, record_id):
+        """Returns the revision of the record document."""
+        return self.__get_record(model_id, record_id)['_rev']
+
+    def get_record_document(self, model_id, record_id):
+        """Returns the record document (data, authors and revision)."""
+        doc = self.__get_record(model_id, record_id)
+        return {'data': doc['data'], 'authors': doc['authors'],
+                'revision': doc['_rev']}
+
     def put_model(self, definition, roles, policy_id, model_id=None):
         if model_id is None:
             model_id = self.generate_id()
@@ -54,12 +318,20 @@ class Database(object):
         # Check that policyid exists and raises if not.
         self.get_policy(policy_id)
 
-        definition_id, _ = self._db.save({
+        doc = {
             'type': 'definition',
             '_id': model_id,
             'definition': definition,
             'roles': roles,
-            'policy_id': policy_id})
+            'policy_id': policy_id}
+
+        # An existing model is updated in place, its records are kept.
+        old_doc = self.__get_doc(model_id, 'definition')
+        if old_doc is not None:
+            doc['_rev'] = old_doc['_rev']
+
+        definition_id, _ = self._db.save(doc)
+        views.sync_model_indexes(self._db, model_id, definition)
         return definition_id
 
     def put_record(self, model_id, record, authors, record_id=None):
@@ -86,6 +358,93 @@ class Database(object):
         self._db.save(doc)
         return record_id
 
+    def put_records(self, model_id, records, authors):
+        """Creates several records at once, using a single ``_bulk_docs``
+        request, and returns their ids.
+
+        The id of a record which could not be stored is ``None``.
+        """
+        if not records:
+            return []
+
+        created = [self.generate_id() for record in records]
+        docs = []
+        for record_id, record in zip(created, records):
+            docs.append({
+                '_id': '-'.join((model_id, record_id)),
+                'type': 'data',
+                'authors': authors,
+                'model_id': model_id,
+                'data': record})
+
+        results = self._db.update(docs)
+        for i, (success, docid, error) in enumerate(results):
+            if not success:
+                logger.error('Record %s could not be saved: %s' % (docid,
+                                                                   error))
+                created[i] = None
+        return created
+
+    def replace_records(self, model_id, records, authors):
+        """Replaces the records of a model by the specified ones, and
+        returns their ids.
+
+        Records with an ``id`` are created or updated, other ones are
+        created. Existing records missing from the list are deleted, and
+        unchanged ones are left untouched. Changes are sent by batches of
+        ``batch_size`` documents with ``_bulk_docs``.
+        """
+        self.__get_model(model_id)
+
+        # Revisions of the existing records, by document id.
+        existing = dict((row.id, row.value)
+                        for row in views.records(self._db)[model_id])
+
+        docs = []
+        updated = {}
+        records_ids = []
+        for record in records:
+            record = record.copy()
+            record_id = record.pop('id', None) or self.generate_id()
+            doc = {
+                '_id': '-'.join((model_id, record_id)),
+                'type': 'data',
+                'authors': authors,
+                'model_id': model_id,
+                'data': record}
+            if doc['_id'] in existing:
+                updated[doc['_id']] = doc
+            else:
+                docs.append(doc)
+            records_ids.append(record_id)
+
+        # Only the records which actually changed are updated.
+        updated_ids = list(updated.keys())
+        for i in range(0, len(updated_ids), self.batch_size):
+            keys = updated_ids[i:i + self.batch_size]
+            for row in self._db.view('_all_docs', keys=keys,
+                                     include_docs=True):
+                old_doc = row.doc
+                doc = updated[row.id]
+                if (old_doc['data'] == doc['data'] and
+                        set(authors) <= set(old_doc['authors'])):
+                    continue
+                doc['_rev'] = old_doc['_rev']
+                doc['authors'] = list(set(authors) | set(old_doc['authors']))
+                docs.append(doc)
+
+        for docid, rev in existing.items():
+            if docid not in updated:
+                docs.append({'_id': docid, '_rev': rev, '_deleted': True})
+
+        for i in range(0, len(docs), self.batch_size):
+            results = self._db.update(docs[i:i + self.batch_size])
+            for success, docid, error in results:
+                if not success:
+                    logger.error('Record %s could not be saved: %s' % (
+                        docid, error))
+        return records_ids
+
     def delete_record(self, model_id, record_id):
         doc = self.__get_record(model_id, record_id)
         if doc:
@@ -93,10 +452,34 @@ class Database(object):
         return doc
 
     def delete_records(self, model_id):
-        results = self.__get_records(model_id)
-        for result in results:
-            self._db.delete(result.value)
-        return results
+        """Deletes all the records of a model, by batches of ``batch_size``
+        documents sent in a single ``_bulk_docs`` request.
+
+        Returns the number of deleted records.
+        """
+        options = dict(startkey=model_id, endkey=model_id,
+                       limit=self.batch_size)
+        deleted = 0
+        while True:
+            rows = list(views.records(self._db, **options))
+            # Only the id and revision are needed to delete a document.
+            # The last document of the previous batch is returned again if
+            # it could not be deleted.
+            docs = [{'_id': row.id, '_rev': row.value, '_deleted': True}
+                    for row in rows
+                    if row.id != options.get('startkey_docid')]
+            for success, docid, error in self._db.update(docs):
+                if success:
+                    deleted += 1
+                else:
+                    logger.error('Record %s could not be deleted: %s' % (
+                        docid, error))
+            if len(rows) < self.batch_size or not docs:
+                break
+            options['startkey_docid'] = rows[-1].id
+            logger.info('%s records of model %s deleted so far' % (
+                deleted, model_id))
+        return deleted
 
     def delete_model(self, model_id):
         """DELETE ALL THE THINGS"""
@@ -104,13 +487,11 @@ class Database(object):
         # Delete the associated data if any.
         self.delete_records(model_id)
 
-        try:
-            doc = views.model_definitions(self._db)[model_id].rows[0].value
-        except IndexError:
-            raise ModelNotFound(model_id)
+        doc = self.__get_model(model_id)
 
         # Delete the model definition if it exists.
         self._db.delete(doc)
+        views.sync_model_indexes(self._db, model_id, None)
         return doc
 
     def put_roles(self, model_id, roles):
@@ -163,10 +544,10 @@ class Database(object):
         self._db.save(doc)
 
     def __get_user(self, username):
-        try:
-            return views.users(self._db)[username].rows[0].value
-        except IndexError:
+        doc = self.__get_doc(user_id(username), 'user')
+        if doc is None:
             raise UserNotFound(username)
+        return doc
 
     def get_user(self, username):
         """Returns the information associated with an user"""
@@ -186,8 +567,12 @@ class Database(object):
         if 'groups' not in user:
             user['groups'] = []
 
-        doc = dict(user=user, name=user['name'], type='user')
-        self._db.save(doc)
+        doc = dict(_id=user_id(user['name']), user=user, name=user['name'],
+                   type='user')
+        try:
+            self._db.save(doc)
+        except ResourceConflict:
+            raise UserAlreadyExist(user['name'])
         return user
 
     def __get_policies(self):
@@ -196,15 +581,14 @@ class Database(object):
     def get_policies(self):
         policies = []
         for item in self.__get_policies():
-            policies.append(item.value['name'])
+            policies.append(item.key)
         return policies
 
     def __get_policy(self, policy_name):
-        try:
-            doc = views.policies(self._db)[policy_name].rows[0]
-            return doc.value
-        except IndexError:
+        doc = self.__get_doc(policy_id(policy_name), 'policy')
+        if doc is None:
             raise PolicyNotFound(policy_name)
+        return doc
 
     def get_policy(self, policy_name):
         policy = self. __get_policy(policy_name)['policy']
@@ -215,11 +599,15 @@ class Database(object):
             policy = self.__get_policy(policy_name)
             raise PolicyAlreadyExist(policy_name)
         except PolicyNotFound:
-            self._db.save({
-                'type': 'policy',
-                'name': policy_name,
-                'policy': policy
-            })
+            try:
+                self._db.save({
+                    '_id': policy_id(policy_name),
+                    'type': 'policy',
+                    'name': policy_name,
+                    'policy': policy
+                })
+            except ResourceConflict:
+                raise PolicyAlreadyExist(policy_name)
 
     def delete_policy(self, policy_name):
         doc = self.__get_policy(policy_name)
@@ -235,9 +623,7 @@ class Database(object):
         doc = self.__get_model(model_id)
         return doc['policy_id']
 
-    def __get_policy_definitions(self, policy_name):
-        return views.policy_definitions(self._db)[policy_name]
-
     def policy_is_used(self, policy_name):
-        definitions = self.__get_policy_definitions(policy_name)
-        return len(definitions) > 0
+        # The view reduces to the number of models using the policy.
+        counts = views.policy_definitions(self._db, key=policy_name, limit=1)
+        return any(row.value > 0 for row in counts)
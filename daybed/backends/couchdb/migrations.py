@@ -0,0 +1,70 @@
+"""Migrations of existing CouchDB databases.
+
+Usage::
+
+    $ daybed-migrate-couchdb conf/production.ini
+"""
+import os
+import sys
+
+from couchdb.client import Server
+from pyramid.paster import get_appsettings, setup_logging
+
+from daybed import logger, settings_expandvars
+from . import views
+from .database import user_id, policy_id
+
+
+def migrate_documents_ids(db):
+    """Gives their deterministic id to users and policies documents, which
+    used to be created with random ids, then with ids which could be the
+    ones of models or records.
+
+    Returns the number of migrated documents.
+    """
+    migrated = 0
+    for view, build_id in ((views.users, user_id),
+                           (views.policies, policy_id)):
+        for row in view(db, include_docs=True):
+            doc = row.doc
+            new_id = build_id(doc['name'])
+            if doc['_id'] == new_id:
+                continue
+            if new_id not in db:
+                new_doc = dict((key, value) for key, value in doc.items()
+                               if key not in ('_id', '_rev'))
+                new_doc['_id'] = new_id
+                db.save(new_doc)
+            db.delete(doc)
+            logger.info('Migrated %s to %s' % (doc['_id'], new_id))
+            migrated += 1
+    return migrated
+
+
+def migrate_models_indexes(db):
+    """Creates the fields index of the models, in the design documents of
+    their indexes.
+
+    Returns the number of migrated models.
+    """
+    migrated = 0
+    for row in views.policy_definitions(db, reduce=False, include_docs=True):
+        views.sync_model_indexes(db, row.id, row.doc['definition'])
+        migrated += 1
+    return migrated
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        print('usage: %s <config_uri>' % os.path.basename(argv[0]))
+        sys.exit(1)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = settings_expandvars(get_appsettings(config_uri))
+
+    server = Server(settings['backend.db_host'])
+    db_name = os.environ.get('DB_NAME', settings['backend.db_name'])
+    migrated = migrate_documents_ids(server[db_name])
+    logger.info('%s documents migrated.' % migrated)
+    migrated = migrate_models_indexes(server[db_name])
+    logger.info('%s models indexes migrated.' % migrated)
@@ -0,0 +1,101 @@
+import threading
+import weakref
+
+from couchdb import http
+
+
+class ConnectionPool(http.ConnectionPool):
+    """HTTP connection pool keeping at most ``size`` idle connections by
+    host, and counting its connections.
+
+    :param keep_alive: if ``False``, connections are closed after each
+                       request.
+    """
+    def __init__(self, timeout, size=10, keep_alive=True):
+        super(ConnectionPool, self).__init__(timeout)
+        self.size = size
+        self.keep_alive = keep_alive
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.peak = 0
+        # Connections dropped by the client after an error are forgotten.
+        self._in_use = weakref.WeakSet()
+        self._known = weakref.WeakSet()
+        self._stats_lock = threading.Lock()
+
+    def get(self, url):
+        conn = super(ConnectionPool, self).get(url)
+        with self._stats_lock:
+            if conn in self._known:
+                self.reused += 1
+            else:
+                self._known.add(conn)
+                self.created += 1
+            self._in_use.add(conn)
+            self.peak = max(self.peak, len(self._in_use))
+        return conn
+
+    def release(self, url, conn):
+        scheme, host = http.util.urlsplit(url, 'http', False)[:2]
+        with self._stats_lock:
+            self._in_use.discard(conn)
+        with self.lock:
+            idle = len(self.conns.get((scheme, host), []))
+        if self.keep_alive and idle < self.size:
+            super(ConnectionPool, self).release(url, conn)
+        else:
+            conn.close()
+            with self._stats_lock:
+                self.discarded += 1
+
+    def stats(self):
+        """Returns the number of connections in use, idle, and counters
+        since the pool was created.
+        """
+        with self.lock:
+            idle = sum(len(conns) for conns in self.conns.values())
+        with self._stats_lock:
+            return {
+                'size': self.size,
+                'in_use': len(self._in_use),
+                'idle': idle,
+                'peak': self.peak,
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded
+            }
+
+
+class Cache(http.Cache):
+    """Responses cache of the session, which can be shared by threads."""
+    def __init__(self):
+        super(Cache, self).__init__()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return super(Cache, self).get(url)
+
+    def put(self, url, response):
+        with self._lock:
+            return super(Cache, self).put(url, response)
+
+    def remove(self, url):
+        with self._lock:
+            return super(Cache, self).remove(url)
+
+
+def session(timeout=None, pool_size=10, keep_alive=True, retries=1,
+            retry_delay=0):
+    """Returns an HTTP session for the CouchDB client.
+
+    Requests failing because of a network error (e.g. a connection closed
+    by the server) are retried ``retries`` times, after ``retry_delay``
+    seconds, doubled at each attempt.
+    """
+    delays = [retry_delay * 2 ** i for i in range(retries)]
+    result = http.Session(timeout=timeout, retry_delays=delays)
+    result.cache = Cache()
+    result.connection_pool = ConnectionPool(timeout, pool_size, keep_alive)
+    return result
@@ -1,41 +1,53 @@
-from couchdb.design import ViewDefinition
+import json
 
-# Definition of CouchDB design documents, a.k.a. permanent views.
+from couchdb.design import ViewDefinition
 
+from daybed.backends.spatial import CELL_SIZE, MAX_CELLS, spatial_indexes
+from daybed.schemas.validators import field_operators
 
-""" Model definitions, by model id."""
-model_definitions = ViewDefinition('definitions', 'all', """
-function(doc) {
-  if (doc.type == "definition") {
-    emit(doc._id, doc);
-  }
-}""")
+# Definition of CouchDB design documents, a.k.a. permanent views.
+#
+# Views do not emit whole documents, which would be duplicated in their
+# index: query them with ``include_docs=True`` when documents are needed.
 
 
-"""models by policy_id"""
+"""Number of models by policy_id"""
 policy_definitions = ViewDefinition('definitions_policy', 'by_policy_id', """
 function(doc) {
   if (doc.type == "definition") {
-    emit(doc.policy_id, doc);
+    emit(doc.policy_id, null);
   }
 }
-""")
+""", reduce_fun='_count')
 
-""" Model records, by model name."""
+"""Model records revisions, by model name."""
 records = ViewDefinition('records', 'by_model', """
 function(doc) {
   if (doc.type == "data") {
-    emit(doc.model_id, doc);
+    emit(doc.model_id, doc._rev);
   }
 }""")
 
-""" Record, by id."""
-records_all = ViewDefinition('records_all', 'all', """
+"""Hashes of the ids and revisions of the models and records documents,
+by model name: their statistics change whenever the model or its records
+are modified (see :func:`model_revision`).
+"""
+revisions = ViewDefinition('revisions', 'by_model', """
 function(doc) {
-  if (doc.type == "data") {
-    emit(doc._id, doc);
+  var model_id;
+  if (doc.type == "definition") {
+    model_id = doc._id;
+  } else if (doc.type == "data") {
+    model_id = doc.model_id;
+  } else {
+    return;
   }
-}""")
+  var key = doc._id + doc._rev, hash = 0;
+  for (var i = 0; i < key.length; i++) {
+    hash = (hash * 31 + key.charCodeAt(i)) % 16777216;
+  }
+  emit(model_id, hash);
+}""", reduce_fun='_stats')
 
 """The groups for an user"""
 user_groups = ViewDefinition('groups', 'by_user', """
@@ -52,7 +64,7 @@ function(user){
 users = ViewDefinition('users', 'by_name', """
 function(doc){
   if(doc.type == 'user'){
-      emit(doc.name, doc);
+      emit(doc.name, null);
   }
 }
 """)
@@ -61,7 +73,7 @@ function(doc){
 policies = ViewDefinition('policies', 'by_name', """
 function(doc) {
   if (doc.type == "policy") {
-    emit(doc.name, doc);
+    emit(doc.name, null);
   }
 }
 """)
@@ -69,3 +81,132 @@ function(doc) {
 
 l = locals().values()
 docs = [v for v in l if isinstance(v, ViewDefinition)]
+
+
+def model_revision(stats):
+    """Returns the revision of a model, given the statistics of its rows of
+    the :data:`revisions` view.
+    """
+    return u'%d-%d-%d-%d' % (stats['count'], stats['sum'], stats['min'],
+                             stats['max'])
+
+
+def indexes_design(model_id):
+    """Returns the name of the design document of the model indexes."""
+    return u'indexes-%s' % model_id
+
+
+def model_index(model_id, fields):
+    """Secondary index of a model records, by the values of the specified
+    fields (missing values being ``null``).
+    """
+    values = ', '.join('data[%s]' % json.dumps(field) for field in fields)
+    return ViewDefinition(indexes_design(model_id), '-'.join(fields), """
+function(doc) {
+  if (doc.type == "data" && doc.model_id == %s) {
+    var data = doc.data;
+    emit([%s].map(function(value) {
+      return value === undefined ? null : value;
+    }), null);
+  }
+}""" % (json.dumps(model_id), values))
+
+
+#: Name of the fields index, in the design document of the model indexes.
+FIELDS_INDEX = u'_fields'
+
+#: Filters operators which can read the records from the fields index.
+FIELDS_OPERATORS = ('eq', 'in', 'prefix', 'gt', 'lt', 'contains')
+
+
+def indexed_fields(definition):
+    """Returns the names of the fields of a model definition in its fields
+    index: the ones which can be filtered, apart from long texts.
+    """
+    return [field['name'] for field in definition['fields']
+            if field['type'] != 'text' and
+            set(field_operators(field['type'])) & set(FIELDS_OPERATORS)]
+
+
+def fields_index(model_id, fields):
+    """Index of a model records, by field name and value of the specified
+    fields, used by the filters which cannot use a declared index.
+
+    Lists are indexed by their string items, for the ``contains`` filters.
+    """
+    return ViewDefinition(indexes_design(model_id), FIELDS_INDEX, """
+function(doc) {
+  if (doc.type != "data" || doc.model_id != %s) return;
+  %s.forEach(function(field) {
+    var value = doc.data[field];
+    if (value === undefined) return;
+    if (value === null || typeof value !== "object") {
+      emit([field, value], null);
+    } else if (Array.isArray(value)) {
+      value.forEach(function(item) {
+        if (typeof item === "string") emit([field, item], null);
+      });
+    }
+  });
+}""" % (json.dumps(model_id), json.dumps(fields)))
+
+
+def spatial_index(model_id, field):
+    """Spatial index of a model records, by the cells of the grid covered
+    by the bounding box of a geometry field (see
+    :mod:`daybed.backends.spatial`), ``null`` for larger geometries.
+    """
+    return ViewDefinition(indexes_design(model_id), field, """
+function(doc) {
+  if (doc.type != "data" || doc.model_id != %(model_id)s) return;
+  var box = null;
+  function visit(value) {
+    if (value === null || typeof value !== "object") return;
+    if (!Array.isArray(value)) {
+      if (value.geometries) value.geometries.forEach(visit);
+      else visit(value.coordinates);
+    } else if (value.length >= 2 && typeof value[0] === "number") {
+      box = box === null ? [value[0], value[1], value[0], value[1]] :
+        [Math.min(box[0], value[0]), Math.min(box[1], value[1]),
+         Math.max(box[2], value[0]), Math.max(box[3], value[1])];
+    } else {
+      value.forEach(visit);
+    }
+  }
+  visit(doc.data[%(field)s]);
+  if (box === null) return;
+  var x0 = Math.floor(box[0] / %(size)r), y0 = Math.floor(box[1] / %(size)r),
+      x1 = Math.floor(box[2] / %(size)r), y1 = Math.floor(box[3] / %(size)r);
+  if ((x1 - x0 + 1) * (y1 - y0 + 1) > %(max)d) {
+    emit(null, null);
+    return;
+  }
+  for (var x = x0; x <= x1; x++) {
+    for (var y = y0; y <= y1; y++) emit([x, y], null);
+  }
+}""" % {'model_id': json.dumps(model_id), 'field': json.dumps(field),
+        'size': CELL_SIZE, 'max': MAX_CELLS})
+
+
+def sync_model_indexes(db, model_id, definition):
+    """Creates, updates or deletes the design document of the model
+    indexes, according to the ``indexes`` and fields of its definition
+    (``None`` once the model is deleted).
+    """
+    views = []
+    if definition:
+        geometries = spatial_indexes(definition)
+        views = [spatial_index(model_id, fields[0])
+                 if len(fields) == 1 and fields[0] in geometries
+                 else model_index(model_id, fields)
+                 for fields in definition.get('indexes', [])]
+        fields = indexed_fields(definition)
+        if fields:
+            views.append(fields_index(model_id, fields))
+    if views:
+        ViewDefinition.sync_many(db, views, remove_missing=True)
+        return
+    design_id = u'_design/%s' % indexes_design(model_id)
+    doc = db.get(design_id)
+    if doc is not None:
+        db.delete(doc)
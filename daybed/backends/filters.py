@@ -0,0 +1,127 @@
+"""Records filters, as validated from the querystring by
+:func:`daybed.schemas.validators.filters_validator`.
+
+Filters are lists of ``(field, operator, value)`` tuples, all of which a
+record has to match. Backends which cannot translate them into their own
+queries match the records as they read them, with :func:`matches`.
+"""
+import six
+
+from daybed.backends.spatial import bounds, intersects
+
+
+def _startswith(value, prefix):
+    return isinstance(value, six.string_types) and value.startswith(prefix)
+
+
+def _contains(value, item):
+    return isinstance(value, list) and item in value
+
+
+def _bbox(value, box):
+    return intersects(bounds(value), box)
+
+
+OPERATORS = {
+    'eq': lambda value, expected: value == expected,
+    'in': lambda value, expected: value in expected,
+    'gt': lambda value, expected: value > expected,
+    'lt': lambda value, expected: value < expected,
+    'prefix': _startswith,
+    'contains': _contains,
+    'bbox': _bbox,
+}
+
+
+def matches(record, filters):
+    """Returns ``True`` if the record matches all the filters."""
+    for field, operator, expected in filters:
+        if record.get(field) is None:
+            return False
+        try:
+            if not OPERATORS[operator](record[field], expected):
+                return False
+        except TypeError:
+            # Values of different types (e.g. a record written before its
+            # field type was changed).
+            return False
+    return True
+
+
+def filter_records(get_records, model_id, filters, limit=None, start=None,
+                   batch_size=1000):
+    """Returns the records of a model matching the filters, ordered by id.
+
+    Records are read by batches of ``batch_size`` with
+    ``get_records(model_id, limit, start)``, until ``limit`` of them match.
+    """
+    records = []
+    while True:
+        batch = get_records(model_id, limit=batch_size, start=start)
+        for record in batch:
+            if matches(record, filters):
+                records.append(record)
+                if len(records) == limit:
+                    return records
+        if len(batch) < batch_size:
+            return records
+        start = batch[-1]['id']
+
+
+#: Upper bound of the strings starting with a prefix, in indexes.
+PREFIX_END = u'\uffff'
+
+
+def index_ranges(fields, filters):
+    """Returns the ranges of the keys of an index on the specified fields
+    which contain the records matching the filters, or ``None`` if the
+    index cannot be used.
+
+    Ranges are ``(start, end)`` tuples of key prefixes, both inclusive:
+    they may contain records which do not match the filters, which have
+    to be matched again.
+    """
+    conditions = {}
+    for field, operator, value in filters:
+        conditions.setdefault(field, {})[operator] = value
+
+    prefix = ()
+    for field in fields:
+        condition = conditions.get(field, {})
+        if 'eq' in condition:
+            prefix += (condition['eq'],)
+            continue
+        if 'in' in condition:
+            return [(prefix + (value,), prefix + (value,))
+                    for value in sorted(set(condition['in']))]
+        if 'prefix' in condition:
+            start = condition['prefix']
+            return [(prefix + (start,), prefix + (start + PREFIX_END,))]
+        if 'gt' in condition or 'lt' in condition:
+            start = (condition['gt'],) if 'gt' in condition else ()
+            end = (condition['lt'],) if 'lt' in condition else ()
+            return [(prefix + start, prefix + end)]
+        break
+    if not prefix:
+        return None
+    return [(prefix, prefix)]
+
+
+def choose_index(indexes, filters):
+    """Returns the fields of the index to use for the filters, among the
+    specified ones, and its ranges (see :func:`index_ranges`).
+
+    The index whose ranges are the narrowest is chosen, or ``(None, None)``
+    if none can be used.
+    """
+    chosen = (None, None)
+    depth = 0
+    for fields in indexes:
+        ranges = index_ranges(fields, filters)
+        if ranges is None:
+            continue
+        start, end = ranges[0]
+        if max(len(start), len(end)) > depth:
+            depth = max(len(start), len(end))
+            chosen = (fields, ranges)
+    return chosen
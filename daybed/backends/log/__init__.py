@@ -0,0 +1,5 @@
+from .backend import LogBackend
+
+__all__ = [
+    'LogBackend'
+]
@@ -0,0 +1,60 @@
+import threading
+import time
+
+from pyramid.settings import asbool
+
+from daybed import logger
+from daybed.backends.cached import PoliciesCache
+from .database import Database
+from .store import LogStore
+
+
+class LogBackend(object):
+    """Stores everything in append-only segment files, in the
+    ``backend.db_path`` directory.
+
+    Segments are compacted by a background thread once the proportion of
+    overwritten or deleted documents reaches ``backend.compaction_ratio``.
+    """
+    def db(self):
+        return Database(self.store, self._generate_id,
+                        batch_size=self.batch_size)
+
+    def __init__(self, config):
+        settings = config.registry.settings
+
+        segment_size = int(settings.get('backend.segment_size',
+                                        64 * 1024 * 1024))
+        self.store = LogStore(settings['backend.db_path'],
+                              segment_size=segment_size,
+                              fsync=asbool(settings.get('backend.fsync')))
+        self.batch_size = int(settings.get('backend.batch_size', 1000))
+        self.compaction_ratio = float(settings.get('backend.compaction_ratio',
+                                                   0.5))
+
+        # model id generator
+        generator = config.maybe_dotted(settings['daybed.id_generator'])
+        self._generate_id = generator(config)
+
+        self.policies = PoliciesCache()
+
+        interval = int(settings.get('backend.compaction_interval', 60))
+        if interval > 0:
+            thread = threading.Thread(target=self.compact_periodically,
+                                      args=(interval,),
+                                      name='daybed-compaction')
+            thread.daemon = True
+            thread.start()
+
+    def compact_periodically(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                if self.store.dead_ratio() >= self.compaction_ratio:
+                    self.store.compact()
+            except Exception as e:
+                logger.error('Compaction failed: %s' % e)
+
+    def delete_db(self):
+        self.store.clear()
+        self.policies.invalidate()
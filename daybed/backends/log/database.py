@@ -0,0 +1,353 @@
+from daybed.backends.exceptions import (
+    UserAlreadyExist, UserNotFound, ModelNotFound,
+    PolicyNotFound, PolicyAlreadyExist, RecordNotFound
+)
+from daybed.backends.filters import filter_records, matches
+from daybed.backends.sorting import project, sort_records
+from daybed.backends.spatial import nearest_records
+
+
+class Database(object):
+    """Object handling all the interactions with the log store.
+
+    Documents are read from the segments on each call: they can be
+    modified by callers.
+    """
+
+    def __init__(self, store, generate_id, batch_size=1000):
+        self._store = store
+        self.generate_id = generate_id
+        self.batch_size = batch_size
+
+    def __get_model(self, model_id):
+        doc = self._store.get(('models', model_id))
+        if doc is None:
+            raise ModelNotFound(model_id)
+        return doc
+
+    def get_model(self, model_id):
+        """Returns the model document (definition, roles and policy id)."""
+        return self.__get_model(model_id)
+
+    def get_model_definition(self, model_id):
+        return self.__get_model(model_id)['definition']
+
+    def get_model_revision(self, model_id):
+        """Returns the revision of the model, which changes whenever the
+        model or its records are modified.
+
+        It is the location of the last write of the model document or of
+        its revision document, written along with its records.
+        """
+        self.__get_model(model_id)
+        locations = [self._store.location((prefix, model_id))
+                     for prefix in ('models', 'revisions')]
+        return u'%d-%d' % max(location[:2] for location in locations
+                              if location is not None)
+
+    def get_records(self, model_id, limit=None, start=None, filters=None,
+                    fields=None):
+        """Returns the records of a model, ordered by id.
+
+        :param limit: maximum number of records to return.
+        :param start: if specified, only records whose id follow this one
+                      are returned.
+        :param filters: if specified, only records matching them are
+                        returned (see :mod:`daybed.backends.filters`).
+        :param fields: if specified, only these fields of the records are
+                       returned, with their id.
+        """
+        if filters:
+            records = filter_records(self.get_records, model_id, filters,
+                                     limit, start, self.batch_size)
+            return [project(record, fields) for record in records]
+
+        # Check that model_id exists and raises if not.
+        self.__get_model(model_id)
+        records_ids = self._store.children(('records', model_id),
+                                           start=start, limit=limit)
+        docs = self._store.get_many([('records', model_id, record_id)
+                                     for record_id in records_ids])
+        records = []
+        for record_id, doc in zip(records_ids, docs):
+            if doc is not None:
+                record = doc['data']
+                record['id'] = record_id
+                records.append(project(record, fields))
+        return records
+
+    def iter_records(self, model_id, batch_size=None, filters=None,
+                     fields=None):
+        """Yields the records of a model one by one, ordered by id.
+
+        Records are read by batches of ``batch_size``.
+        """
+        batch_size = batch_size or self.batch_size
+        records = self.get_records(model_id, limit=batch_size)
+
+        def batches(records):
+            while True:
+                for record in records:
+                    if not filters or matches(record, filters):
+                        yield project(record, fields)
+                if len(records) < batch_size:
+                    break
+                records = self.get_records(model_id, limit=batch_size,
+                                           start=records[-1]['id'])
+        return batches(records)
+
+    def get_sorted_records(self, model_id, sort, limit=None, offset=0,
+                           filters=None, fields=None):
+        """Returns the records of a model in the specified sort (see
+        :mod:`daybed.backends.sorting`), skipping the first ``offset`` ones.
+
+        Secondary indexes are not supported: all records are read.
+        """
+        records = sort_records(self.iter_records(model_id, filters=filters),
+                               sort, limit, offset)
+        return [project(record, fields) for record in records]
+
+    def get_nearest_records(self, model_id, field, point, limit=None,
+                            filters=None):
+        """Returns the records of a model the nearest to a point, by the
+        distance to the bounding box of their ``field`` geometry.
+
+        Spatial indexes are not supported: all records are read.
+        """
+        return nearest_records(self.iter_records(model_id, filters=filters),
+                               field, point, limit)
+
+    def __get_record(self, model_id, record_id):
+        doc = self._store.get(('records', model_id, record_id))
+        if doc is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return doc
+
+    def get_record(self, model_id, record_id):
+        return self.__get_record(model_id, record_id)['data']
+
+    def get_record_authors(self, model_id, record_id):
+        return self.__get_record(model_id, record_id)['authors']
+
+    def get_record_revision(self, model_id, record_id):
+        """Returns the revision of the record, which changes whenever the
+        record is modified.
+        """
+        location = self._store.location(('records', model_id, record_id))
+        if location is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return u'%d-%d' % location[:2]
+
+    def get_record_document(self, model_id, record_id):
+        """Returns the record document (data, authors and revision)."""
+        doc = self.__get_record(model_id, record_id)
+        return {'data': doc['data'], 'authors': doc['authors'],
+                'revision': self.get_record_revision(model_id, record_id)}
+
+    def put_model(self, definition, roles, policy_id, model_id=None):
+        if model_id is None:
+            model_id = self.generate_id()
+
+        # Check that policyid exists and raises if not.
+        self.get_policy(policy_id)
+
+        # Records are stored separately, and kept if the model exists.
+        self._store.write([(('models', model_id), {
+            'type': 'definition',
+            '_id': model_id,
+            'definition': definition,
+            'roles': roles,
+            'policy_id': policy_id
+        })])
+        return model_id
+
+    def __revision_doc(self, model_id):
+        """Returns the document whose location changes whenever the records
+        of the model are written (see :meth:`get_model_revision`).
+        """
+        return (('revisions', model_id), {})
+
+    def __record_doc(self, model_id, record_id, record, authors):
+        return (('records', model_id, record_id), {
+            'type': 'data',
+            '_id': record_id,
+            'model_id': model_id,
+            'authors': authors,
+            'data': record
+        })
+
+    def put_record(self, model_id, record, authors, record_id=None):
+        self.__get_model(model_id)
+        if record_id is not None:
+            try:
+                old_doc = self.__get_record(model_id, record_id)
+            except RecordNotFound:
+                pass
+            else:
+                authors = list(set(authors) | set(old_doc['authors']))
+        else:
+            record_id = self.generate_id()
+
+        self._store.write([self.__record_doc(model_id, record_id, record,
+                                             authors),
+                           self.__revision_doc(model_id)])
+        return record_id
+
+    def put_records(self, model_id, records, authors):
+        """Creates several records at once, with a single write, and
+        returns their ids.
+        """
+        self.__get_model(model_id)
+        created = [self.generate_id() for record in records]
+        docs = [self.__record_doc(model_id, record_id, record, authors)
+                for record_id, record in zip(created, records)]
+        self._store.write(docs + [self.__revision_doc(model_id)])
+        return created
+
+    def replace_records(self, model_id, records, authors):
+        """Replaces the records of a model by the specified ones, and
+        returns their ids.
+
+        Records with an ``id`` are created or updated, other ones are
+        created. Existing records missing from the list are deleted, and
+        unchanged ones are left untouched.
+        """
+        self.__get_model(model_id)
+        existing = set(self._store.children(('records', model_id)))
+
+        docs = []
+        records_ids = []
+        for record in records:
+            record = record.copy()
+            record_id = record.pop('id', None) or self.generate_id()
+            records_ids.append(record_id)
+            doc_authors = authors
+            if record_id in existing:
+                existing.remove(record_id)
+                old_doc = self.__get_record(model_id, record_id)
+                if (old_doc['data'] == record and
+                        set(authors) <= set(old_doc['authors'])):
+                    continue
+                doc_authors = list(set(authors) | set(old_doc['authors']))
+            docs.append(self.__record_doc(model_id, record_id, record,
+                                          doc_authors))
+
+        deleted = [('records', model_id, record_id) for record_id in existing]
+        if docs or deleted:
+            docs.append(self.__revision_doc(model_id))
+            self._store.write(docs, deleted)
+        return records_ids
+
+    def delete_record(self, model_id, record_id):
+        doc = self.__get_record(model_id, record_id)
+        self._store.write([self.__revision_doc(model_id)],
+                          [('records', model_id, record_id)])
+        return doc
+
+    def delete_records(self, model_id):
+        """Deletes all the records of a model, and returns their number."""
+        self.__get_model(model_id)
+        records_ids = self._store.children(('records', model_id))
+        if records_ids:
+            self._store.write([self.__revision_doc(model_id)],
+                              [('records', model_id, record_id)
+                               for record_id in records_ids])
+        return len(records_ids)
+
+    def delete_model(self, model_id):
+        doc = self.__get_model(model_id)
+        records_ids = self._store.children(('records', model_id))
+        deleted = [('records', model_id, record_id)
+                   for record_id in records_ids]
+        deleted.append(('models', model_id))
+        if self._store.location(('revisions', model_id)) is not None:
+            deleted.append(('revisions', model_id))
+        self._store.write(deleted=deleted)
+        return doc
+
+    def put_roles(self, model_id, roles):
+        doc = self.__get_model(model_id)
+        doc['roles'] = roles
+        self._store.write([(('models', model_id), doc)])
+        return doc
+
+    def add_role(self, model_id, role_name, users):
+        doc = self.__get_model(model_id)
+        roles = doc['roles']
+        existing_users = set(roles.get(role_name, []))
+        roles[role_name] = list(existing_users | set(users))
+        self._store.write([(('models', model_id), doc)])
+
+    def get_roles(self, model_id):
+        return self.__get_model(model_id)['roles']
+
+    def get_groups(self, username):
+        """Return the groups for a specific user"""
+        return self.get_user(username)['groups']
+
+    def add_group(self, username, group):
+        """Adds an user to an existing group"""
+        user = self.get_user(username)
+        if group not in user['groups']:
+            user['groups'].append(group)
+            self._store.write([(('users', username), user)])
+
+    def get_user(self, username):
+        """Returns the information associated with an user"""
+        user = self._store.get(('users', username))
+        if user is None:
+            raise UserNotFound(username)
+        return user
+
+    def add_user(self, user):
+        # Check that the user doesn't already exist.
+        try:
+            self.get_user(user['name'])
+            raise UserAlreadyExist(user['name'])
+        except UserNotFound:
+            pass
+
+        user = user.copy()
+
+        if 'groups' not in user:
+            user['groups'] = []
+
+        self._store.write([(('users', user['name']), user)])
+        return user
+
+    def get_policies(self):
+        return self._store.children(('policies',))
+
+    def get_policy(self, policy_name):
+        policy = self._store.get(('policies', policy_name))
+        if policy is None:
+            raise PolicyNotFound(policy_name)
+        return policy
+
+    def set_policy(self, policy_name, policy):
+        try:
+            self.get_policy(policy_name)
+            raise PolicyAlreadyExist(policy_name)
+        except PolicyNotFound:
+            self._store.write([(('policies', policy_name), policy)])
+
+    def delete_policy(self, policy_name):
+        policy = self.get_policy(policy_name)
+        self._store.write(deleted=[('policies', policy_name)])
+        return {
+            'type': 'policy',
+            'name': policy_name,
+            'policy': policy
+        }
+
+    def get_model_policy(self, model_id):
+        return self.get_policy(self.get_model_policy_id(model_id))
+
+    def get_model_policy_id(self, model_id):
+        return self.__get_model(model_id)['policy_id']
+
+    def policy_is_used(self, policy_name):
+        for model_id in self._store.children(('models',)):
+            if self.get_model_policy_id(model_id) == policy_name:
+                return True
+        return False
@@ -0,0 +1,299 @@
+import json
+import mmap
+import os
+import threading
+from bisect import bisect_left, bisect_right
+
+import six
+
+from daybed import logger
+
+
+SEGMENT_SUFFIX = '.log'
+COMPACTING_SUFFIX = '.compacting'
+
+
+def segment_name(number):
+    return '%08d%s' % (number, SEGMENT_SUFFIX)
+
+
+def encode(entry):
+    return json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def decode(line):
+    return json.loads(line.decode('utf-8'))
+
+
+class LogStore(object):
+    """Key/value store appending JSON-encoded operations to segment files.
+
+    Keys are tuples of strings. The location of the last version of each
+    document is kept in memory, and documents are read from the memory
+    mapped segments when needed.
+
+    Each line of a segment is either a document (``{"k": key, "d": doc}``),
+    a deletion (``{"k": key}``) or, in first position, the list of the
+    segments a compacted segment replaces (``{"compacted": [numbers]}``).
+
+    :param path: the directory of the segment files.
+    :param segment_size: size after which a new segment is started.
+    :param fsync: if ``True``, writes are synced to the disk.
+    """
+    def __init__(self, path, segment_size=64 * 1024 * 1024, fsync=False):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._load()
+
+    def _segment_path(self, number):
+        return os.path.join(self.path, segment_name(number))
+
+    def _load(self):
+        """Rebuilds the index from the segment files."""
+        # Location (segment, offset, length) of the documents, by key.
+        self._index = {}
+        # Sorted last parts of the keys, by key prefix.
+        self._children = {}
+        self._sizes = {}
+        self._dead = {}
+        self._maps = {}
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        numbers = []
+        for filename in os.listdir(self.path):
+            if filename.endswith(COMPACTING_SUFFIX):
+                # Unfinished compaction.
+                os.remove(os.path.join(self.path, filename))
+            elif filename.endswith(SEGMENT_SUFFIX):
+                numbers.append(int(filename[:-len(SEGMENT_SUFFIX)]))
+
+        # Segments merged by a compaction which could not delete them.
+        replaced = set()
+        for number in numbers:
+            with open(self._segment_path(number), 'rb') as segment:
+                first = segment.readline()
+            if first.endswith(b'\n'):
+                merged = decode(first).get('compacted', [])
+                replaced.update(n for n in merged if n != number)
+
+        for number in sorted(numbers):
+            if number in replaced:
+                os.remove(self._segment_path(number))
+                continue
+            self._replay(number)
+
+        self._active = max(self._sizes) if self._sizes else 1
+        self._file = open(self._segment_path(self._active), 'ab')
+        self._sizes.setdefault(self._active, 0)
+        self._dead.setdefault(self._active, 0)
+
+    def _replay(self, number):
+        path = self._segment_path(number)
+        offset = 0
+        self._sizes[number] = 0
+        self._dead[number] = 0
+        with open(path, 'rb') as segment:
+            for line in segment:
+                if not line.endswith(b'\n'):
+                    logger.warning('Truncating incomplete entry of %s' % path)
+                    break
+                entry = decode(line)
+                if 'd' in entry:
+                    self._set(tuple(entry['k']), (number, offset, len(line)))
+                elif 'k' in entry:
+                    # Deletions are never read again.
+                    self._set(tuple(entry['k']), None)
+                    self._dead[number] += len(line)
+                offset += len(line)
+        if offset < os.path.getsize(path):
+            with open(path, 'r+b') as segment:
+                segment.truncate(offset)
+        self._sizes[number] = offset
+
+    def _set(self, key, location):
+        """Updates the index, ``None`` meaning the document was deleted."""
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._dead[old[0]] += old[2]
+        children = self._children.setdefault(key[:-1], [])
+        position = bisect_left(children, key[-1])
+        exists = position < len(children) and children[position] == key[-1]
+        if location is None:
+            if exists:
+                del children[position]
+            return
+        self._index[key] = location
+        if not exists:
+            children.insert(position, key[-1])
+
+    def _read(self, location):
+        number, offset, length = location
+        segment = self._maps.get(number)
+        if segment is None or len(segment) < offset + length:
+            if segment is not None:
+                segment.close()
+            with open(self._segment_path(number), 'rb') as f:
+                segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[number] = segment
+        return decode(segment[offset:offset + length])
+
+    def get(self, key):
+        """Returns the document of the specified key, or ``None``."""
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            return self._read(location)['d']
+
+    def get_many(self, keys):
+        """Returns the documents of the specified keys, ``None`` for the
+        missing ones.
+        """
+        with self._lock:
+            locations = [self._index.get(key) for key in keys]
+            return [None if location is None else self._read(location)['d']
+                    for location in locations]
+
+    def location(self, key):
+        """Returns the ``(segment, offset, length)`` location of the
+        document of the specified key, or ``None``.
+
+        The location changes whenever the document is written.
+        """
+        with self._lock:
+            return self._index.get(key)
+
+    def children(self, prefix, start=None, limit=None):
+        """Returns the sorted last parts of the keys beginning with the
+        specified prefix.
+
+        :param start: if specified, only the parts following it are
+                      returned.
+        :param limit: maximum number of parts to return.
+        """
+        with self._lock:
+            children = self._children.get(prefix, [])
+            first = bisect_right(children, start) if start is not None else 0
+            last = first + limit if limit is not None else len(children)
+            return children[first:last]
+
+    def write(self, documents=(), deleted=()):
+        """Stores the specified ``(key, document)`` pairs and deletes the
+        specified keys, with a single write.
+        """
+        entries = [(key, encode({'k': key, 'd': doc}), True)
+                   for key, doc in documents]
+        entries += [(key, encode({'k': key}), False) for key in deleted]
+        if not entries:
+            return
+
+        with self._lock:
+            if self._sizes[self._active] >= self.segment_size:
+                self._rotate()
+            number = self._active
+            offset = self._sizes[number]
+            self._file.write(b''.join(line for key, line, put in entries))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+            for key, line, put in entries:
+                if put:
+                    self._set(key, (number, offset, len(line)))
+                else:
+                    self._set(key, None)
+                    self._dead[number] += len(line)
+                offset += len(line)
+            self._sizes[number] = offset
+
+    def _rotate(self):
+        self._file.close()
+        self._active += 1
+        self._file = open(self._segment_path(self._active), 'ab')
+        self._sizes[self._active] = 0
+        self._dead[self._active] = 0
+
+    def dead_ratio(self):
+        """Returns the proportion of the sealed segments which is made of
+        overwritten or deleted documents.
+        """
+        with self._lock:
+            sealed = [n for n in self._sizes if n != self._active]
+            size = sum(self._sizes[n] for n in sealed)
+            if not size:
+                return 0.0
+            return float(sum(self._dead[n] for n in sealed)) / size
+
+    def compact(self):
+        """Merges the live documents of all the sealed segments into a
+        single one. Writes are only blocked while the index is updated.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                sealed = sorted(n for n in self._sizes if n != self._active)
+                if not sealed:
+                    return
+                live = [(key, location)
+                        for key, location in six.iteritems(self._index)
+                        if location[0] in sealed]
+
+            # Sealed segments are never modified, they can be read without
+            # blocking writes.
+            number = sealed[-1]
+            path = self._segment_path(number)
+            temp_path = path + COMPACTING_SUFFIX
+            locations = {}
+            with open(temp_path, 'wb') as compacted:
+                header = encode({'compacted': sealed})
+                compacted.write(header)
+                offset = len(header)
+                for key, location in live:
+                    with self._lock:
+                        line = encode(self._read(location))
+                    compacted.write(line)
+                    locations[key] = (location, (number, offset, len(line)))
+                    offset += len(line)
+                compacted.flush()
+                os.fsync(compacted.fileno())
+
+            with self._lock:
+                os.rename(temp_path, path)
+                for n in sealed:
+                    segment = self._maps.pop(n, None)
+                    if segment is not None:
+                        segment.close()
+                    del self._sizes[n]
+                    del self._dead[n]
+                self._sizes[number] = offset
+                self._dead[number] = 0
+                for key, (old, new) in six.iteritems(locations):
+                    if self._index.get(key) == old:
+                        self._index[key] = new
+                    else:
+                        # Changed during the compaction.
+                        self._dead[number] += new[2]
+                for n in sealed[:-1]:
+                    os.remove(self._segment_path(n))
+            logger.info('Compacted segments %s' % sealed)
+
+    def clear(self):
+        """Deletes all the documents and segments."""
+        with self._compaction_lock:
+            with self._lock:
+                self.close()
+                for filename in os.listdir(self.path):
+                    if filename.endswith(SEGMENT_SUFFIX):
+                        os.remove(os.path.join(self.path, filename))
+                self._load()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            for segment in self._maps.values():
+                segment.close()
+            self._maps = {}
@@ -1,3 +1,4 @@
+from daybed.backends.cached import PoliciesCache
 from .database import Database
 
 
@@ -5,23 +6,33 @@ class MemoryBackend(object):
     def db(self):
         return Database(self.__db, self._generate_id)
 
+    def async_db(self, executor=None):
+        """Returns an asynchronous database, which never blocks."""
+        from daybed.backends.aio import DirectDatabase
+        return DirectDatabase(self.db())
+
     def __init__(self, config):
         # model id generator
         settings = config.registry.settings
         generator = config.maybe_dotted(settings['daybed.id_generator'])
         self._generate_id = generator(config)
 
+        self.policies = PoliciesCache()
         self.__init_db()
         self._db = self.db()
 
     def delete_db(self):
         self.__db.clear()
         self.__init_db()
+        self.policies.invalidate()
 
     def __init_db(self):
         self.__db = {
             'models': {},
             'data': {},
+            'index': {},
             'users': {},
-            'policies': {}
+            'policies': {},
+            'revisions': {},
+            'indexes': {}
         }
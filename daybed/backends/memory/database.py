@@ -1,24 +1,61 @@
-from copy import deepcopy
+from bisect import bisect_left, bisect_right, insort
+from uuid import uuid4
 
 from daybed.backends.exceptions import (
     UserAlreadyExist, UserNotFound, ModelNotFound,
     PolicyNotFound, PolicyAlreadyExist, RecordNotFound
 )
+from daybed.backends.filters import choose_index, matches
+from daybed.backends.sorting import project, sort_index, sort_records
+from daybed.backends.spatial import (nearest_records, search_nearest,
+                                     spatial_indexes)
+from .frozen import freeze
+from .index import GridIndex, SortedIndex
 
 
 class Database(object):
-    """Object handling all the db interactions."""
+    """Object handling all the db interactions.
+
+    Stored documents are frozen (see :func:`freeze`): they are returned
+    without being copied, and are replaced instead of being modified.
+    """
 
     def __init__(self, db, generate_id):
         self._db = db
+        self._db.setdefault('revisions', {})
+        self._db.setdefault('indexes', {})
         self.generate_id = generate_id
 
+    def __touch(self, model_id):
+        """Changes the revision of the model, after it or its records were
+        modified.
+        """
+        self._db['revisions'][model_id] = uuid4().hex
+
+    def get_model_revision(self, model_id):
+        """Returns the revision of the model, which changes whenever the
+        model or its records are modified.
+        """
+        self.__get_model(model_id)
+        return self._db['revisions'].setdefault(model_id, uuid4().hex)
+
+    def get_record_revision(self, model_id, record_id):
+        """Returns the revision of the record, which changes whenever the
+        record is modified.
+        """
+        self.__get_record(model_id, record_id)
+        return self.get_model_revision(model_id)
+
     def __get_model(self, model_id):
         try:
-            return deepcopy(self._db['models'][model_id])
+            return self._db['models'][model_id]
         except KeyError:
             raise ModelNotFound(model_id)
 
+    def get_model(self, model_id):
+        """Returns the model document (definition, roles and policy id)."""
+        return self.__get_model(model_id)
+
     def get_model_definition(self, model_id):
         return self.__get_model(model_id)['definition']
 
@@ -27,16 +64,172 @@ class Database(object):
         self.__get_model(model_id)
         return self._db['data'].get(model_id, {}).values()
 
-    def get_records(self, model_id):
+    def __build_indexes(self, model_id, definition):
+        """Builds the secondary indexes declared by the model definition.
+        """
+        indexes = {}
+        data = self._db['data'][model_id]
+        geometries = spatial_indexes(definition)
+        for fields in definition.get('indexes', []):
+            if len(fields) == 1 and fields[0] in geometries:
+                index = GridIndex(fields[0])
+            else:
+                index = SortedIndex(fields)
+            indexes[tuple(fields)] = index
+            for record_id, doc in data.items():
+                index.add(record_id, doc['data'])
+        self._db['indexes'][model_id] = indexes
+
+    def __index(self, model_id, record_id, record):
+        for index in self._db['indexes'].get(model_id, {}).values():
+            index.add(record_id, record)
+
+    def __unindex(self, model_id, record_id):
+        for index in self._db['indexes'].get(model_id, {}).values():
+            index.remove(record_id)
+
+    def __indexed_records(self, model_id, filters):
+        """Returns the sorted ids of the records which may match the
+        filters, read from a secondary index, or ``None`` if none of the
+        indexes of the model can be used.
+        """
+        indexes = self._db['indexes'].get(model_id, {})
+        for field, operator, box in filters:
+            index = indexes.get((field,))
+            if operator == 'bbox' and isinstance(index, GridIndex):
+                return sorted(index.lookup(box))
+
+        sorted_indexes = [fields for fields, index in indexes.items()
+                          if isinstance(index, SortedIndex)]
+        fields, ranges = choose_index(sorted_indexes, filters)
+        if fields is None:
+            return None
+        records_ids = set()
+        for start, end in ranges:
+            records_ids.update(indexes[fields].lookup(start, end))
+        return sorted(records_ids)
+
+    def __record(self, item, fields):
+        """Returns the record of a stored document, with only the specified
+        fields if any.
+        """
+        data = item['data']
+        if fields is None:
+            record = data.copy()
+        else:
+            record = dict((field, data[field]) for field in fields
+                          if field in data)
+        record['id'] = item['_id']
+        return record
+
+    def get_records(self, model_id, limit=None, start=None, filters=None,
+                    fields=None):
+        """Returns the records of a model, ordered by id.
+
+        :param limit: maximum number of records to return.
+        :param start: if specified, only records whose id follow this one
+                      are returned.
+        :param filters: if specified, only records matching them are
+                        returned (see :mod:`daybed.backends.filters`).
+        :param fields: if specified, only these fields of the records are
+                       returned, with their id.
+        """
+        # Check that model_id exists and raises if not.
+        self.__get_model(model_id)
+        records_ids = self._db['index'].get(model_id, [])
+        if filters:
+            indexed = self.__indexed_records(model_id, filters)
+            if indexed is not None:
+                records_ids = indexed
+        first = bisect_right(records_ids, start) if start is not None else 0
+        last = len(records_ids)
+        if limit is not None and not filters:
+            last = first + limit
+
+        records = []
+        data = self._db['data'][model_id]
+        for record_id in records_ids[first:last]:
+            item = data[record_id]
+            if filters and not matches(item['data'], filters):
+                continue
+            records.append(self.__record(item, fields))
+            if len(records) == limit:
+                break
+        return records
+
+    def iter_records(self, model_id, filters=None, fields=None):
+        """Yields the records of a model one by one, ordered by id."""
+        # Check that model_id exists and raises if not.
+        self.__get_model(model_id)
+        records_ids = list(self._db['index'].get(model_id, []))
+        if filters:
+            indexed = self.__indexed_records(model_id, filters)
+            if indexed is not None:
+                records_ids = indexed
+        data = self._db['data'][model_id]
+
+        def records():
+            for record_id in records_ids:
+                item = data.get(record_id)
+                if item is None:
+                    continue
+                if filters and not matches(item['data'], filters):
+                    continue
+                yield self.__record(item, fields)
+        return records()
+
+    def get_sorted_records(self, model_id, sort, limit=None, offset=0,
+                           filters=None, fields=None):
+        """Returns the records of a model in the specified sort (see
+        :mod:`daybed.backends.sorting`), skipping the first ``offset`` ones.
+
+        Records are read in order from the secondary index of the sorted
+        fields if it is declared, unless the filters can use an index.
+        """
+        # Check that model_id exists and raises if not.
+        self.__get_model(model_id)
+        indexes = self._db['indexes'].get(model_id, {})
+        index = sort_index([names for names, index in indexes.items()
+                            if isinstance(index, SortedIndex)], sort)
+        if index is None or (filters and self.__indexed_records(
+                model_id, filters) is not None):
+            records = self.iter_records(model_id, filters=filters)
+            records = sort_records(records, sort, limit, offset)
+            return [project(record, fields) for record in records]
+
         records = []
-        for item in self.__get_records(model_id):
-            item['data']['id'] = item['_id']
-            records.append(deepcopy(item['data']))
+        data = self._db['data'][model_id]
+        for record_id in indexes[index].ids(reverse=sort[0][1]):
+            item = data[record_id]
+            if filters and not matches(item['data'], filters):
+                continue
+            if offset:
+                offset -= 1
+                continue
+            records.append(self.__record(item, fields))
+            if len(records) == limit:
+                break
         return records
 
+    def get_nearest_records(self, model_id, field, point, limit=None,
+                            filters=None):
+        """Returns the records of a model the nearest to a point, by the
+        distance to the bounding box of their ``field`` geometry.
+
+        The spatial index of the field is used if it is declared and the
+        number of records is limited.
+        """
+        indexes = self._db['indexes'].get(model_id, {})
+        if limit is not None and isinstance(indexes.get((field,)),
+                                            GridIndex):
+            return search_nearest(self.get_records, model_id, field, point,
+                                  limit, filters)
+        return nearest_records(self.iter_records(model_id, filters=filters),
+                               field, point, limit)
+
     def __get_record(self, model_id, record_id):
         try:
-            return deepcopy(self._db['data'][model_id][record_id])
+            return self._db['data'][model_id][record_id]
         except KeyError:
             raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
 
@@ -48,6 +241,12 @@ class Database(object):
         doc = self.__get_record(model_id, record_id)
         return doc['authors']
 
+    def get_record_document(self, model_id, record_id):
+        """Returns the record document (data, authors and revision)."""
+        doc = self.__get_record(model_id, record_id)
+        return {'data': doc['data'], 'authors': doc['authors'],
+                'revision': self.get_model_revision(model_id)}
+
     def put_model(self, definition, roles, policy_id, model_id=None):
         if model_id is None:
             model_id = self.generate_id()
@@ -55,14 +254,18 @@ class Database(object):
         # Check that policyid exists and raises if not.
         self.get_policy(policy_id)
 
-        self._db['models'][model_id] = {
+        self._db['models'][model_id] = freeze({
             'type': 'definition',
             '_id': model_id,
             'definition': definition,
             'roles': roles,
             'policy_id': policy_id
-        }
-        self._db['data'][model_id] = {}
+        })
+        # The records of an existing model are kept.
+        self._db['data'].setdefault(model_id, {})
+        self._db['index'].setdefault(model_id, [])
+        self.__build_indexes(model_id, definition)
+        self.__touch(model_id)
         return model_id
 
     def put_record(self, model_id, record, authors, record_id=None):
@@ -81,46 +284,125 @@ class Database(object):
             else:
                 authors = list(set(authors) | set(old_doc['authors']))
                 doc['authors'] = authors
-                old_doc.update(doc)
-                doc = old_doc
+                doc = dict(old_doc, **doc)
         else:
             record_id = self.generate_id()
             doc['_id'] = record_id
 
-        self._db['data'][model_id][record_id] = doc
+        if record_id not in self._db['data'][model_id]:
+            insort(self._db['index'][model_id], record_id)
+        self._db['data'][model_id][record_id] = freeze(doc)
+        self.__index(model_id, record_id, record)
+        self.__touch(model_id)
         return record_id
 
+    def put_records(self, model_id, records, authors):
+        """Creates several records at once, and returns their ids."""
+        created = [self.generate_id() for record in records]
+        docs = {}
+        for record_id, record in zip(created, records):
+            docs[record_id] = freeze({
+                'type': 'data',
+                'authors': authors,
+                'model_id': model_id,
+                'data': record,
+                '_id': record_id
+            })
+
+        self._db['data'][model_id].update(docs)
+        for record_id, record in zip(created, records):
+            self.__index(model_id, record_id, record)
+        records_ids = self._db['index'][model_id]
+        records_ids.extend(created)
+        records_ids.sort()
+        self.__touch(model_id)
+        return created
+
+    def replace_records(self, model_id, records, authors):
+        """Replaces the records of a model by the specified ones, and
+        returns their ids.
+
+        Records with an ``id`` are created or updated, other ones are
+        created. Existing records missing from the list are deleted, and
+        unchanged ones are left untouched.
+        """
+        definition = self.__get_model(model_id)['definition']
+        existing = self._db['data'].get(model_id, {})
+        docs = {}
+        records_ids = []
+        for record in records:
+            record = record.copy()
+            record_id = record.pop('id', None) or self.generate_id()
+            old_doc = existing.get(record_id)
+            if old_doc is None:
+                doc = freeze({
+                    'type': 'data',
+                    'authors': authors,
+                    'model_id': model_id,
+                    'data': record,
+                    '_id': record_id
+                })
+            elif (old_doc['data'] != record or
+                  not set(authors) <= set(old_doc['authors'])):
+                doc_authors = list(set(authors) | set(old_doc['authors']))
+                doc = freeze(dict(old_doc, data=record, authors=doc_authors))
+            else:
+                doc = old_doc
+            docs[record_id] = doc
+            records_ids.append(record_id)
+
+        self._db['data'][model_id] = docs
+        self._db['index'][model_id] = sorted(docs)
+        self.__build_indexes(model_id, definition)
+        self.__touch(model_id)
+        return records_ids
+
     def delete_record(self, model_id, record_id):
         doc = self.__get_record(model_id, record_id)
         if doc:
             del self._db['data'][model_id][record_id]
+            records_ids = self._db['index'][model_id]
+            del records_ids[bisect_left(records_ids, record_id)]
+            self.__unindex(model_id, record_id)
+            self.__touch(model_id)
         return doc
 
     def delete_records(self, model_id):
-        results = self.__get_records(model_id)
-        records_ids = [r['_id'] for r in results]
-        for record_id in records_ids:
-            self.delete_record(model_id, record_id)
-        return results
+        """Deletes all the records of a model, and returns their number.
+
+        The records, their sorted ids and the indexes are emptied at once.
+        """
+        definition = self.__get_model(model_id)['definition']
+        deleted = len(self._db['data'].get(model_id, {}))
+        self._db['data'][model_id] = {}
+        self._db['index'][model_id] = []
+        self.__build_indexes(model_id, definition)
+        self.__touch(model_id)
+        return deleted
 
     def delete_model(self, model_id):
         self.delete_records(model_id)
         doc = self._db['models'][model_id]
         del self._db['models'][model_id]
+        self._db['index'].pop(model_id, None)
+        self._db['indexes'].pop(model_id, None)
+        self._db['revisions'].pop(model_id, None)
         return doc
 
     def put_roles(self, model_id, roles):
-        doc = self.__get_model(model_id)
+        doc = self.__get_model(model_id).copy()
         doc['roles'] = roles
-        self._db['models'][model_id] = doc
+        doc = self._db['models'][model_id] = freeze(doc)
+        self.__touch(model_id)
         return doc
 
     def add_role(self, model_id, role_name, users):
-        doc = self.__get_model(model_id)
-        roles = doc['roles']
+        doc = self.__get_model(model_id).copy()
+        roles = doc['roles'] = doc['roles'].copy()
         existing_users = set(roles.get(role_name, []))
         roles[role_name] = list(existing_users | set(users))
-        self._db['models'][model_id] = doc
+        self._db['models'][model_id] = freeze(doc)
+        self.__touch(model_id)
 
     def get_roles(self, model_id):
         doc = self.__get_model(model_id)
@@ -135,12 +417,12 @@ class Database(object):
         doc = self.__get_user(username)
         groups = doc['user']['groups']
         if group not in groups:
-            groups.append(group)
-        self._db['users'][username] = doc
+            user = dict(doc['user'], groups=groups + [group])
+            self._db['users'][username] = freeze(dict(doc, user=user))
 
     def __get_user(self, username):
         try:
-            return deepcopy(self._db['users'][username])
+            return self._db['users'][username]
         except KeyError:
             raise UserNotFound(username)
 
@@ -163,9 +445,9 @@ class Database(object):
         if 'groups' not in user:
             user['groups'] = []
 
-        doc = dict(user=user, name=username, type='user')
+        doc = freeze(dict(user=user, name=username, type='user'))
         self._db['users'][username] = doc
-        return user
+        return doc['user']
 
     def get_policies(self):
         policies = []
@@ -188,11 +470,11 @@ class Database(object):
             self.__get_policy(policy_name)
             raise PolicyAlreadyExist(policy_name)
         except PolicyNotFound:
-            self._db['policies'][policy_name] = {
+            self._db['policies'][policy_name] = freeze({
                 'type': 'policy',
                 'name': policy_name,
                 'policy': policy
-            }
+            })
 
     def delete_policy(self, policy_name):
         doc = self.__get_policy(policy_name)
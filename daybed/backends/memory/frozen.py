@@ -0,0 +1,66 @@
+from copy import deepcopy
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError('%s object is immutable' % self.__class__.__name__)
+
+
+class FrozenDict(dict):
+    """A ``dict`` which cannot be modified once built.
+
+    Being a ``dict``, it remains JSON serializable and comparable to regular
+    dicts. Use ``copy()`` to obtain a modifiable (shallow) copy.
+    """
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict((k, deepcopy(v, memo)) for k, v in self.items())
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+class FrozenList(list):
+    """A ``list`` which cannot be modified once built.
+
+    Use ``copy()`` to obtain a modifiable (shallow) copy.
+    """
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    __setslice__ = __delslice__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+    clear = _immutable
+
+    def copy(self):
+        return list(self)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [deepcopy(v, memo) for v in self]
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+
+def freeze(value):
+    """Returns an immutable version of the specified value.
+
+    Frozen parts of the value are reused as is, so that a document can be
+    modified by building a new one sharing its unchanged parts.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(v) for v in value)
+    return value
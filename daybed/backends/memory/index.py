@@ -0,0 +1,111 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+from itertools import islice
+
+from daybed.backends import spatial
+from daybed.backends.sorting import sort_key
+
+
+class SortedIndex(object):
+    """Secondary index of the records of a model: their ids, sorted by the
+    values of the specified fields.
+    """
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        # Sorted (key, record id) pairs.
+        self._entries = []
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, values):
+        return tuple(sort_key(value) for value in values)
+
+    def add(self, record_id, record):
+        self.remove(record_id)
+        key = self.key(record.get(field) for field in self.fields)
+        insort(self._entries, (key, record_id))
+        self._keys[record_id] = key
+
+    def remove(self, record_id):
+        key = self._keys.pop(record_id, None)
+        if key is not None:
+            del self._entries[bisect_left(self._entries, (key, record_id))]
+
+    def ids(self, reverse=False):
+        """Yields the ids of the records, ordered by the values."""
+        entries = reversed(self._entries) if reverse else self._entries
+        for key, record_id in entries:
+            yield record_id
+
+    def lookup(self, start, end):
+        """Yields the ids of the records whose values begin with ``start``
+        or follow it, and begin with ``end`` or precede it, ordered by the
+        values.
+        """
+        start = self.key(start)
+        end = self.key(end)
+        first = bisect_left(self._entries, (start,))
+        for key, record_id in islice(self._entries, first, None):
+            if key[:len(end)] > end:
+                break
+            yield record_id
+
+
+class GridIndex(object):
+    """Spatial index of the records of a model: their ids by the cells of
+    the grid covered by the bounding box of a geometry field.
+    """
+    def __init__(self, field):
+        self.fields = (field,)
+        self._cells = defaultdict(set)
+        # Records covering too many cells.
+        self._large = set()
+        self._bounds = {}
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def add(self, record_id, record):
+        self.remove(record_id)
+        box = spatial.bounds(record.get(self.fields[0]))
+        if box is None:
+            return
+        cells = spatial.cells(box)
+        if cells is None:
+            self._large.add(record_id)
+        else:
+            for cell in cells:
+                self._cells[cell].add(record_id)
+        self._bounds[record_id] = (box, cells)
+
+    def remove(self, record_id):
+        box, cells = self._bounds.pop(record_id, (None, None))
+        if box is None:
+            return
+        if cells is None:
+            self._large.discard(record_id)
+            return
+        for cell in cells:
+            self._cells[cell].discard(record_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def lookup(self, box):
+        """Returns the ids of the records whose bounding box intersects the
+        specified one.
+        """
+        (x0, y0), (x1, y1) = spatial.cells_range(box)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            # Fewer cells are used than covered by the box.
+            cells = [cell for cell in self._cells
+                     if x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1]
+        else:
+            cells = [(x, y) for x in range(x0, x1 + 1)
+                     for y in range(y0, y1 + 1) if (x, y) in self._cells]
+        candidates = set(self._large)
+        for cell in cells:
+            candidates.update(self._cells[cell])
+        return set(record_id for record_id in candidates
+                   if spatial.intersects(self._bounds[record_id][0], box))
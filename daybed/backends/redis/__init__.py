@@ -0,0 +1,5 @@
+from .backend import RedisBackend
+
+__all__ = [
+    'RedisBackend'
+]
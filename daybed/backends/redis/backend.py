@@ -0,0 +1,39 @@
+import redis
+
+from daybed.backends.cached import PoliciesCache
+from .database import Database
+
+
+class RedisBackend(object):
+    """Stores models, records, users and policies in Redis.
+
+    The server is specified by the ``backend.db_url`` setting, for
+    instance ``redis://localhost:6379/0``. Keys are prefixed with
+    ``backend.db_prefix`` (``daybed:`` by default).
+    """
+    def db(self):
+        return Database(self._client, self._generate_id, prefix=self.prefix,
+                        batch_size=self.batch_size)
+
+    def __init__(self, config):
+        settings = config.registry.settings
+
+        pool_size = int(settings.get('backend.pool_size', 10))
+        self._client = redis.StrictRedis.from_url(
+            settings['backend.db_url'], decode_responses=True,
+            max_connections=pool_size)
+        self.prefix = settings.get('backend.db_prefix', 'daybed:')
+        self.batch_size = int(settings.get('backend.batch_size', 1000))
+
+        # model id generator
+        generator = config.maybe_dotted(settings['daybed.id_generator'])
+        self._generate_id = generator(config)
+
+        # Policies may be modified by other processes.
+        self.policies = PoliciesCache(shared=True)
+
+    def delete_db(self):
+        keys = list(self._client.scan_iter(match=self.prefix + '*'))
+        for i in range(0, len(keys), self.batch_size):
+            self._client.delete(*keys[i:i + self.batch_size])
+        self.policies.invalidate()
@@ -0,0 +1,623 @@
+from bisect import bisect_right
+from itertools import islice
+import json
+from uuid import uuid4
+
+from redis import WatchError
+
+from daybed.backends.exceptions import (
+    UserAlreadyExist, UserNotFound, ModelNotFound,
+    PolicyNotFound, PolicyAlreadyExist, RecordNotFound
+)
+from daybed.backends.filters import choose_index, filter_records, matches
+from daybed.backends.sorting import project, sort_records
+from daybed.backends.spatial import nearest_records, spatial_indexes
+from .index import index_member, lex_range, member_id
+
+
+class Database(object):
+    """Object handling all the interactions with Redis.
+
+    Keys (all prefixed):
+
+    * ``model:<model_id>``: hash of the model definition, roles and policy;
+    * ``records:<model_id>``: hash of the records data, by record id;
+    * ``index:<model_id>``: records ids, sorted for listings;
+    * ``authors:<model_id>:<record_id>``: set of the record authors;
+    * ``values:<model_id>:<fields>``: secondary index of the records on the
+      fields (a JSON list) declared by the ``indexes`` of the definition,
+      sorted by values (see :mod:`daybed.backends.redis.index`);
+    * ``revision:<model_id>``: changed whenever the model or its records
+      are modified;
+    * ``policy_models:<policy_name>``: set of the models using a policy;
+    * ``users`` and ``policies``: hashes of users and policies, by name;
+    * ``policies_revision``: changed whenever a policy is modified.
+
+    Operations touching several keys are sent in a single pipeline.
+    """
+
+    def __init__(self, client, generate_id, prefix='daybed:',
+                 batch_size=1000):
+        self._client = client
+        self.generate_id = generate_id
+        self.prefix = prefix
+        self.batch_size = batch_size
+
+    def _key(self, *parts):
+        return self.prefix + u':'.join(parts)
+
+    def __get_model(self, model_id, client=None):
+        client = client or self._client
+        doc = client.hgetall(self._key('model', model_id))
+        if not doc:
+            raise ModelNotFound(model_id)
+        return {
+            'type': 'definition',
+            '_id': model_id,
+            'definition': json.loads(doc['definition']),
+            'roles': json.loads(doc['roles']),
+            'policy_id': doc['policy_id']
+        }
+
+    def __check_model(self, model_id):
+        if not self._client.exists(self._key('model', model_id)):
+            raise ModelNotFound(model_id)
+
+    def __indexes(self, definition):
+        """Returns the fields of the secondary indexes declared by the
+        definition. Spatial indexes are not supported.
+        """
+        geometries = spatial_indexes(definition)
+        return [tuple(fields) for fields in definition.get('indexes', [])
+                if len(fields) > 1 or fields[0] not in geometries]
+
+    def __index_key(self, model_id, fields):
+        return self._key('values', model_id, json.dumps(list(fields)))
+
+    def __reindex(self, pipe, model_id, indexes, old, new):
+        """Adds the commands replacing the ``old`` records by the ``new``
+        ones in the secondary indexes to the pipeline, both by record id.
+        """
+        for fields in indexes:
+            removed = set(index_member(fields, record_id, record)
+                          for record_id, record in old.items())
+            added = set(index_member(fields, record_id, record)
+                        for record_id, record in new.items())
+            key = self.__index_key(model_id, fields)
+            if removed - added:
+                pipe.zrem(key, *(removed - added))
+            if added - removed:
+                pipe.zadd(key, dict((member, 0)
+                                    for member in added - removed))
+
+    def __indexed_ids(self, model_id, filters):
+        """Returns the sorted ids of the records which may match the
+        filters, read from a secondary index, or ``None`` if none of the
+        indexes of the model can be used.
+        """
+        definition = self.__get_model(model_id)['definition']
+        fields, ranges = choose_index(self.__indexes(definition), filters)
+        if fields is None:
+            return None
+        pipe = self._client.pipeline(transaction=False)
+        for start, end in ranges:
+            pipe.zrangebylex(self.__index_key(model_id, fields),
+                             *lex_range(start, end))
+        return sorted(set(member_id(fields, member)
+                          for members in pipe.execute()
+                          for member in members))
+
+    def __matching_records(self, model_id, records_ids, filters):
+        """Yields the records of the specified ids matching the filters,
+        fetched by batches of ``batch_size``.
+        """
+        key = self._key('records', model_id)
+        for i in range(0, len(records_ids), self.batch_size):
+            batch = records_ids[i:i + self.batch_size]
+            for record_id, value in zip(batch, self._client.hmget(key, batch)):
+                if value is None:
+                    continue
+                record = json.loads(value)
+                record['id'] = record_id
+                if matches(record, filters):
+                    yield record
+
+    def get_model(self, model_id):
+        """Returns the model document (definition, roles and policy id)."""
+        return self.__get_model(model_id)
+
+    def get_model_definition(self, model_id):
+        return self.__get_model(model_id)['definition']
+
+    def __touch(self, pipe, model_id):
+        """Adds the command changing the revision of the model to the
+        pipeline.
+        """
+        pipe.set(self._key('revision', model_id), uuid4().hex)
+
+    def get_model_revision(self, model_id):
+        """Returns the revision of the model, which changes whenever the
+        model or its records are modified.
+        """
+        pipe = self._client.pipeline(transaction=False)
+        pipe.exists(self._key('model', model_id))
+        pipe.get(self._key('revision', model_id))
+        exists, revision = pipe.execute()
+        if not exists:
+            raise ModelNotFound(model_id)
+        return revision or u'0'
+
+    def get_record_revision(self, model_id, record_id):
+        """Returns the revision of the record, which changes whenever the
+        record is modified.
+        """
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hexists(self._key('records', model_id), record_id)
+        pipe.get(self._key('revision', model_id))
+        exists, revision = pipe.execute()
+        if not exists:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return revision or u'0'
+
+    def get_records(self, model_id, limit=None, start=None, filters=None,
+                    fields=None):
+        """Returns the records of a model, ordered by id.
+
+        :param limit: maximum number of records to return.
+        :param start: if specified, only records whose id follow this one
+                      are returned.
+        :param filters: if specified, only records matching them are
+                        returned (see :mod:`daybed.backends.filters`).
+        :param fields: if specified, only these fields of the records are
+                       returned, with their id.
+        """
+        if filters:
+            records_ids = self.__indexed_ids(model_id, filters)
+            if records_ids is None:
+                records = filter_records(self.get_records, model_id,
+                                         filters, limit, start,
+                                         self.batch_size)
+            else:
+                if start is not None:
+                    records_ids = records_ids[bisect_right(records_ids,
+                                                           start):]
+                records = islice(self.__matching_records(
+                    model_id, records_ids, filters), limit)
+            return [project(record, fields) for record in records]
+
+        pipe = self._client.pipeline(transaction=False)
+        pipe.exists(self._key('model', model_id))
+        pipe.zrangebylex(self._key('index', model_id),
+                         '-' if start is None else u'(%s' % start, '+',
+                         start=None if limit is None else 0, num=limit)
+        exists, records_ids = pipe.execute()
+        if not exists:
+            raise ModelNotFound(model_id)
+        if not records_ids:
+            return []
+
+        values = self._client.hmget(self._key('records', model_id),
+                                    records_ids)
+        records = []
+        for record_id, value in zip(records_ids, values):
+            if value is not None:
+                record = json.loads(value)
+                record['id'] = record_id
+                records.append(project(record, fields))
+        return records
+
+    def iter_records(self, model_id, batch_size=None, filters=None,
+                     fields=None):
+        """Yields the records of a model one by one, ordered by id.
+
+        Records are fetched by batches of ``batch_size``, from a secondary
+        index if the filters can use one.
+        """
+        if filters:
+            records_ids = self.__indexed_ids(model_id, filters)
+            if records_ids is not None:
+                return (project(record, fields)
+                        for record in self.__matching_records(
+                            model_id, records_ids, filters))
+
+        batch_size = batch_size or self.batch_size
+        records = self.get_records(model_id, limit=batch_size)
+
+        def batches(records):
+            while True:
+                for record in records:
+                    if not filters or matches(record, filters):
+                        yield project(record, fields)
+                if len(records) < batch_size:
+                    break
+                records = self.get_records(model_id, limit=batch_size,
+                                           start=records[-1]['id'])
+        return batches(records)
+
+    def get_sorted_records(self, model_id, sort, limit=None, offset=0,
+                           filters=None, fields=None):
+        """Returns the records of a model in the specified sort (see
+        :mod:`daybed.backends.sorting`), skipping the first ``offset`` ones.
+
+        Records are sorted once read, from a secondary index if the filters
+        can use one.
+        """
+        records = sort_records(self.iter_records(model_id, filters=filters),
+                               sort, limit, offset)
+        return [project(record, fields) for record in records]
+
+    def get_nearest_records(self, model_id, field, point, limit=None,
+                            filters=None):
+        """Returns the records of a model the nearest to a point, by the
+        distance to the bounding box of their ``field`` geometry.
+
+        Spatial indexes are not supported: all records are read.
+        """
+        return nearest_records(self.iter_records(model_id, filters=filters),
+                               field, point, limit)
+
+    def get_record(self, model_id, record_id):
+        value = self._client.hget(self._key('records', model_id), record_id)
+        if value is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return json.loads(value)
+
+    def get_record_authors(self, model_id, record_id):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hexists(self._key('records', model_id), record_id)
+        pipe.smembers(self._key('authors', model_id, record_id))
+        exists, authors = pipe.execute()
+        if not exists:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return list(authors)
+
+    def get_record_document(self, model_id, record_id):
+        """Returns the record document (data, authors and revision)."""
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hget(self._key('records', model_id), record_id)
+        pipe.smembers(self._key('authors', model_id, record_id))
+        pipe.get(self._key('revision', model_id))
+        value, authors, revision = pipe.execute()
+        if value is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return {'data': json.loads(value), 'authors': list(authors),
+                'revision': revision or u'0'}
+
+    def put_model(self, definition, roles, policy_id, model_id=None):
+        if model_id is None:
+            model_id = self.generate_id()
+
+        # Check that policyid exists and raises if not.
+        self.get_policy(policy_id)
+
+        key = self._key('model', model_id)
+        old_policy_id, old_definition = self._client.hmget(
+            key, 'policy_id', 'definition')
+        old_indexes = []
+        if old_definition is not None:
+            old_indexes = self.__indexes(json.loads(old_definition))
+        indexes = self.__indexes(definition)
+
+        # An existing model is updated in place, its records are kept.
+        pipe = self._client.pipeline()
+        pipe.hset(key, mapping={'definition': json.dumps(definition),
+                                'roles': json.dumps(roles),
+                                'policy_id': policy_id})
+        if old_policy_id is not None:
+            pipe.srem(self._key('policy_models', old_policy_id), model_id)
+        pipe.sadd(self._key('policy_models', policy_id), model_id)
+        # Secondary indexes are built again if they changed.
+        if indexes != old_indexes:
+            if old_indexes:
+                pipe.delete(*[self.__index_key(model_id, fields)
+                              for fields in old_indexes])
+            records = self._client.hgetall(self._key('records', model_id))
+            self.__reindex(pipe, model_id, indexes, {}, dict(
+                (record_id, json.loads(value))
+                for record_id, value in records.items()))
+        self.__touch(pipe, model_id)
+        pipe.execute()
+        return model_id
+
+    def __put_records(self, pipe, model_id, records, authors, indexes=(),
+                      old=None):
+        """Adds the commands storing the specified records, by id, to the
+        pipeline. Authors are added to the existing ones.
+
+        :param indexes: the secondary indexes of the model.
+        :param old: the records being replaced, by id.
+        """
+        pipe.hset(self._key('records', model_id),
+                  mapping=dict((record_id, json.dumps(record))
+                               for record_id, record in records.items()))
+        pipe.zadd(self._key('index', model_id),
+                  dict((record_id, 0) for record_id in records))
+        for record_id in records:
+            pipe.sadd(self._key('authors', model_id, record_id), *authors)
+        self.__reindex(pipe, model_id, indexes, old or {}, records)
+        self.__touch(pipe, model_id)
+
+    def put_record(self, model_id, record, authors, record_id=None):
+        definition = self.__get_model(model_id)['definition']
+        indexes = self.__indexes(definition)
+        old = {}
+        if record_id is None:
+            record_id = self.generate_id()
+        elif indexes:
+            value = self._client.hget(self._key('records', model_id),
+                                      record_id)
+            if value is not None:
+                old[record_id] = json.loads(value)
+
+        pipe = self._client.pipeline()
+        self.__put_records(pipe, model_id, {record_id: record}, authors,
+                           indexes, old)
+        pipe.execute()
+        return record_id
+
+    def put_records(self, model_id, records, authors):
+        """Creates several records at once, in a single pipeline, and
+        returns their ids.
+        """
+        definition = self.__get_model(model_id)['definition']
+        created = [self.generate_id() for record in records]
+        if records:
+            pipe = self._client.pipeline()
+            self.__put_records(pipe, model_id, dict(zip(created, records)),
+                               authors, self.__indexes(definition))
+            pipe.execute()
+        return created
+
+    def replace_records(self, model_id, records, authors):
+        """Replaces the records of a model by the specified ones, and
+        returns their ids.
+
+        Records with an ``id`` are created or updated, other ones are
+        created. Existing records missing from the list are deleted, and
+        unchanged ones are left untouched.
+        """
+        definition = self.__get_model(model_id)['definition']
+        indexes = self.__indexes(definition)
+        existing = self._client.hgetall(self._key('records', model_id))
+
+        docs = {}
+        records_ids = []
+        for record in records:
+            record = record.copy()
+            record_id = record.pop('id', None) or self.generate_id()
+            docs[record_id] = record
+            records_ids.append(record_id)
+
+        # Authors of the records which may be unchanged.
+        same = [record_id for record_id, record in docs.items()
+                if record_id in existing and
+                json.loads(existing[record_id]) == record]
+        pipe = self._client.pipeline(transaction=False)
+        for record_id in same:
+            pipe.smembers(self._key('authors', model_id, record_id))
+        for record_id, record_authors in zip(same, pipe.execute()):
+            if set(authors) <= record_authors:
+                del docs[record_id]
+
+        # Replaced and deleted records, to be removed from the indexes.
+        old = dict((record_id, json.loads(existing[record_id]))
+                   for record_id in docs if record_id in existing)
+        kept = set(records_ids)
+        deleted = dict((record_id, json.loads(value))
+                       for record_id, value in existing.items()
+                       if record_id not in kept)
+
+        pipe = self._client.pipeline()
+        if docs:
+            self.__put_records(pipe, model_id, docs, authors, indexes, old)
+        self.__delete_records(pipe, model_id, deleted, indexes)
+        pipe.execute()
+        return records_ids
+
+    def __delete_records(self, pipe, model_id, records, indexes=()):
+        """Adds the commands deleting the specified records, by id, to the
+        pipeline.
+
+        :param indexes: the secondary indexes of the model.
+        """
+        if not records:
+            return
+        records_ids = list(records)
+        pipe.hdel(self._key('records', model_id), *records_ids)
+        pipe.zrem(self._key('index', model_id), *records_ids)
+        pipe.delete(*[self._key('authors', model_id, record_id)
+                      for record_id in records_ids])
+        self.__reindex(pipe, model_id, indexes, records, {})
+        self.__touch(pipe, model_id)
+
+    def delete_record(self, model_id, record_id):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hget(self._key('model', model_id), 'definition')
+        pipe.hget(self._key('records', model_id), record_id)
+        pipe.smembers(self._key('authors', model_id, record_id))
+        definition, value, authors = pipe.execute()
+        if value is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+
+        pipe = self._client.pipeline()
+        self.__delete_records(pipe, model_id,
+                              {record_id: json.loads(value)},
+                              self.__indexes(json.loads(definition)))
+        pipe.execute()
+        return {
+            'type': 'data',
+            '_id': record_id,
+            'model_id': model_id,
+            'data': json.loads(value),
+            'authors': list(authors)
+        }
+
+    def delete_records(self, model_id):
+        """Deletes all the records of a model, by batches of
+        ``batch_size``, and returns their number.
+        """
+        definition = self.__get_model(model_id)['definition']
+        indexes = self.__indexes(definition)
+        index = self._key('index', model_id)
+        deleted = 0
+        while True:
+            records_ids = self._client.zrange(index, 0, self.batch_size - 1)
+            records = dict((record_id, None) for record_id in records_ids)
+            if indexes and records_ids:
+                values = self._client.hmget(self._key('records', model_id),
+                                            records_ids)
+                records = dict((record_id, json.loads(value))
+                               for record_id, value in zip(records_ids,
+                                                           values)
+                               if value is not None)
+            pipe = self._client.pipeline()
+            self.__delete_records(pipe, model_id, records, indexes)
+            pipe.execute()
+            deleted += len(records_ids)
+            if len(records_ids) < self.batch_size:
+                break
+        return deleted
+
+    def delete_model(self, model_id):
+        doc = self.__get_model(model_id)
+        self.delete_records(model_id)
+
+        pipe = self._client.pipeline()
+        pipe.delete(self._key('model', model_id),
+                    self._key('records', model_id),
+                    self._key('index', model_id),
+                    self._key('revision', model_id),
+                    *[self.__index_key(model_id, fields)
+                      for fields in self.__indexes(doc['definition'])])
+        pipe.srem(self._key('policy_models', doc['policy_id']), model_id)
+        pipe.execute()
+        return doc
+
+    def __update_roles(self, model_id, update):
+        """Applies the specified function to the roles of the model, and
+        saves them unless the model was modified concurrently, in which
+        case the update is retried.
+        """
+        key = self._key('model', model_id)
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    doc = self.__get_model(model_id, client=pipe)
+                    doc['roles'] = update(doc['roles'])
+                    pipe.multi()
+                    pipe.hset(key, 'roles', json.dumps(doc['roles']))
+                    self.__touch(pipe, model_id)
+                    pipe.execute()
+                    return doc
+                except WatchError:
+                    continue
+
+    def put_roles(self, model_id, roles):
+        """Record roles associated to the a model.
+
+        :param roles: is a dictionary containing the name of the role as a key
+                      and the related users as a value.
+        """
+        return self.__update_roles(model_id, lambda old_roles: roles)
+
+    def add_role(self, model_id, role_name, users):
+        """Add some users to a role"""
+        def add_role(roles):
+            existing_users = set(roles.get(role_name, []))
+            roles[role_name] = list(existing_users | set(users))
+            return roles
+        self.__update_roles(model_id, add_role)
+
+    def get_roles(self, model_id):
+        return self.__get_model(model_id)['roles']
+
+    def get_groups(self, username):
+        """Return the groups for a specific user"""
+        return self.get_user(username)['groups']
+
+    def add_group(self, username, group):
+        """Adds an user to an existing group"""
+        key = self._key('users')
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = pipe.hget(key, username)
+                    if value is None:
+                        raise UserNotFound(username)
+                    user = json.loads(value)
+                    if group in user['groups']:
+                        return
+                    user['groups'].append(group)
+                    pipe.multi()
+                    pipe.hset(key, username, json.dumps(user))
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def get_user(self, username):
+        """Returns the information associated with an user"""
+        value = self._client.hget(self._key('users'), username)
+        if value is None:
+            raise UserNotFound(username)
+        return json.loads(value)
+
+    def add_user(self, user):
+        user = user.copy()
+
+        if 'groups' not in user:
+            user['groups'] = []
+
+        if not self._client.hsetnx(self._key('users'), user['name'],
+                                   json.dumps(user)):
+            raise UserAlreadyExist(user['name'])
+        return user
+
+    def get_policies(self):
+        return sorted(self._client.hkeys(self._key('policies')))
+
+    def get_policy(self, policy_name):
+        value = self._client.hget(self._key('policies'), policy_name)
+        if value is None:
+            raise PolicyNotFound(policy_name)
+        return json.loads(value)
+
+    def get_policies_revision(self):
+        """Returns the revision of the policies, which changes whenever a
+        policy is created or deleted.
+        """
+        return self._client.get(self._key('policies_revision')) or u'0'
+
+    def set_policy(self, policy_name, policy):
+        if not self._client.hsetnx(self._key('policies'), policy_name,
+                                   json.dumps(policy)):
+            raise PolicyAlreadyExist(policy_name)
+        self._client.incr(self._key('policies_revision'))
+
+    def delete_policy(self, policy_name):
+        policy = self.get_policy(policy_name)
+        pipe = self._client.pipeline()
+        pipe.hdel(self._key('policies'), policy_name)
+        pipe.incr(self._key('policies_revision'))
+        pipe.execute()
+        return {
+            'type': 'policy',
+            'name': policy_name,
+            'policy': policy
+        }
+
+    def get_model_policy(self, model_id):
+        return self.get_policy(self.get_model_policy_id(model_id))
+
+    def get_model_policy_id(self, model_id):
+        policy_id = self._client.hget(self._key('model', model_id),
+                                      'policy_id')
+        if policy_id is None:
+            raise ModelNotFound(model_id)
+        return policy_id
+
+    def policy_is_used(self, policy_name):
+        return self._client.scard(self._key('policy_models',
+                                            policy_name)) > 0
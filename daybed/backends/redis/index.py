@@ -0,0 +1,72 @@
+"""Secondary indexes of the Redis backend, on the fields declared by the
+``indexes`` of the models definitions.
+
+An index is a sorted set whose members all have the same score, so that
+they are sorted lexicographically: a member is made of the encoded values of
+the indexed fields of a record, followed by the record id. Values are
+encoded so that their order is the one of
+:func:`daybed.backends.sorting.sort_key`.
+"""
+from decimal import Decimal
+import json
+import struct
+
+import six
+
+
+#: Follows each encoded value, and precedes all the characters of values.
+SEPARATOR = u'\x01'
+
+#: Characters of strings lower than the separator, escaped in order.
+ESCAPED = {u'\x00': u'\x02\x30', u'\x01': u'\x02\x31', u'\x02': u'\x02\x32'}
+
+
+def encode_value(value):
+    """Returns the encoded value: missing values come first, then numbers
+    and strings.
+    """
+    if value is None:
+        return u'0' + SEPARATOR
+    if isinstance(value, (bool, float, Decimal) + six.integer_types):
+        # Bits of the double, flipped so that they are ordered as numbers
+        # (adding 0.0 turns -0.0 into 0.0).
+        bits, = struct.unpack('>Q', struct.pack('>d', float(value) + 0.0))
+        bits = bits ^ 0xFFFFFFFFFFFFFFFF if bits >> 63 else bits | 1 << 63
+        return u'1%016x' % bits + SEPARATOR
+    if isinstance(value, six.string_types):
+        tag = u'2'
+    else:
+        tag, value = u'3', json.dumps(value, sort_keys=True)
+    return tag + u''.join(ESCAPED.get(char, char) for char in value) + \
+        SEPARATOR
+
+
+def encode_values(values):
+    return u''.join(encode_value(value) for value in values)
+
+
+def index_member(fields, record_id, record):
+    """Returns the member of the index on the specified fields of a record.
+    """
+    return encode_values(record.get(field) for field in fields) + record_id
+
+
+def member_id(fields, member):
+    """Returns the record id of a member of the index on the specified
+    fields.
+    """
+    return member.split(SEPARATOR, len(fields))[-1]
+
+
+def lex_range(start, end):
+    """Returns the ``ZRANGEBYLEX`` bounds of the members whose values
+    begin with ``start`` or follow it, and begin with ``end`` or precede it.
+    """
+    low = b'-'
+    if start:
+        low = b'[' + encode_values(start).encode('utf-8')
+    high = b'+'
+    if end:
+        # No UTF-8 byte is 0xff.
+        high = b'[' + encode_values(end).encode('utf-8') + b'\xff'
+    return low, high
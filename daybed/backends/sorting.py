@@ -0,0 +1,94 @@
+"""Records sorting and projection, as validated from the querystring by
+:func:`daybed.schemas.validators.sort_validator` and
+:func:`daybed.schemas.validators.projection_validator`.
+
+Sorts are lists of ``(field, descending)`` tuples. Records with the same
+values are ordered by id, in the direction of the last field, so that the
+order is the one of an index on the sorted fields. Backends which cannot
+read the records in order from an index sort them with
+:func:`sort_records`.
+"""
+from decimal import Decimal
+from functools import partial
+import heapq
+import json
+
+import six
+
+
+def sort_key(value):
+    """Returns a key of the specified field value, comparable with the keys
+    of other values whatever their type: missing values come first, then
+    numbers and strings.
+    """
+    if value is None:
+        return (0,)
+    if isinstance(value, (bool, float, Decimal) + six.integer_types):
+        return (1, value)
+    if isinstance(value, six.string_types):
+        return (2, value)
+    return (3, json.dumps(value, sort_keys=True))
+
+
+class Descending(object):
+    """Key of a value sorted in descending order."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+def record_key(record, sort):
+    """Returns the key of a record in the specified sort."""
+    key = []
+    for field, descending in sort:
+        value = sort_key(record.get(field))
+        key.append(Descending(value) if descending else value)
+    record_id = record.get('id')
+    key.append(Descending(record_id) if sort[-1][1] else record_id)
+    return tuple(key)
+
+
+def sort_records(records, sort, limit=None, offset=0):
+    """Returns the records of an iterable in the specified sort, skipping
+    the first ``offset`` ones.
+    """
+    key = partial(record_key, sort=sort)
+    if limit is None:
+        return sorted(records, key=key)[offset:]
+    return heapq.nsmallest(offset + limit, records, key=key)[offset:]
+
+
+def sort_index(indexes, sort):
+    """Returns the fields of the index giving the specified sort, among the
+    specified ones, or ``None``.
+
+    The fields of the index have to be the sorted ones, all of them sorted
+    in the same direction (an index can be read backwards).
+    """
+    fields = [field for field, descending in sort]
+    if len(set(descending for field, descending in sort)) > 1:
+        return None
+    for index in indexes:
+        if list(index) == fields:
+            return index
+    return None
+
+
+def project(record, fields):
+    """Returns the record with only the specified fields (and its id), or
+    the record itself if ``fields`` is ``None``.
+    """
+    if fields is None:
+        return record
+    projected = dict((field, record[field]) for field in fields
+                     if field in record)
+    if 'id' in record:
+        projected['id'] = record['id']
+    return projected
@@ -0,0 +1,147 @@
+"""Bounding boxes of the geometry fields values, and the grid of the spatial
+indexes.
+
+Boxes are ``(minx, miny, maxx, maxy)`` tuples. Spatial indexes divide the
+plane into square cells of ``CELL_SIZE``, suited to GPS coordinates, and
+reference each record from the cells its bounding box covers. Geometries
+covering more than ``MAX_CELLS`` cells are referenced apart, and always
+read.
+"""
+import heapq
+import math
+
+
+#: Types of the fields holding geometries.
+GEOMETRY_TYPES = ('point', 'line', 'polygon', 'geojson')
+
+#: Size of the cells of spatial indexes, in coordinates units.
+CELL_SIZE = 0.1
+
+#: Maximum number of cells referencing a geometry.
+MAX_CELLS = 1024
+
+#: Radius beyond which nearest records are looked for by scanning the model.
+MAX_RADIUS = CELL_SIZE * 2 ** 10
+
+
+def positions(geometry):
+    """Yields the ``(x, y)`` positions of a geometry field value: the
+    coordinates of a point, line or polygon, or a GeoJSON geometry.
+    """
+    if isinstance(geometry, dict):
+        if 'geometries' in geometry:
+            for member in geometry['geometries']:
+                for position in positions(member):
+                    yield position
+            return
+        geometry = geometry.get('coordinates')
+    if not isinstance(geometry, (list, tuple)) or not geometry:
+        return
+    if isinstance(geometry[0], (list, tuple, dict)):
+        for member in geometry:
+            for position in positions(member):
+                yield position
+    elif len(geometry) >= 2:
+        yield geometry[0], geometry[1]
+
+
+def bounds(geometry):
+    """Returns the bounding box of a geometry field value, or ``None`` if
+    it has no positions.
+    """
+    xs, ys = [], []
+    for x, y in positions(geometry):
+        xs.append(x)
+        ys.append(y)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def intersects(box, other):
+    """Returns ``True`` if the boxes intersect, borders included."""
+    if box is None or other is None:
+        return False
+    return (box[0] <= other[2] and other[0] <= box[2] and
+            box[1] <= other[3] and other[1] <= box[3])
+
+
+def distance(point, box):
+    """Returns the planar distance between a point and a box (zero if the
+    point is inside).
+    """
+    dx = max(box[0] - point[0], 0, point[0] - box[2])
+    dy = max(box[1] - point[1], 0, point[1] - box[3])
+    return math.hypot(dx, dy)
+
+
+def cell(x, y):
+    """Returns the cell of the grid containing a position."""
+    return int(math.floor(x / CELL_SIZE)), int(math.floor(y / CELL_SIZE))
+
+
+def cells_range(box):
+    """Returns the first and last cells covered by a box."""
+    return cell(box[0], box[1]), cell(box[2], box[3])
+
+
+def cells(box):
+    """Returns the cells covered by a box, or ``None`` if there are more
+    than ``MAX_CELLS``.
+    """
+    (x0, y0), (x1, y1) = cells_range(box)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_CELLS:
+        return None
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def spatial_indexes(definition):
+    """Returns the names of the geometry fields of a model definition which
+    are indexed, i.e. which are the only field of one of its indexes.
+    """
+    geometries = set(field['name'] for field in definition['fields']
+                     if field['type'] in GEOMETRY_TYPES)
+    return set(fields[0] for fields in definition.get('indexes', [])
+               if len(fields) == 1 and fields[0] in geometries)
+
+
+def nearest_records(records, field, point, limit=None):
+    """Returns the records the nearest to a point, by their distance to the
+    bounding box of their ``field`` value. Records without a geometry are
+    left out.
+    """
+    located = []
+    for record in records:
+        box = bounds(record.get(field))
+        if box is not None:
+            located.append((distance(point, box), record.get('id'), record))
+    if limit is None:
+        located.sort(key=lambda item: item[:2])
+    else:
+        located = heapq.nsmallest(limit, located, key=lambda item: item[:2])
+    return [record for _, _, record in located]
+
+
+def search_nearest(get_records, model_id, field, point, limit,
+                   filters=None):
+    """Returns the ``limit`` records the nearest to a point, read from a
+    spatial index with ``get_records(model_id, filters=filters)``.
+
+    Records are looked for in a box around the point, whose size is doubled
+    until it contains enough of them, up to ``MAX_RADIUS``.
+    """
+    filters = list(filters or [])
+    radius = CELL_SIZE
+    while radius <= MAX_RADIUS:
+        box = (point[0] - radius, point[1] - radius,
+               point[0] + radius, point[1] + radius)
+        records = get_records(model_id,
+                              filters=filters + [(field, 'bbox', box)])
+        found = nearest_records(records, field, point, limit)
+        # Records further than the radius may lie outside of the box.
+        if len(found) == limit and \
+                distance(point, bounds(found[-1][field])) <= radius:
+            return found
+        radius *= 2
+    return nearest_records(get_records(model_id, filters=filters), field,
+                           point, limit)
@@ -0,0 +1,5 @@
+from .backend import SQLBackend
+
+__all__ = [
+    'SQLBackend'
+]
@@ -0,0 +1,526 @@
+import json
+from functools import partial
+from uuid import uuid4
+
+import six
+
+from daybed.backends.exceptions import (
+    UserAlreadyExist, UserNotFound, ModelNotFound,
+    PolicyNotFound, PolicyAlreadyExist, RecordNotFound
+)
+from daybed.backends.filters import filter_records
+from daybed.backends.sorting import project, sort_records
+from daybed.backends.spatial import (bounds, cells, nearest_records,
+                                     search_nearest, spatial_indexes)
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def loads(value):
+    # Some drivers decode JSON columns themselves.
+    if isinstance(value, six.string_types):
+        return json.loads(value)
+    return value
+
+
+class Database(object):
+    """Object handling all the interactions with a SQL database.
+
+    Each method runs in its own transaction, using a connection of the pool.
+    """
+
+    def __init__(self, pool, dialect, generate_id, batch_size=1000):
+        self._pool = pool
+        self._dialect = dialect
+        self._sql = dialect.statements
+        self.generate_id = generate_id
+        self.batch_size = batch_size
+
+    def _execute(self, connection, statement, params=()):
+        cursor = connection.cursor()
+        cursor.execute(self._sql[statement], params)
+        return cursor
+
+    def _fetchone(self, statement, params=()):
+        with self._pool.transaction() as connection:
+            return self._execute(connection, statement, params).fetchone()
+
+    def __get_model(self, connection, model_id):
+        row = self._execute(connection, 'get_model', (model_id,)).fetchone()
+        if row is None:
+            raise ModelNotFound(model_id)
+        definition, roles, policy_id = row
+        return {
+            'type': 'definition',
+            '_id': model_id,
+            'definition': loads(definition),
+            'roles': loads(roles),
+            'policy_id': policy_id
+        }
+
+    def get_model(self, model_id):
+        """Returns the model document (definition, roles and policy id)."""
+        with self._pool.transaction() as connection:
+            return self.__get_model(connection, model_id)
+
+    def get_model_definition(self, model_id):
+        return self.get_model(model_id)['definition']
+
+    def __touch(self, connection, model_id):
+        """Changes the revision of the model, after it or its records were
+        modified.
+        """
+        self._execute(connection, 'touch_model', (uuid4().hex, model_id))
+
+    def get_model_revision(self, model_id):
+        """Returns the revision of the model, which changes whenever the
+        model or its records are modified.
+        """
+        row = self._fetchone('get_model_revision', (model_id,))
+        if row is None:
+            raise ModelNotFound(model_id)
+        return row[0]
+
+    def get_record_revision(self, model_id, record_id):
+        """Returns the revision of the record, which changes whenever the
+        record is modified.
+        """
+        row = self._fetchone('get_record_revision', (model_id, record_id))
+        if row is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        return row[0]
+
+    def __sql_filters(self, model_id, filters):
+        """Returns the filters which can be translated in SQL: bounding
+        boxes of geometry fields without a spatial index are matched once
+        the records are read.
+        """
+        geometries = set()
+        if any(operator == 'bbox' for _, operator, _ in filters):
+            geometries = spatial_indexes(self.get_model_definition(model_id))
+        return [(field, operator, value)
+                for field, operator, value in filters
+                if operator != 'bbox' or field in geometries]
+
+    def __select_records(self, model_id, statement, params, fields):
+        with self._pool.transaction() as connection:
+            # Check that model_id exists and raises if not.
+            self.__get_model(connection, model_id)
+            cursor = connection.cursor()
+            cursor.execute(statement, params)
+            rows = cursor.fetchall()
+
+        records = []
+        for record_id, data in rows:
+            record = loads(data)
+            if fields is not None:
+                if isinstance(record, list):
+                    # Projected values (see ``Dialect.projection``).
+                    record = dict(zip(fields, record))
+                record = dict((field, record[field]) for field in fields
+                              if record.get(field) is not None)
+            record['id'] = record_id
+            records.append(record)
+        return records
+
+    def get_records(self, model_id, limit=None, start=None, filters=None,
+                    fields=None):
+        """Returns the records of a model, ordered by id.
+
+        :param limit: maximum number of records to return.
+        :param start: if specified, only records whose id follow this one
+                      are returned.
+        :param filters: if specified, only records matching them are
+                        returned (see :mod:`daybed.backends.filters`).
+        :param fields: if specified, only these fields of the records are
+                       read, and returned with their id.
+        """
+        params = (model_id, start or u'')
+        if filters:
+            sql_filters = self.__sql_filters(model_id, filters)
+            if len(sql_filters) < len(filters):
+                get_records = partial(self.get_records, filters=sql_filters)
+                records = filter_records(get_records, model_id, filters,
+                                         limit, start, self.batch_size)
+                return [project(record, fields) for record in records]
+        if filters or fields is not None:
+            statement, filters_params = self._dialect.filter_records(
+                filters or [], limit=limit is not None, fields=fields)
+            params += tuple(filters_params)
+        elif limit is not None:
+            statement = self._sql['get_records_page']
+        else:
+            statement = self._sql['get_records']
+        if limit is not None:
+            params += (limit,)
+        return self.__select_records(model_id, statement, params, fields)
+
+    def iter_records(self, model_id, batch_size=None, filters=None,
+                     fields=None):
+        """Yields the records of a model one by one, ordered by id.
+
+        Records are fetched by batches of ``batch_size``.
+        """
+        batch_size = batch_size or self.batch_size
+        records = self.get_records(model_id, limit=batch_size,
+                                   filters=filters, fields=fields)
+
+        def batches(records):
+            while True:
+                for record in records:
+                    yield record
+                if len(records) < batch_size:
+                    break
+                records = self.get_records(model_id, limit=batch_size,
+                                           start=records[-1]['id'],
+                                           filters=filters, fields=fields)
+        return batches(records)
+
+    def get_sorted_records(self, model_id, sort, limit=None, offset=0,
+                           filters=None, fields=None):
+        """Returns the records of a model in the specified sort (see
+        :mod:`daybed.backends.sorting`), skipping the first ``offset`` ones.
+
+        Records are sorted by the database, which reads them in order from
+        the secondary index of the sorted fields if it is declared.
+        """
+        filters = filters or []
+        if len(self.__sql_filters(model_id, filters)) < len(filters):
+            records = sort_records(self.iter_records(model_id,
+                                                     filters=filters),
+                                   sort, limit, offset)
+            return [project(record, fields) for record in records]
+
+        statement, filters_params = self._dialect.filter_records(
+            filters, limit=limit is not None, fields=fields, sort=sort,
+            offset=limit is not None)
+        params = (model_id,) + tuple(filters_params)
+        if limit is not None:
+            params += (limit, offset)
+        records = self.__select_records(model_id, statement, params, fields)
+        return records if limit is not None else records[offset:]
+
+    def get_nearest_records(self, model_id, field, point, limit=None,
+                            filters=None):
+        """Returns the records of a model the nearest to a point, by the
+        distance to the bounding box of their ``field`` geometry.
+
+        The spatial index of the field is used if it is declared and the
+        number of records is limited.
+        """
+        definition = self.get_model_definition(model_id)
+        if limit is not None and field in spatial_indexes(definition):
+            return search_nearest(self.get_records, model_id, field, point,
+                                  limit, filters)
+        return nearest_records(self.iter_records(model_id, filters=filters),
+                               field, point, limit)
+
+    def __index(self, connection, model_id, geometries, records):
+        """Updates the spatial indexes of the specified geometry fields,
+        from a list of ``(record_id, record)`` tuples.
+        """
+        if not geometries:
+            return
+        cursor = connection.cursor()
+        cursor.executemany(self._sql['delete_record_cells'],
+                           [(model_id, record_id)
+                            for record_id, record in records])
+        rows = []
+        for record_id, record in records:
+            for field in geometries:
+                box = bounds(record.get(field))
+                if box is None:
+                    continue
+                for x, y in cells(box) or [(None, None)]:
+                    rows.append((model_id, record_id, field, x, y) + box)
+        if rows:
+            cursor.executemany(self._sql['insert_cell'], rows)
+
+    def __get_record(self, connection, model_id, record_id):
+        row = self._execute(connection, 'get_record',
+                            (model_id, record_id)).fetchone()
+        if row is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        data, authors = row
+        return {
+            'type': 'data',
+            '_id': record_id,
+            'model_id': model_id,
+            'data': loads(data),
+            'authors': loads(authors)
+        }
+
+    def get_record(self, model_id, record_id):
+        with self._pool.transaction() as connection:
+            return self.__get_record(connection, model_id, record_id)['data']
+
+    def get_record_authors(self, model_id, record_id):
+        with self._pool.transaction() as connection:
+            doc = self.__get_record(connection, model_id, record_id)
+        return doc['authors']
+
+    def get_record_document(self, model_id, record_id):
+        """Returns the record document (data, authors and revision)."""
+        row = self._fetchone('get_record_document', (model_id, record_id))
+        if row is None:
+            raise RecordNotFound(u'(%s, %s)' % (model_id, record_id))
+        data, authors, revision = row
+        return {'data': loads(data), 'authors': loads(authors),
+                'revision': revision}
+
+    def put_model(self, definition, roles, policy_id, model_id=None):
+        if model_id is None:
+            model_id = self.generate_id()
+
+        # Check that policyid exists and raises if not.
+        self.get_policy(policy_id)
+
+        params = (dumps(definition), dumps(roles), policy_id, uuid4().hex,
+                  model_id)
+        geometries = spatial_indexes(definition)
+        with self._pool.transaction() as connection:
+            try:
+                previous = self.__get_model(connection, model_id)
+                indexed = spatial_indexes(previous['definition'])
+            except ModelNotFound:
+                indexed = set()
+            # An existing model is updated in place, its records are kept.
+            cursor = self._execute(connection, 'update_model', params)
+            if cursor.rowcount == 0:
+                self._execute(connection, 'insert_model', params)
+            # Secondary indexes, on the fields values.
+            for fields in definition.get('indexes', []):
+                if len(fields) > 1 or fields[0] not in geometries:
+                    connection.cursor().execute(
+                        self._dialect.create_index(fields))
+            # Spatial indexes, rebuilt if their fields changed.
+            if geometries != indexed:
+                self._execute(connection, 'delete_model_cells', (model_id,))
+                rows = self._execute(connection, 'get_records_docs',
+                                     (model_id,)).fetchall()
+                self.__index(connection, model_id, geometries,
+                             [(record_id, loads(data))
+                              for record_id, data, authors in rows])
+        return model_id
+
+    def put_record(self, model_id, record, authors, record_id=None):
+        with self._pool.transaction() as connection:
+            definition = self.__get_model(connection, model_id)['definition']
+            statement = 'insert_record'
+            if record_id is not None:
+                try:
+                    old_doc = self.__get_record(connection, model_id,
+                                                record_id)
+                except RecordNotFound:
+                    pass
+                else:
+                    authors = list(set(authors) | set(old_doc['authors']))
+                    statement = 'update_record'
+            else:
+                record_id = self.generate_id()
+
+            self._execute(connection, statement,
+                          (dumps(record), dumps(authors), model_id,
+                           record_id))
+            self.__index(connection, model_id, spatial_indexes(definition),
+                         [(record_id, record)])
+            self.__touch(connection, model_id)
+        return record_id
+
+    def put_records(self, model_id, records, authors):
+        """Creates several records at once, in a single transaction, and
+        returns their ids.
+        """
+        created = [self.generate_id() for record in records]
+        authors = dumps(authors)
+        params = [(dumps(record), authors, model_id, record_id)
+                  for record_id, record in zip(created, records)]
+        with self._pool.transaction() as connection:
+            definition = self.__get_model(connection, model_id)['definition']
+            cursor = connection.cursor()
+            cursor.executemany(self._sql['insert_record'], params)
+            self.__index(connection, model_id, spatial_indexes(definition),
+                         list(zip(created, records)))
+            self.__touch(connection, model_id)
+        return created
+
+    def replace_records(self, model_id, records, authors):
+        """Replaces the records of a model by the specified ones, and
+        returns their ids.
+
+        Records with an ``id`` are created or updated, other ones are
+        created. Existing records missing from the list are deleted, and
+        unchanged ones are left untouched.
+        """
+        with self._pool.transaction() as connection:
+            definition = self.__get_model(connection, model_id)['definition']
+            rows = self._execute(connection, 'get_records_docs', (model_id,))
+            existing = dict((record_id, (loads(data), loads(doc_authors)))
+                            for record_id, data, doc_authors in rows)
+
+            created = []
+            updated = []
+            records_ids = []
+            for record in records:
+                record = record.copy()
+                record_id = record.pop('id', None) or self.generate_id()
+                records_ids.append(record_id)
+                if record_id not in existing:
+                    created.append((dumps(record), dumps(authors), model_id,
+                                    record_id))
+                    continue
+                data, doc_authors = existing.pop(record_id)
+                if data != record or not set(authors) <= set(doc_authors):
+                    doc_authors = list(set(authors) | set(doc_authors))
+                    updated.append((dumps(record), dumps(doc_authors),
+                                    model_id, record_id))
+            deleted = [(model_id, record_id) for record_id in existing]
+
+            cursor = connection.cursor()
+            for statement, params in (('insert_record', created),
+                                      ('update_record', updated),
+                                      ('delete_record', deleted),
+                                      ('delete_record_cells', deleted)):
+                if params:
+                    cursor.executemany(self._sql[statement], params)
+            self.__index(connection, model_id, spatial_indexes(definition),
+                         [(record_id, loads(data)) for data, _, _, record_id
+                          in created + updated])
+            self.__touch(connection, model_id)
+        return records_ids
+
+    def delete_record(self, model_id, record_id):
+        with self._pool.transaction() as connection:
+            doc = self.__get_record(connection, model_id, record_id)
+            self._execute(connection, 'delete_record', (model_id, record_id))
+            self._execute(connection, 'delete_record_cells',
+                          (model_id, record_id))
+            self.__touch(connection, model_id)
+        return doc
+
+    def delete_records(self, model_id):
+        """Deletes all the records of a model, and returns their number."""
+        with self._pool.transaction() as connection:
+            self.__get_model(connection, model_id)
+            cursor = self._execute(connection, 'delete_records', (model_id,))
+            deleted = cursor.rowcount
+            self._execute(connection, 'delete_model_cells', (model_id,))
+            self.__touch(connection, model_id)
+        return deleted
+
+    def delete_model(self, model_id):
+        with self._pool.transaction() as connection:
+            doc = self.__get_model(connection, model_id)
+            self._execute(connection, 'delete_records', (model_id,))
+            self._execute(connection, 'delete_model_cells', (model_id,))
+            self._execute(connection, 'delete_model', (model_id,))
+        return doc
+
+    def put_roles(self, model_id, roles):
+        with self._pool.transaction() as connection:
+            doc = self.__get_model(connection, model_id)
+            doc['roles'] = roles
+            self._execute(connection, 'update_roles',
+                          (dumps(roles), uuid4().hex, model_id))
+        return doc
+
+    def add_role(self, model_id, role_name, users):
+        with self._pool.transaction() as connection:
+            roles = self.__get_model(connection, model_id)['roles']
+            existing_users = set(roles.get(role_name, []))
+            roles[role_name] = list(existing_users | set(users))
+            self._execute(connection, 'update_roles',
+                          (dumps(roles), uuid4().hex, model_id))
+
+    def get_roles(self, model_id):
+        return self.get_model(model_id)['roles']
+
+    def get_groups(self, username):
+        """Return the groups for a specific user"""
+        return self.get_user(username)['groups']
+
+    def add_group(self, username, group):
+        """Adds an user to an existing group"""
+        with self._pool.transaction() as connection:
+            user = self.__get_user(connection, username)
+            if group not in user['groups']:
+                user['groups'].append(group)
+                self._execute(connection, 'update_user',
+                              (dumps(user), username))
+
+    def __get_user(self, connection, username):
+        row = self._execute(connection, 'get_user', (username,)).fetchone()
+        if row is None:
+            raise UserNotFound(username)
+        return loads(row[0])
+
+    def get_user(self, username):
+        """Returns the information associated with an user"""
+        with self._pool.transaction() as connection:
+            return self.__get_user(connection, username)
+
+    def add_user(self, user):
+        user = user.copy()
+
+        if 'groups' not in user:
+            user['groups'] = []
+
+        try:
+            with self._pool.transaction() as connection:
+                self._execute(connection, 'insert_user',
+                              (dumps(user), user['name']))
+        except self._dialect.IntegrityError:
+            raise UserAlreadyExist(user['name'])
+        return user
+
+    def get_policies(self):
+        with self._pool.transaction() as connection:
+            rows = self._execute(connection, 'get_policies').fetchall()
+        return [name for name, in rows]
+
+    def get_policy(self, policy_name):
+        row = self._fetchone('get_policy', (policy_name,))
+        if row is None:
+            raise PolicyNotFound(policy_name)
+        return loads(row[0])
+
+    def get_policies_revision(self):
+        """Returns the revision of the policies, which changes whenever a
+        policy is created or deleted.
+        """
+        return self._fetchone('get_revision', ('policies',))[0]
+
+    def set_policy(self, policy_name, policy):
+        try:
+            with self._pool.transaction() as connection:
+                self._execute(connection, 'insert_policy',
+                              (dumps(policy), policy_name))
+                self._execute(connection, 'touch',
+                              (uuid4().hex, 'policies'))
+        except self._dialect.IntegrityError:
+            raise PolicyAlreadyExist(policy_name)
+
+    def delete_policy(self, policy_name):
+        with self._pool.transaction() as connection:
+            row = self._execute(connection, 'get_policy',
+                                (policy_name,)).fetchone()
+            if row is None:
+                raise PolicyNotFound(policy_name)
+            self._execute(connection, 'delete_policy', (policy_name,))
+            self._execute(connection, 'touch', (uuid4().hex, 'policies'))
+        return {
+            'type': 'policy',
+            'name': policy_name,
+            'policy': loads(row[0])
+        }
+
+    def get_model_policy(self, model_id):
+        return self.get_policy(self.get_model_policy_id(model_id))
+
+    def get_model_policy_id(self, model_id):
+        return self.get_model(model_id)['policy_id']
+
+    def policy_is_used(self, policy_name):
+        return self._fetchone('policy_is_used', (policy_name,)) is not None
@@ -0,0 +1,51 @@
+import sys
+from contextlib import contextmanager
+
+import six
+from six.moves import queue
+
+
+class ConnectionPool(object):
+    """A pool of at most ``size`` DB-API connections, opened when needed.
+
+    Threads wait for a connection to be released if they are all in use.
+    """
+    def __init__(self, connect, size=5):
+        self._connect = connect
+        self._connections = queue.LifoQueue(size)
+        for i in range(size):
+            self._connections.put(None)
+
+    @contextmanager
+    def transaction(self):
+        """Yields a connection whose changes are committed on exit, or
+        rolled back if an exception is raised.
+        """
+        connection = self._connections.get()
+        try:
+            if connection is None:
+                connection = self._connect()
+            yield connection
+            connection.commit()
+        except Exception:
+            exc_info = sys.exc_info()
+            if connection is not None:
+                try:
+                    connection.rollback()
+                except Exception:
+                    # The connection is broken, a new one will be opened.
+                    connection = None
+            six.reraise(*exc_info)
+        finally:
+            self._connections.put(connection)
+
+    def close(self):
+        """Closes the opened connections."""
+        connections = []
+        while not self._connections.empty():
+            connection = self._connections.get()
+            if connection is not None:
+                connection.close()
+            connections.append(None)
+        for connection in connections:
+            self._connections.put(connection)
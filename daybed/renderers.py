@@ -3,7 +3,76 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 
-from pyramid.renderers import JSONP
+import types
+
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.renderers import JSONP as BaseJSONP, JSONP_VALID_CALLBACK
+
+
+class JSONP(BaseJSONP):
+    """JSONP renderer, which streams the rendered value if one of its items
+    is a generator (e.g. records fetched from the backend on the fly).
+
+    The response body is then produced incrementally as the WSGI
+    ``app_iter``, by chunks of ``chunk_size`` items.
+    """
+    chunk_size = 100
+
+    def __call__(self, info):
+        render = super(JSONP, self).__call__(info)
+
+        def _render(value, system):
+            streamed = None
+            if isinstance(value, dict):
+                for key, items in value.items():
+                    if isinstance(items, types.GeneratorType):
+                        streamed = key
+            if streamed is None:
+                return render(value, system)
+
+            request = system.get('request')
+            default = self._make_default(request)
+            content_type = 'application/json'
+            prefix, suffix = self._wrap(value, streamed, default)
+
+            callback = request.GET.get(self.param_name)
+            if callback is not None:
+                if not JSONP_VALID_CALLBACK.match(callback):
+                    raise HTTPBadRequest('Invalid JSONP callback function '
+                                         'name.')
+                content_type = 'application/javascript'
+                prefix = '/**/%s(%s' % (callback, prefix)
+                suffix = '%s);' % suffix
+
+            response = request.response
+            if response.content_type == response.default_content_type:
+                response.content_type = content_type
+            response.app_iter = self._stream(prefix, value[streamed], suffix,
+                                             default)
+
+        return _render
+
+    def _wrap(self, value, key, default):
+        """Returns the serialized value around the streamed list."""
+        others = dict((k, v) for k, v in value.items() if k != key)
+        prefix = self.serializer(others, default=default, **self.kw)[:-1]
+        if others:
+            prefix += ', '
+        prefix += '%s: [' % self.serializer(key)
+        return prefix, ']}'
+
+    def _stream(self, prefix, items, suffix, default):
+        chunk = [prefix]
+        separator = ''
+        for i, item in enumerate(items):
+            chunk.append(separator)
+            chunk.append(self.serializer(item, default=default, **self.kw))
+            separator = ', '
+            if (i + 1) % self.chunk_size == 0:
+                yield ''.join(chunk).encode('utf-8')
+                chunk = []
+        chunk.append(suffix)
+        yield ''.join(chunk).encode('utf-8')
 
 
 class GeoJSON(JSONP):
@@ -23,11 +92,11 @@ class GeoJSON(JSONP):
             records = value.get('data')
 
             if records is not None:
-                geojson = dict(type='FeatureCollection', features=[])
-                for record in records:
-                    feature = self._buildFeature(geom_fields, record)
-                    geojson['features'].append(feature)
-                value = geojson
+                features = (self._buildFeature(geom_fields, record)
+                            for record in records)
+                if not isinstance(records, types.GeneratorType):
+                    features = list(features)
+                value = dict(type='FeatureCollection', features=features)
 
             jsonp = super(GeoJSON, self).__call__(info)
             return jsonp(value, system)
@@ -58,12 +127,11 @@ class GeoJSON(JSONP):
         feature['id'] = record.pop('id', None)
         first = True
         for name, geomtype in geom_fields.items():
-            if geomtype == 'geojson':
-                geometry = record.pop(name)
-            else:
+            # Geometries may be missing, or left out by ``_fields``.
+            geometry = record.pop(name, None)
+            if geometry is not None and geomtype != 'geojson':
                 # Note for future: this won't work for GeometryCollection
-                coords = record.pop(name)
-                geometry = dict(type=geomtype, coordinates=coords)
+                geometry = dict(type=geomtype, coordinates=geometry)
             name = 'geometry' if first else name
             feature[name] = geometry
             first = False
@@ -24,6 +24,8 @@ class TypeRegistry(object):
 
     def __init__(self):
         self._registry = {}
+        # Incremented when types are (un)registered.
+        self.version = 0
 
     def register(self, name, klass):
         if name in self._registry:
@@ -31,11 +33,13 @@ class TypeRegistry(object):
                                                                     self._registry[name])
             raise AlreadyRegisteredError(error_msg)
         self._registry[name] = klass
+        self.version += 1
 
     def unregister(self, name):
         if name not in self._registry:
             raise NotRegisteredError('The model %s is not registered' % name)
         del self._registry[name]
+        self.version += 1
 
     def validation(self, typename, **options):
         try:
@@ -73,6 +77,8 @@ class TypeField(object):
     required = True
     default_value = null
     hint = u''
+    # Operators of the records filters on fields of this type.
+    operators = ('eq', 'in')
 
     @classmethod
     def definition(cls):
@@ -35,12 +35,14 @@ __all__ = ['IntField', 'StringField', 'RangeField',
 class IntField(TypeField):
     node = Int
     hint = _('An integer')
+    operators = ('eq', 'in', 'gt', 'lt')
 
 
 @registry.add('string')
 class StringField(TypeField):
     node = String
     hint = _('A set of characters')
+    operators = ('eq', 'in', 'prefix')
 
 
 @registry.add('text')
@@ -53,6 +55,7 @@ class TextField(TypeField):
 class DecimalField(TypeField):
     node = Decimal
     hint = _('A decimal number')
+    operators = ('eq', 'in', 'gt', 'lt')
 
 
 @registry.add('boolean')
@@ -83,6 +86,7 @@ class EnumField(TypeField):
 class ChoicesField(TypeField):
     node = JSONList
     hint = _('Some choices among values')
+    operators = ('contains',)
 
     @classmethod
     def definition(cls):
@@ -101,6 +105,7 @@ class ChoicesField(TypeField):
 class RangeField(TypeField):
     node = Int
     hint = _('A number with limits')
+    operators = ('eq', 'in', 'gt', 'lt')
 
     @classmethod
     def definition(cls):
@@ -174,6 +179,7 @@ class AutoNowMixin(object):
     """Mixin to share ``auto_now`` mechanism for both date and datetime fields.
     """
     auto_now = False
+    operators = ('eq', 'in', 'gt', 'lt')
 
     @classmethod
     def definition(cls):
@@ -214,6 +220,8 @@ class DateTimeField(AutoNowMixin, TypeField):
 
 @registry.add('group')
 class GroupField(TypeField):
+    operators = ()
+
     @classmethod
     def definition(cls):
         schema = super(GroupField, cls).definition()
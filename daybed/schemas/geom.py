@@ -103,6 +103,7 @@ class GeometryField(TypeField):
 
     node = JSONSequence
     subnode = PointNode
+    operators = ('bbox', 'near')
 
     @classmethod
     def definition(cls):
@@ -215,3 +216,4 @@ class GeoJSONType(JSONType):
 class GeoJSONField(JSONField):
     node = GeoJSONType
     hint = _('A GeoJSON geometry')
+    operators = ('bbox', 'near')
@@ -34,6 +34,7 @@ class JSONType(Mapping):
 class JSONField(TypeField):
     node = JSONType
     hint = _('A JSON value')
+    operators = ()
 
 
 class JSONSequence(Sequence):
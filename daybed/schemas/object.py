@@ -45,16 +45,16 @@ class ExclusiveKeys(object):
 class ObjectField(TypeField):
     hint = _('An object')
     node = JSONType
+    operators = ()
 
     @classmethod
     def definition(cls, **kwargs):
         schema = super(ObjectField, cls).definition(**kwargs)
 
-        db = global_registries.last.backend.db()
         schema.add(SchemaNode(String(),
                               name='model',
                               missing=drop,
-                              validator=ModelExist(db)))
+                              validator=ModelExist()))
 
         schema.add(SchemaNode(Sequence(), SchemaNode(TypeFieldNode()),
                               name='fields',
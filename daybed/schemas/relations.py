@@ -1,35 +1,59 @@
 import six
 from pyramid.i18n import TranslationString as _
 from pyramid.config import global_registries
+from pyramid.threadlocal import get_current_request
 from colander import (String, SchemaNode, Invalid)
 
 from daybed.backends.exceptions import ModelNotFound, RecordNotFound
 from .base import registry, TypeField, JSONList
 
 
+def current_db():
+    """Returns the database of the current request, or of the backend of
+    the last application outside of requests.
+    """
+    request = get_current_request()
+    if request is not None:
+        return request.db
+    return global_registries.last.backend.db()
+
+
 class ModelExist(object):
-    def __init__(self, db):
+    """Validates that the model exists.
+
+    If no database is specified, the one of the current request is used
+    when validating (definitions schemas are also built to be described).
+    """
+    def __init__(self, db=None):
         self.db = db
 
     def __call__(self, node, value):
+        db = self.db or current_db()
         try:
-            self.db.get_model_definition(value)
+            db.get_model_definition(value)
         except ModelNotFound:
             msg = u"Model '%s' not found." % value
             raise Invalid(node, msg)
 
 
 class RecordsExist(object):
-    def __init__(self, db, model_id):
+    """Validates that the records of the specified model exist.
+
+    If no database is specified, the one of the current request is used
+    when validating, so that the compiled record schemas do not depend on
+    the application they were built by.
+    """
+    def __init__(self, model_id, db=None):
         self.db = db
         self.model_id = model_id
 
     def __call__(self, node, value):
         if isinstance(value, six.string_types):
             value = [value]
+        db = self.db or current_db()
         for record_id in value:
             try:
-                self.db.get_record(self.model_id, record_id)
+                db.get_record(self.model_id, record_id)
             except RecordNotFound:
                 msg = u"Record '%s' of model '%s' not found." % (record_id,
                                                                  self.model_id)
@@ -43,16 +67,14 @@ class OneOfField(TypeField):
 
     @classmethod
     def definition(cls, **kwargs):
-        db = global_registries.last.backend.db()
         schema = super(OneOfField, cls).definition(**kwargs)
         schema.add(SchemaNode(String(), name='model',
-                   validator=ModelExist(db)))
+                   validator=ModelExist()))
         return schema
 
     @classmethod
     def validation(cls, **kwargs):
-        db = global_registries.last.backend.db()
-        kwargs['validator'] = RecordsExist(db, kwargs['model'])
+        kwargs['validator'] = RecordsExist(kwargs['model'])
         return super(OneOfField, cls).validation(**kwargs)
 
 
@@ -60,17 +82,16 @@ class OneOfField(TypeField):
 class AnyOfField(TypeField):
     node = JSONList
     hint = _('Some choices among records')
+    operators = ('contains',)
 
     @classmethod
     def definition(cls, **kwargs):
-        db = global_registries.last.backend.db()
         schema = super(AnyOfField, cls).definition(**kwargs)
         schema.add(SchemaNode(String(), name='model',
-                   validator=ModelExist(db)))
+                   validator=ModelExist()))
         return schema
 
     @classmethod
     def validation(cls, **kwargs):
-        db = global_registries.last.backend.db()
-        kwargs['validator'] = RecordsExist(db, kwargs['model'])
+        kwargs['validator'] = RecordsExist(kwargs['model'])
         return super(AnyOfField, cls).validation(**kwargs)
@@ -1,7 +1,15 @@
 from __future__ import absolute_import
 from functools import partial
+import base64
+import binascii
+import hashlib
 import json
 import datetime
+import threading
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 
 import six
 from colander import (SchemaNode, Mapping, Sequence, Length, String,
@@ -9,16 +17,48 @@ from colander import (SchemaNode, Mapping, Sequence, Length, String,
 from pyramid.security import Everyone
 
 from daybed.backends.exceptions import ModelNotFound, PolicyNotFound
+from daybed.tiles import MAX_ZOOM, geometry_field
 from . import registry, TypeFieldNode
 
 
+def field_operators(fieldtype):
+    """Returns the filters operators supported by a field type."""
+    try:
+        return registry.type(fieldtype).operators
+    except KeyError:
+        return ()
+
+
+def indexed_fields(node, definition):
+    """Validates that the indexes of a definition are made of its fields
+    which can be filtered by value, or of a single geometry field.
+    """
+    fields = dict((field['name'], field['type'])
+                  for field in definition['fields'])
+    for fields_names in definition.get('indexes', []):
+        for name in fields_names:
+            operators = field_operators(fields.get(name))
+            spatial = 'bbox' in operators and len(fields_names) == 1
+            if 'eq' not in operators and not spatial:
+                error = Invalid(node)
+                error.add(Invalid(node['indexes'],
+                                  u'%s cannot be indexed' % name))
+                raise error
+
+
 class DefinitionValidator(SchemaNode):
     def __init__(self):
-        super(DefinitionValidator, self).__init__(Mapping())
+        super(DefinitionValidator, self).__init__(Mapping(),
+                                                  validator=indexed_fields)
         self.add(SchemaNode(String(), name='title'))
         self.add(SchemaNode(String(), name='description'))
         self.add(SchemaNode(Sequence(), SchemaNode(TypeFieldNode()),
                             name='fields', validator=Length(min=1)))
+        # Secondary indexes, each one on one or several fields.
+        self.add(SchemaNode(Sequence(),
+                            SchemaNode(Sequence(), SchemaNode(String()),
+                                       validator=Length(min=1)),
+                            name='indexes', missing=drop))
 
 
 class RolesValidator(SchemaNode):
@@ -63,10 +103,79 @@ class RecordValidator(SchemaNode):
     def __init__(self, definition):
         super(RecordValidator, self).__init__(Mapping())
         for field in definition['fields']:
+            field = field.copy()
             fieldtype = field.pop('type')
             self.add(registry.validation(fieldtype, **field))
 
 
+def definition_revision(definition):
+    """Returns a hash of the specified definition, which changes whenever
+    the definition does.
+    """
+    serialized = json.dumps(definition, sort_keys=True)
+    return hashlib.md5(serialized.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(fields):
+    """Returns ``False`` if the compiled schema of the specified fields
+    depends on something else than the definition itself, i.e. current time
+    (``auto_now``) or another model definition (``object`` fields).
+    """
+    for field in fields:
+        if field.get('auto_now'):
+            return False
+        if field.get('type') == 'object' and 'model' in field:
+            return False
+        if not is_cacheable(field.get('fields', [])):
+            return False
+    return True
+
+
+class RecordValidatorCache(object):
+    """LRU cache of compiled ``RecordValidator`` schemas, shared by the
+    requests of an application (``registry.record_validators``).
+
+    Schemas are stored by model id along with the revision of the definition
+    they were built from, so that a stale schema is never used even if the
+    model was changed by another process.
+    """
+    def __init__(self, size=128):
+        self.size = size
+        self._schemas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def get(self, model_id, definition):
+        """Returns the compiled schema of the specified model definition."""
+        if not is_cacheable(definition['fields']):
+            return RecordValidator(definition)
+
+        revision = definition_revision(definition)
+        with self._lock:
+            cached = self._schemas.pop(model_id, None)
+            if cached is not None and cached[0] == revision:
+                # Mark as most recently used.
+                self._schemas[model_id] = cached
+                return cached[1]
+
+        schema = RecordValidator(definition)
+        with self._lock:
+            self._schemas[model_id] = (revision, schema)
+            while len(self._schemas) > self.size:
+                self._schemas.popitem(last=False)
+        return schema
+
+    def invalidate(self, model_id):
+        with self._lock:
+            self._schemas.pop(model_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+
+
 def validate_against_schema(request, schema, data):
     try:
         data_pure = schema.deserialize(data)
@@ -110,24 +219,332 @@ def validator(request, schema):
 definition_validator = partial(validator, schema=DefinitionValidator())
 
 
-def record_validator(request):
-    """Validates a request body according to its model definition.
+def record_schema(request):
+    """Returns the compiled schema of the requested model, or ``None``
+    if it does not exist.
     """
     model_id = request.matchdict['model_id']
 
     try:
         definition = request.db.get_model_definition(model_id)
-        schema = RecordValidator(definition)
-        validator(request, schema)
+        return request.registry.record_validators.get(model_id, definition)
     except ModelNotFound:
         request.errors.add('path', 'modelname',
                            'Unknown model %s' % model_id)
         request.errors.status = 404
 
 
+def record_validator(request):
+    """Validates a request body according to its model definition.
+    """
+    schema = record_schema(request)
+    if schema is not None:
+        validator(request, schema)
+
+
+def records_validator(request):
+    """Validates a request body, containing either a single record or a
+    list of records, according to its model definition.
+
+    Each record of a list is validated separately: the valid ones are
+    attached to the request along with the errors of the others.
+    """
+    schema = record_schema(request)
+    if schema is None:
+        return
+
+    try:
+        body = request.body.decode('utf-8')
+        body = json.loads(body) if body else {}
+    except ValueError as e:
+        request.errors.add('body', 'body', six.text_type(e))
+        return
+
+    if not isinstance(body, list):
+        validate_against_schema(request, schema, body)
+        return
+
+    records = []
+    for record in body:
+        try:
+            records.append((post_serialize(schema.deserialize(record)), []))
+        except Invalid as e:
+            errors = []
+            for error in e.children:
+                for field, error in error.asdict().items():
+                    errors.append(dict(location='body', name=field,
+                                       description=error))
+            if not errors:
+                errors.append(dict(location='body', name='body',
+                                   description=e.msg))
+            records.append((None, errors))
+    request.validated['records'] = records
+
+
 policy_validator = partial(validator, schema=PolicyValidator())
 
 
+def encode_token(record_id):
+    """Returns an opaque continuation token from the specified record id."""
+    token = base64.urlsafe_b64encode(record_id.encode('utf-8'))
+    return token.decode('ascii')
+
+
+def decode_token(token):
+    """Returns the record id of the specified continuation token."""
+    try:
+        record_id = base64.urlsafe_b64decode(token.encode('ascii'))
+        record_id = record_id.decode('utf-8')
+    except (TypeError, ValueError, binascii.Error):
+        record_id = None
+    if not record_id or encode_token(record_id) != token:
+        raise ValueError('Invalid token %s' % token)
+    return record_id
+
+
+def pagination_validator(request):
+    """Validates the ``_limit`` and ``_token`` querystring parameters of
+    records listing.
+
+    Sorted records (see :func:`sort_validator`) are paginated by offset:
+    their tokens hold the number of records of the previous pages.
+    """
+    limit = request.GET.get('_limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError()
+        except ValueError:
+            request.errors.add('querystring', '_limit',
+                               '_limit should be a positive integer')
+    request.validated['limit'] = limit
+
+    token = request.GET.get('_token')
+    start = None
+    offset = 0
+    if token is not None:
+        try:
+            start = decode_token(token)
+            if '_sort' in request.GET:
+                if not start.isdigit():
+                    raise ValueError('Invalid token %s' % token)
+                offset = int(start)
+        except ValueError as e:
+            request.errors.add('querystring', '_token', six.text_type(e))
+    request.validated['start'] = start
+    request.validated['offset'] = offset
+
+
+def coordinates_value(node, value, count):
+    """Returns the ``count`` comma-separated numbers of a querystring
+    value.
+    """
+    try:
+        numbers = [float(number) for number in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise Invalid(node, u'%d comma-separated numbers expected' % count)
+    return tuple(numbers)
+
+
+def filter_value(field, operator, value):
+    """Returns the value of a records filter, deserialized with the schema
+    of the specified field definition.
+
+    Bounds and prefixes only have to be of the field type, while other
+    values have to be valid for the field (e.g. among its choices).
+    Bounding boxes and points are comma-separated coordinates.
+    """
+    if operator == 'bbox':
+        node = SchemaNode(String(), name=field['name'])
+        box = coordinates_value(node, value, 4)
+        if box[0] > box[2] or box[1] > box[3]:
+            raise Invalid(node, u'Bounding box minimums exceed maximums')
+        return box
+    if operator == 'near':
+        node = SchemaNode(String(), name=field['name'])
+        return coordinates_value(node, value, 2)
+
+    field = field.copy()
+    fieldtype = field.pop('type')
+    if operator in ('gt', 'lt', 'prefix'):
+        node = SchemaNode(registry.type(fieldtype).node())
+    else:
+        field.pop('auto_now', None)
+        field['required'] = True
+        node = registry.validation(fieldtype, **field)
+
+    if operator == 'in':
+        values = [node.deserialize(v) for v in value.split(',')]
+    elif operator == 'contains':
+        values = node.deserialize([value])
+    else:
+        values = [node.deserialize(value)]
+    values = [v.isoformat() if isinstance(v, (datetime.date,
+                                              datetime.datetime)) else v
+              for v in values]
+    return values if operator == 'in' else values[0]
+
+
+def filters_validator(request):
+    """Validates the records filters of the querystring, according to the
+    model definition: ``<field>=<value>``, or ``<operator>_<field>=<value>``
+    with the operators supported by the field type (e.g. ``gt_age=18``,
+    ``in_status=todo,done``).
+
+    Parameters starting with an underscore, and the JSONP ``callback``, are
+    not filters. Geometries are filtered by bounding box
+    (``bbox=minx,miny,maxx,maxy``), and records can be ordered by distance
+    to a point (``near=x,y``), in which case they are not paginated: both
+    apply to the first geometry field of the model if none is specified
+    (e.g. ``bbox_location``).
+    """
+    filters = request.validated['filters'] = []
+    request.validated['near'] = None
+    params = [(param, value) for param, value in request.GET.items()
+              if not param.startswith('_') and param != 'callback']
+    if not params:
+        return
+
+    try:
+        definition = request.db.get_model_definition(
+            request.matchdict['model_id'])
+    except ModelNotFound:
+        # Reported by the view.
+        return
+    fields = dict((field['name'], field) for field in definition['fields'])
+    geometries = [field['name'] for field in definition['fields']
+                  if 'bbox' in field_operators(field['type'])]
+
+    for param, value in params:
+        operator, name = 'eq', param
+        if param in fields:
+            pass
+        elif param in ('bbox', 'near') and geometries:
+            operator, name = param, geometries[0]
+        elif '_' in param:
+            operator, name = param.split('_', 1)
+        field = fields.get(name)
+        if field is None:
+            request.errors.add('querystring', param,
+                               'Unknown field %s' % name)
+            continue
+        operators = field_operators(field['type'])
+        if operator not in operators:
+            request.errors.add('querystring', param,
+                               '%s fields cannot be filtered with %s' % (
+                                   field['type'], operator))
+            continue
+        try:
+            value = filter_value(field, operator, value)
+        except Invalid as e:
+            request.errors.add('querystring', param,
+                               u'; '.join(e.messages()))
+            continue
+        if operator != 'near':
+            filters.append((name, operator, value))
+        elif request.validated['near'] is not None:
+            request.errors.add('querystring', param,
+                               'Records can be near a single point')
+        elif '_token' in request.GET:
+            request.errors.add('querystring', '_token',
+                               'Nearest records cannot be paginated')
+        else:
+            request.validated['near'] = (name, value)
+
+
+def _model_fields(request, param):
+    """Returns the fields of the model by name, and the names listed by a
+    querystring parameter, or ``None`` if it is not specified or the model
+    does not exist (which is reported by the view).
+    """
+    value = request.GET.get(param)
+    if value is None:
+        return None, None
+    try:
+        definition = request.db.get_model_definition(
+            request.matchdict['model_id'])
+    except ModelNotFound:
+        return None, None
+    fields = dict((field['name'], field) for field in definition['fields'])
+    return fields, value.split(',')
+
+
+def sort_validator(request):
+    """Validates the ``_sort`` querystring parameter of records listing:
+    comma-separated names of fields which can be filtered by value,
+    prefixed with ``-`` to be sorted in descending order (e.g.
+    ``_sort=status,-age``).
+    """
+    request.validated['sort'] = None
+    fields, names = _model_fields(request, '_sort')
+    if names is None:
+        return
+    sort = []
+    for name in names:
+        descending = name.startswith('-')
+        name = name[1:] if descending else name
+        field = fields.get(name)
+        if field is None:
+            request.errors.add('querystring', '_sort',
+                               'Unknown field %s' % name)
+        elif 'eq' not in field_operators(field['type']):
+            request.errors.add('querystring', '_sort',
+                               '%s fields cannot be sorted' % field['type'])
+        else:
+            sort.append((name, descending))
+    if request.validated.get('near') is not None:
+        request.errors.add('querystring', '_sort',
+                           'Nearest records are ordered by distance')
+    request.validated['sort'] = sort
+
+
+def projection_validator(request):
+    """Validates the ``_fields`` querystring parameter of records listing:
+    comma-separated names of the fields to return, the records id being
+    always returned (e.g. ``_fields=title,status``).
+    """
+    request.validated['fields'] = None
+    fields, names = _model_fields(request, '_fields')
+    if names is None:
+        return
+    for name in names:
+        if name not in fields:
+            request.errors.add('querystring', '_fields',
+                               'Unknown field %s' % name)
+    request.validated['fields'] = list(OrderedDict.fromkeys(names))
+
+
+def tile_validator(request):
+    """Validates the zoom level and coordinates of a map tile, and that the
+    model has a geometry field.
+    """
+    try:
+        z, x, y = [int(request.matchdict[name]) for name in 'zxy']
+    except ValueError:
+        request.errors.add('path', 'tile', 'Tile coordinates are integers')
+        return
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        request.errors.add('path', 'tile',
+                           'Invalid tile %d/%d/%d' % (z, x, y))
+        return
+    request.validated['tile'] = (z, x, y)
+
+    model_id = request.matchdict['model_id']
+    try:
+        definition = request.db.get_model_definition(model_id)
+    except ModelNotFound:
+        request.errors.add('path', 'modelname',
+                           'Unknown model %s' % model_id)
+        request.errors.status = 404
+        return
+    if geometry_field(definition) is None:
+        request.errors.add('path', 'modelname',
+                           'Model %s has no geometry field' % model_id)
+
+
 def model_validator(request):
     """Verify that the model is okay (that we have the right fields) and
     eventually populates it if there is a need to.
@@ -147,8 +564,9 @@ def model_validator(request):
     request.validated['definition'] = definition
 
     # Check that the records are valid according to the definition.
+    # Records are left as ``None`` if not specified.
     records = body.get('records')
-    request.validated['records'] = []
+    request.validated['records'] = None if records is None else []
     if records:
         definition_validator = RecordValidator(definition)
         for record in records:
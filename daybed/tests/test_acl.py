@@ -2,12 +2,15 @@ try:
     from unittest2 import TestCase
 except ImportError:
     from unittest import TestCase  # flake8: noqa
+
 import mock
 
 from pyramid.security import Authenticated
 
 from daybed.acl import (DaybedAuthorizationPolicy, build_user_principals,
-                        PERMISSION_FULL, CRUD, get_binary_mask)
+                        PERMISSION_FULL, CRUD, get_binary_mask,
+                        compile_policy, VIEWS_PERMISSIONS_REQUIRED,
+                        VIEWS_PERMISSIONS_MASKS)
 
 
 class TestACL(TestCase):
@@ -32,7 +35,8 @@ class TestACL(TestCase):
         policy = {'group:admins': PERMISSION_FULL,
                   'authors:': {'records': CRUD},
                   Authenticated: {'definition': {'read': True}}}
-        context.db.get_model_policy.return_value = policy
+        masks = compile_policy(policy)
+        context.db.get_model_policy_masks.return_value = masks
 
         self.assertFalse(permits(context, ['Alexis'], 'get_definition'))
         self.assertTrue(permits(context, ['Alexis', Authenticated],
@@ -75,3 +79,22 @@ class PermissionAsMaskTest(TestCase):
     def test_all_permissions_is_full_mask(self):
         mask = get_binary_mask(PERMISSION_FULL)
         self.assertEquals(mask, 0xFFFF)
+
+
+class CompilePolicyTest(TestCase):
+    def test_each_role_has_its_mask(self):
+        masks = compile_policy({'role:admins': PERMISSION_FULL,
+                                Authenticated: {'records': {'read': True}}})
+        self.assertEquals(masks, {'role:admins': 0xFFFF,
+                                  Authenticated: 0x0400})
+
+    def test_title_and_description_are_ignored(self):
+        masks = compile_policy({'title': 'Open', 'description': 'To all'})
+        self.assertEquals(masks, {})
+
+
+class ViewsPermissionsMasksTest(TestCase):
+    def test_each_view_has_its_mask(self):
+        for view, permissions in VIEWS_PERMISSIONS_REQUIRED.items():
+            self.assertEquals(VIEWS_PERMISSIONS_MASKS[view],
+                              get_binary_mask(permissions))
@@ -0,0 +1,356 @@
+try:
+    from unittest2 import TestCase, skipIf
+except ImportError:
+    from unittest import TestCase, skipIf  # flake8: noqa
+import base64
+import sys
+from uuid import uuid4
+
+import mock
+import six
+from couchdb.client import Server
+from couchdb.design import ViewDefinition
+
+from daybed.backends.couchdb.database import Database as CouchDBDatabase
+from daybed.backends.couchdb.views import docs as couchdb_views
+from daybed.backends.exceptions import ModelNotFound, RecordNotFound
+from daybed.backends.memory.database import Database as MemoryDatabase
+from daybed.renderers import JSONP
+from daybed.tests.support import BaseWebTest
+
+PY36 = sys.version_info >= (3, 6)
+
+try:
+    import aiohttp  # NOQA
+except ImportError:
+    aiohttp = None
+
+
+def run(loop, awaitable):
+    return loop.run_until_complete(awaitable)
+
+
+def collect(loop, records):
+    """Returns the items of an asynchronous iterator, as a list."""
+    items = []
+    while True:
+        try:
+            items.append(run(loop, records.__anext__()))
+        except StopAsyncIteration:
+            return items
+
+
+def done(loop, result=None):
+    future = loop.create_future()
+    future.set_result(result)
+    return future
+
+
+class AsyncDatabaseTestBase(object):
+    """Tests shared by the asynchronous databases, which wrap the blocking
+    ``self.sync_db``.
+    """
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.definition = {
+            "title": "simple",
+            "description": "One optional field",
+            "fields": [{"name": "age", "type": "int", "required": False}]
+        }
+        self.sync_db.set_policy('read-only', {})
+        self.sync_db.put_model(self.definition, {'admins': ['Remy']},
+                               'read-only', 'modelname')
+        self.sync_db.add_user({'name': 'Remy', 'apitoken': 'foo'})
+
+    def tearDown(self):
+        run(self.loop, self.db.close())
+        self.loop.close()
+
+    def test_get_model(self):
+        model = run(self.loop, self.db.get_model('modelname'))
+        self.assertEqual(model['definition'], self.definition)
+        self.assertEqual(model['roles'], {'admins': ['Remy']})
+        self.assertEqual(model['policy_id'], 'read-only')
+
+    def test_get_model_raises_if_unknown(self):
+        self.assertRaises(ModelNotFound, run, self.loop,
+                          self.db.get_model_definition('unknown'))
+
+    def test_records_are_read_and_written(self):
+        record_id = run(self.loop, self.db.put_record(
+            'modelname', {'age': 42}, ['Remy']))
+        self.assertEqual(run(self.loop, self.db.get_record(
+            'modelname', record_id)), {'age': 42})
+        self.assertEqual(run(self.loop, self.db.get_record_authors(
+            'modelname', record_id)), ['Remy'])
+        doc = run(self.loop, self.db.get_record_document('modelname',
+                                                         record_id))
+        self.assertEqual(doc['revision'], self.sync_db.get_record_revision(
+            'modelname', record_id))
+        run(self.loop, self.db.delete_record('modelname', record_id))
+        self.assertRaises(RecordNotFound, run, self.loop,
+                          self.db.get_record('modelname', record_id))
+
+    def test_iter_records(self):
+        created = run(self.loop, self.db.put_records(
+            'modelname', [{'age': age} for age in range(5)], ['Remy']))
+        records = collect(self.loop, self.db.iter_records('modelname'))
+        self.assertEqual(sorted(r['id'] for r in records), sorted(created))
+        self.assertEqual(records, self.sync_db.get_records('modelname'))
+
+    def test_delete_records(self):
+        run(self.loop, self.db.put_records(
+            'modelname', [{'age': age} for age in range(3)], ['Remy']))
+        self.assertEqual(
+            run(self.loop, self.db.delete_records('modelname')), 3)
+        self.assertEqual(self.sync_db.get_records('modelname'), [])
+
+    def test_model_revision_changes_with_the_records(self):
+        revisions = [run(self.loop, self.db.get_model_revision('modelname'))]
+        record_id = run(self.loop, self.db.put_record(
+            'modelname', {'age': 42}, ['Remy']))
+        revisions.append(run(self.loop,
+                             self.db.get_model_revision('modelname')))
+        run(self.loop, self.db.put_records('modelname', [{'age': 43}],
+                                           ['Remy']))
+        revisions.append(run(self.loop,
+                             self.db.get_model_revision('modelname')))
+        run(self.loop, self.db.delete_record('modelname', record_id))
+        revisions.append(run(self.loop,
+                             self.db.get_model_revision('modelname')))
+        self.assertEqual(len(set(revisions)), len(revisions))
+        self.assertEqual(revisions[-1],
+                         self.sync_db.get_model_revision('modelname'))
+
+    def test_users_and_policies(self):
+        self.assertEqual(run(self.loop, self.db.get_groups('Remy')), [])
+        self.assertEqual(run(self.loop, self.db.get_policy('read-only')), {})
+
+    def test_other_methods_are_available(self):
+        self.assertTrue(run(self.loop, self.db.policy_is_used('read-only')))
+
+
+@skipIf(not PY36, "Requires Python 3.6")
+class MemoryAsyncDatabaseTest(AsyncDatabaseTestBase, TestCase):
+
+    def setUp(self):
+        from daybed.backends.aio import DirectDatabase
+        empty = {
+            'models': {},
+            'data': {},
+            'index': {},
+            'users': {},
+            'policies': {}
+        }
+        self.sync_db = MemoryDatabase(empty, lambda: six.text_type(uuid4()))
+        self.db = DirectDatabase(self.sync_db)
+        super(MemoryAsyncDatabaseTest, self).setUp()
+
+
+@skipIf(not PY36, "Requires Python 3.6")
+class ThreadedAsyncDatabaseTest(AsyncDatabaseTestBase, TestCase):
+
+    def setUp(self):
+        from daybed.backends.aio import ThreadedDatabase
+        empty = {
+            'models': {},
+            'data': {},
+            'index': {},
+            'users': {},
+            'policies': {}
+        }
+        self.sync_db = MemoryDatabase(empty, lambda: six.text_type(uuid4()))
+        self.sync_db.batch_size = 2
+        self.db = ThreadedDatabase(self.sync_db)
+        super(ThreadedAsyncDatabaseTest, self).setUp()
+
+
+@skipIf(not PY36 or aiohttp is None, "Requires Python 3.6 and aiohttp")
+class CouchDBAsyncDatabaseTest(AsyncDatabaseTestBase, TestCase):
+
+    def setUp(self):
+        from daybed.backends.aio import ThreadedDatabase
+        from daybed.backends.couchdb.aio import AsyncDatabase
+        self.server = Server('http://localhost:5984')
+        self.db_name = 'test_%s' % uuid4()
+        self.server.create(self.db_name)
+
+        db = self.server[self.db_name]
+        ViewDefinition.sync_many(db, couchdb_views)
+        self.sync_db = CouchDBDatabase(db, lambda: six.text_type(uuid4()))
+        self.db = AsyncDatabase('http://localhost:5984/%s' % self.db_name,
+                                self.sync_db.generate_id,
+                                ThreadedDatabase(self.sync_db),
+                                batch_size=2)
+        super(CouchDBAsyncDatabaseTest, self).setUp()
+
+    def tearDown(self):
+        super(CouchDBAsyncDatabaseTest, self).tearDown()
+        del self.server[self.db_name]
+
+
+@skipIf(not PY36, "Requires Python 3.6")
+class ASGITest(BaseWebTest):
+
+    def setUp(self):
+        import asyncio
+        from daybed.asgi import DaybedASGI, start_wsgi
+        self.start_wsgi = start_wsgi
+        super(ASGITest, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        self.asgi = DaybedASGI(self.app.app, threads=2)
+
+        self.app.put_json('/models/test', {'definition': {
+            'title': 'test',
+            'description': 'test',
+            'fields': [{'name': 'age', 'type': 'int'}]
+        }}, headers=self.headers)
+        for age in range(3):
+            self.app.put_json('/models/test/records/%s' % age,
+                              {'age': age}, headers=self.headers)
+
+    def tearDown(self):
+        self.asgi.executor.shutdown(wait=False)
+        self.loop.close()
+        super(ASGITest, self).tearDown()
+
+    def request(self, path, method='GET', headers=None, body=b''):
+        """Sends the request to the ASGI application, and returns the sent
+        messages and whether the WSGI application was called.
+        """
+        headers = dict(self.headers, **(headers or {}))
+        messages = []
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': b'',
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in headers.items() if value],
+        }
+
+        def receive():
+            return done(self.loop, {'type': 'http.request', 'body': body})
+
+        def send(message):
+            messages.append(message)
+            return done(self.loop)
+
+        with mock.patch('daybed.asgi.start_wsgi',
+                        wraps=self.start_wsgi) as wsgi:
+            run(self.loop, self.asgi(scope, receive, send))
+        return messages, wsgi.called
+
+    def assertSameResponse(self, path, headers=None, native=True):
+        """Checks that the ASGI response is the WSGI one, and whether it
+        was built natively.
+        """
+        messages, wsgi_called = self.request(path, headers=headers)
+        self.assertEqual(wsgi_called, not native)
+        headers = dict(self.headers, **(headers or {}))
+        response = self.app.get(path, status='*', headers=dict(
+            (name, value) for name, value in headers.items() if value))
+        self.assertEqual(messages[0]['status'], response.status_int)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertEqual(body, response.body)
+        sent = dict(messages[0]['headers'])
+        for name in ('ETag', 'Cache-Control'):
+            value = response.headers.get(name)
+            self.assertEqual(sent.get(name.lower().encode('latin-1')),
+                             value and value.encode('latin-1'))
+        return messages
+
+    def test_records_are_served_natively(self):
+        self.asgi.chunk_size = 2
+        messages = self.assertSameResponse('/models/test/records')
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(messages[1]['more_body'])
+
+    def test_record_and_definition_are_served_natively(self):
+        self.assertSameResponse('/models/test/records/1')
+        self.assertSameResponse('/models/test/definition')
+
+    def test_native_responses_have_the_etag_of_the_wsgi_ones(self):
+        for path in ('/models/test/records', '/models/test/records/1',
+                     '/models/test/definition'):
+            messages = self.assertSameResponse(path)
+            self.assertIn(b'etag', dict(messages[0]['headers']))
+
+    def test_anonymous_reads_are_served_natively(self):
+        self.assertSameResponse('/models/test/records/1',
+                                headers={'Authorization': None})
+
+    def test_errors_are_served_by_the_wsgi_application(self):
+        for path in ('/models/unknown/definition', '/models/test/records/42',
+                     '/models/test'):
+            self.assertSameResponse(path, native=False)
+
+    def test_forbidden_reads_are_served_by_the_wsgi_application(self):
+        self.db.put_model(self.db.get_model_definition('test'), {},
+                          'admin-only', 'secret')
+        self.db.put_record('secret', {'age': 1}, ['admin'], '1')
+        self.assertSameResponse('/models/secret/records/1',
+                                headers={'Authorization': None},
+                                native=False)
+
+    def test_policies_fetched_before_an_invalidation_are_not_cached(self):
+        policies = self.asgi.backend.policies
+        policy_id = self.db.get_model_policy_id('test')
+        policies.invalidate()
+
+        def get_policy(policy_name):
+            # The policy is modified while it is being fetched.
+            policies.invalidate(policy_name)
+            return done(self.loop, self.db.get_policy(policy_name))
+
+        with mock.patch.object(self.asgi.db, 'get_policy', get_policy):
+            messages, wsgi_called = self.request('/models/test/definition')
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIsNone(policies.peek(policy_id))
+        self.request('/models/test/definition')
+        self.assertIsNotNone(policies.peek(policy_id))
+
+    def test_geojson_records_are_served_by_the_wsgi_application(self):
+        self.assertSameResponse('/models/test/records',
+                                headers={'Accept': None}, native=False)
+
+    def test_wsgi_responses_are_streamed(self):
+        with mock.patch.object(JSONP, 'chunk_size', 2):
+            messages = self.assertSameResponse(
+                '/models/test/records', headers={'Accept': None},
+                native=False)
+        self.assertEqual(len(messages), 4)
+        self.assertTrue(messages[1]['more_body'])
+        self.assertTrue(messages[2]['more_body'])
+        self.assertFalse(messages[3].get('more_body', False))
+
+    def test_unknown_users_are_served_by_the_wsgi_application(self):
+        auth = base64.b64encode(b'alexis:bar').decode('ascii')
+        self.assertSameResponse('/models/test/definition',
+                                headers={'Authorization': 'Basic ' + auth},
+                                native=False)
+
+    def test_writes_are_served_by_the_wsgi_application(self):
+        messages, wsgi_called = self.request(
+            '/models/test/records/4', method='PUT', body=b'{"age": 4}')
+        self.assertTrue(wsgi_called)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(self.db.get_record('test', '4'), {'age': 4})
+
+    def test_lifespan(self):
+        messages = []
+        events = iter([{'type': 'lifespan.startup'},
+                       {'type': 'lifespan.shutdown'}])
+
+        def receive():
+            return done(self.loop, next(events))
+
+        def send(message):
+            messages.append(message['type'])
+            return done(self.loop)
+
+        run(self.loop, self.asgi({'type': 'lifespan'}, receive, send))
+        self.assertEqual(messages, ['lifespan.startup.complete',
+                                    'lifespan.shutdown.complete'])
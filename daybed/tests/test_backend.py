@@ -2,23 +2,49 @@ try:
     from unittest2 import TestCase
 except ImportError:
     from unittest import TestCase  # flake8: noqa
+import os
+import shutil
+import tempfile
 from collections import defaultdict
+from copy import deepcopy
+from decimal import Decimal
 from uuid import uuid4
 
+import fakeredis
 import mock
 import six
 from couchdb.client import Server
 from couchdb.design import ViewDefinition
+from pyramid import testing
 
 from daybed.backends.exceptions import (
-    UserAlreadyExist, PolicyNotFound, ModelNotFound, RecordNotFound,
+    UserAlreadyExist, UserNotFound, PolicyNotFound, ModelNotFound,
+    RecordNotFound,
 )
+from daybed.backends.filters import PREFIX_END
+from daybed.backends.cached import CachedDatabase, PoliciesCache
 from daybed.backends.couchdb.backend import (
     CouchDBBackendConnectionError, CouchDBBackend
 )
 from daybed.backends.couchdb.database import Database as CouchDBDatabase
+from daybed.backends.couchdb.migrations import (
+    migrate_documents_ids, migrate_models_indexes)
+from daybed.backends.couchdb.pool import (
+    ConnectionPool as CouchDBConnectionPool, session as couchdb_session
+)
+from daybed.backends.couchdb import views
 from daybed.backends.couchdb.views import docs as couchdb_views
+from daybed.backends.log.database import Database as LogDatabase
+from daybed.backends.log.store import LogStore
 from daybed.backends.memory.database import Database as MemoryDatabase
+from daybed.backends.memory.frozen import freeze
+from daybed.backends.memory.index import GridIndex, SortedIndex
+from daybed.backends.redis.database import Database as RedisDatabase
+from daybed.backends.redis.index import (encode_value, index_member,
+                                         lex_range, member_id)
+from daybed.backends.sql import SQLBackend
+from daybed.backends.sql.dialects import dialect_from_url
+from daybed.backends.sql.pool import ConnectionPool
 
 
 class BackendTestBase(object):
@@ -121,11 +147,90 @@ class BackendTestBase(object):
         authors = self.db.get_record_authors('modelname', item_id)
         self.assertEquals(set(authors), set(['Alexis', 'Remy']))
 
+    def test_put_records(self):
+        self._create_model()
+        records_ids = self.db.put_records('modelname',
+                                          [{'age': 1}, {'age': 2}],
+                                          ['Alexis'])
+        self.assertEqual(len(records_ids), 2)
+        self.assertEqual(self.db.get_record('modelname', records_ids[1]),
+                         {'age': 2})
+        self.assertEqual(self.db.get_record_authors('modelname',
+                                                    records_ids[0]),
+                         ['Alexis'])
+        self.assertEqual(len(self.db.get_records('modelname')), 2)
+
+    def test_put_model_keeps_records(self):
+        self._create_model()
+        record_id = self.db.put_record('modelname', {'age': 42}, ['Remy'])
+        self.db.put_model(self.definition, {'admins': ['Alexis']},
+                          'admin-only', 'modelname')
+        self.assertEqual(self.db.get_roles('modelname'),
+                         {'admins': ['Alexis']})
+        self.assertEqual(self.db.get_record('modelname', record_id),
+                         {'age': 42})
+
+    def test_replace_records(self):
+        self._create_model()
+        kept, deleted = self.db.put_records('modelname',
+                                            [{'age': 1}, {'age': 2}],
+                                            ['Remy'])
+        records_ids = self.db.replace_records(
+            'modelname', [{'id': kept, 'age': 3}, {'age': 4}], ['Alexis'])
+        self.assertEqual(records_ids[0], kept)
+        self.assertEqual(self.db.get_record('modelname', kept), {'age': 3})
+        self.assertEqual(sorted(self.db.get_record_authors('modelname',
+                                                           kept)),
+                         ['Alexis', 'Remy'])
+        self.assertEqual(self.db.get_record('modelname', records_ids[1]),
+                         {'age': 4})
+        self.assertRaises(RecordNotFound, self.db.get_record,
+                          'modelname', deleted)
+        self.assertEqual(len(self.db.get_records('modelname')), 2)
+
+    def test_replace_records_raises_if_model_unknown(self):
+        self.assertRaises(ModelNotFound, self.db.replace_records,
+                          'unknown', [], ['Remy'])
+
     def test_get_records(self):
         self._create_model()
         self.db.put_record('modelname', self.record, ['author'])
         self.assertEqual(len(self.db.get_records('modelname')), 1)
 
+    def test_get_records_are_sorted_by_id(self):
+        self._create_model()
+        for record_id in ('c', 'a', 'b'):
+            self.db.put_record('modelname', self.record, ['author'], record_id)
+        records = self.db.get_records('modelname')
+        self.assertEqual([r['id'] for r in records], ['a', 'b', 'c'])
+
+    def test_get_records_with_limit_and_start(self):
+        self._create_model()
+        for record_id in ('a', 'b', 'c', 'd'):
+            self.db.put_record('modelname', self.record, ['author'], record_id)
+        records = self.db.get_records('modelname', limit=2)
+        self.assertEqual([r['id'] for r in records], ['a', 'b'])
+        records = self.db.get_records('modelname', limit=2, start='b')
+        self.assertEqual([r['id'] for r in records], ['c', 'd'])
+        records = self.db.get_records('modelname', limit=2, start='d')
+        self.assertEqual(records, [])
+
+    def test_get_records_start_can_be_deleted(self):
+        self._create_model()
+        for record_id in ('a', 'b', 'c'):
+            self.db.put_record('modelname', self.record, ['author'], record_id)
+        self.db.delete_record('modelname', 'a')
+        records = self.db.get_records('modelname', limit=1, start='a')
+        self.assertEqual([r['id'] for r in records], ['b'])
+
+    def test_iter_records(self):
+        self._create_model()
+        for record_id in ('b', 'a'):
+            self.db.put_record('modelname', self.record, ['author'], record_id)
+        records = list(self.db.iter_records('modelname'))
+        self.assertEqual(records, [{'age': 7, 'id': 'a'},
+                                   {'age': 7, 'id': 'b'}])
+
     def test_get_records_empty(self):
         self._create_model()
         self.assertEqual(self.db.get_records('modelname'), [])
@@ -142,6 +247,17 @@ class BackendTestBase(object):
         self.assertEqual(self.db.get_record_authors('modelname', 'record'),
                          ['author'])
 
+    def test_get_record_document(self):
+        self._create_model()
+        self.db.put_record('modelname', self.record, ['author'], 'record')
+        doc = self.db.get_record_document('modelname', 'record')
+        self.assertEqual(doc, {
+            'data': self.record,
+            'authors': ['author'],
+            'revision': self.db.get_record_revision('modelname', 'record')})
+        self.assertRaises(RecordNotFound, self.db.get_record_document,
+                          'modelname', 'unknown')
+
     def test_delete_record(self):
         self._create_model()
         self.db.put_record('modelname', self.record, ['author'], 'record')
@@ -153,6 +269,13 @@ class BackendTestBase(object):
         self.assertRaises(PolicyNotFound, self.db.put_model, self.definition,
                           self.roles, 'unknown')
 
+    def test_get_model(self):
+        self._create_model()
+        model = self.db.get_model('modelname')
+        self.assertEquals(model['definition'], self.definition)
+        self.assertEquals(model['roles'], self.roles)
+        self.assertEquals(model['policy_id'], 'admin-only')
+
     def test_get_model_definition(self):
         self._create_model()
         self.assertEquals(self.db.get_model_definition('modelname'),
@@ -164,12 +287,289 @@ class BackendTestBase(object):
         self.assertRaises(ModelNotFound, self.db.get_model_definition,
                           'modelname')
 
+    def _create_filtered_records(self):
+        self._create_model()
+        records = [{'age': 7, 'name': u'Remy', 'tags': [u'a', u'b']},
+                   {'age': 12, 'name': u'R\xe9mi', 'tags': [u'b']},
+                   {'age': 30, 'name': u'Alexis', 'tags': []},
+                   {'name': u'remy'}]
+        for i, record in enumerate(records):
+            self.db.put_record('modelname', record, ['author'], str(i))
+
+    def assertFiltered(self, filters, expected, **kwargs):
+        records = self.db.get_records('modelname', filters=filters, **kwargs)
+        self.assertEqual([r['id'] for r in records], expected)
+
+    def test_records_can_be_filtered(self):
+        self._create_filtered_records()
+        self.assertFiltered([('age', 'eq', 12)], ['1'])
+        self.assertFiltered([('name', 'eq', u'R\xe9mi')], ['1'])
+        self.assertFiltered([('age', 'in', [7, 30, 31])], ['0', '2'])
+        self.assertFiltered([('age', 'gt', 7)], ['1', '2'])
+        self.assertFiltered([('age', 'lt', 12)], ['0'])
+        self.assertFiltered([('name', 'prefix', u'R')], ['0', '1'])
+        self.assertFiltered([('tags', 'contains', u'b')], ['0', '1'])
+        self.assertFiltered([('age', 'gt', 7), ('tags', 'contains', u'b')],
+                            ['1'])
+        self.assertFiltered([('age', 'gt', 100)], [])
+
+    def test_filtered_records_are_paginated(self):
+        self._create_filtered_records()
+        self.assertFiltered([('name', 'prefix', u'R')], ['0'], limit=1)
+        self.assertFiltered([('name', 'prefix', u'R')], ['1'], limit=1,
+                            start='0')
+        self.assertFiltered([('name', 'prefix', u'R')], [], start='1')
+
+    def test_filtered_records_can_be_iterated(self):
+        self._create_filtered_records()
+        records = self.db.iter_records('modelname',
+                                       filters=[('age', 'gt', 10)])
+        self.assertEqual([r['id'] for r in records], ['1', '2'])
+
+    def test_indexed_records_can_be_filtered(self):
+        self.definition['fields'].append({"name": "name", "type": "string"})
+        self.definition['indexes'] = [['age'], ['name', 'age']]
+        self._create_filtered_records()
+        self.db.put_record('modelname', {'age': 12, 'name': u'Remy'},
+                           ['author'], '4')
+        self.assertFiltered([('age', 'eq', 12)], ['1', '4'])
+        self.assertFiltered([('age', 'in', [7, 30])], ['0', '2'])
+        self.assertFiltered([('age', 'gt', 7), ('age', 'lt', 30)],
+                            ['1', '4'])
+        self.assertFiltered([('name', 'eq', u'Remy'), ('age', 'gt', 7)],
+                            ['4'])
+        self.assertFiltered([('name', 'prefix', u'R')], ['0', '1', '4'])
+        self.assertFiltered([('name', 'prefix', u'R')], ['1'], limit=1,
+                            start='0')
+        self.db.delete_record('modelname', '4')
+        self.assertFiltered([('age', 'eq', 12)], ['1'])
+        records = self.db.iter_records('modelname',
+                                       filters=[('age', 'gt', 10)])
+        self.assertEqual([r['id'] for r in records], ['1', '2'])
+
+    def test_indexes_follow_the_model_definition(self):
+        self._create_filtered_records()
+        self.definition['indexes'] = [['age']]
+        self.db.put_model(self.definition, self.roles, 'admin-only',
+                          'modelname')
+        self.assertFiltered([('age', 'lt', 10)], ['0'])
+        self.db.replace_records('modelname', [{'id': '5', 'age': 5}],
+                                ['author'])
+        self.assertFiltered([('age', 'lt', 10)], ['5'])
+        del self.definition['indexes']
+        self.db.put_model(self.definition, self.roles, 'admin-only',
+                          'modelname')
+        self.assertFiltered([('age', 'lt', 10)], ['5'])
+
+    def assertSorted(self, sort, expected, **kwargs):
+        records = self.db.get_sorted_records('modelname', sort, **kwargs)
+        self.assertEqual([r['id'] for r in records], expected)
+
+    def _test_sorted_records(self):
+        self.db.put_record('modelname', {'age': 12, 'name': u'Remy'},
+                           ['author'], '4')
+        self.assertSorted([('age', False)], ['3', '0', '1', '4', '2'])
+        self.assertSorted([('age', True)], ['2', '4', '1', '0', '3'])
+        self.assertSorted([('age', True)], ['4', '1'], limit=2, offset=1)
+        self.assertSorted([('age', False)], ['4', '2'], offset=3)
+        self.assertSorted([('age', True)], ['4', '1', '0'],
+                          filters=[('name', 'prefix', u'R')])
+        self.assertSorted([('age', True)], ['1'], limit=1, offset=1,
+                          filters=[('name', 'prefix', u'R')])
+        self.assertSorted([('age', False)], ['0', '4'],
+                          filters=[('name', 'eq', u'Remy')])
+        self.assertSorted([('name', False), ('age', True)],
+                          ['2', '4', '0', '1', '3'])
+        self.db.delete_record('modelname', '4')
+        self.assertSorted([('age', True)], ['2', '1', '0', '3'])
+
+    def test_records_can_be_sorted(self):
+        self.definition['fields'].append({"name": "name", "type": "string"})
+        self._create_filtered_records()
+        self._test_sorted_records()
+
+    def test_indexed_records_can_be_sorted(self):
+        self.definition['fields'].append({"name": "name", "type": "string"})
+        self.definition['indexes'] = [['age'], ['name']]
+        self._create_filtered_records()
+        self._test_sorted_records()
+
+    def test_records_fields_can_be_selected(self):
+        self._create_filtered_records()
+        records = self.db.get_records('modelname', limit=2,
+                                      fields=['age', 'tags'])
+        self.assertEqual(records, [
+            {'id': '0', 'age': 7, 'tags': [u'a', u'b']},
+            {'id': '1', 'age': 12, 'tags': [u'b']}])
+        records = self.db.get_records('modelname', fields=['name'],
+                                      filters=[('age', 'gt', 10)])
+        self.assertEqual(records, [{'id': '1', 'name': u'R\xe9mi'},
+                                   {'id': '2', 'name': u'Alexis'}])
+        records = self.db.iter_records('modelname', fields=['age'])
+        self.assertEqual(list(records), [{'id': '0', 'age': 7},
+                                         {'id': '1', 'age': 12},
+                                         {'id': '2', 'age': 30},
+                                         {'id': '3'}])
+        records = self.db.get_sorted_records('modelname', [('age', True)],
+                                             limit=1, fields=['name'])
+        self.assertEqual(records, [{'id': '2', 'name': u'Alexis'}])
+
+    def _test_policies_modified_by_other_processes(self, policies):
+        self.db.set_policy('read-only', self.policy)
+        policies.refresh(self.db)
+        self.assertEqual(
+            CachedDatabase(self.db, policies).get_policy('read-only'),
+            self.policy)
+        # Another process replaces the policy.
+        self.db.delete_policy('read-only')
+        self.db.set_policy('read-only', {})
+        policies.refresh(self.db)
+        self.assertEqual(
+            CachedDatabase(self.db, policies).get_policy('read-only'), {})
+
+    def _create_located_records(self, indexed):
+        self.definition['fields'].extend([
+            {"name": "location", "type": "point", "required": False},
+            {"name": "area", "type": "geojson", "required": False}])
+        if indexed:
+            self.definition['indexes'] = [['location'], ['area']]
+        self._create_model()
+        records = [{'age': 1, 'location': [2.35, 48.85]},
+                   {'age': 2, 'location': [2.29, 48.86]},
+                   {'age': 3, 'location': [-0.57, 44.84]},
+                   {'age': 4},
+                   {'age': 5, 'area': {
+                       'type': 'Polygon',
+                       'coordinates': [[[-10, 40], [10, 40], [10, 50],
+                                        [-10, 40]]]}}]
+        for i, record in enumerate(records):
+            self.db.put_record('modelname', record, ['author'], str(i))
+
+    def _test_located_records(self):
+        paris = (2.2, 48.8, 2.4, 48.9)
+        self.assertFiltered([('location', 'bbox', paris)], ['0', '1'])
+        self.assertFiltered([('location', 'bbox', paris),
+                             ('age', 'gt', 1)], ['1'])
+        self.assertFiltered([('location', 'bbox', (-180, -90, 180, 90))],
+                            ['0', '1', '2'])
+        self.assertFiltered([('location', 'bbox', paris)], ['1'], limit=1,
+                            start='0')
+        self.assertFiltered([('area', 'bbox', paris)], ['4'])
+        self.assertFiltered([('area', 'bbox', (20, 0, 30, 10))], [])
+
+        def nearest(point, limit=None, filters=None):
+            records = self.db.get_nearest_records('modelname', 'location',
+                                                  point, limit, filters)
+            return [r['id'] for r in records]
+
+        self.assertEqual(nearest((2.3, 48.86), 1), ['1'])
+        self.assertEqual(nearest((2.3, 48.86), 2), ['1', '0'])
+        self.assertEqual(nearest((0, 45), 2), ['2', '1'])
+        self.assertEqual(nearest((2.3, 48.86)), ['1', '0', '2'])
+        self.assertEqual(nearest((2.3, 48.86), 5), ['1', '0', '2'])
+        self.assertEqual(nearest((2.3, 48.86), 1, [('age', 'gt', 2)]),
+                         ['2'])
+
+        self.db.put_record('modelname', {'age': 2, 'location': [0, 0]},
+                           ['author'], '1')
+        self.db.delete_record('modelname', '0')
+        self.assertFiltered([('location', 'bbox', paris)], [])
+        self.assertEqual(nearest((2.3, 48.86), 1), ['2'])
+
+    def test_records_can_be_located(self):
+        self._create_located_records(indexed=False)
+        self._test_located_records()
+
+    def test_indexed_records_can_be_located(self):
+        self._create_located_records(indexed=True)
+        self._test_located_records()
+
+    def test_spatial_indexes_follow_the_model_definition(self):
+        self._create_located_records(indexed=False)
+        self.definition['indexes'] = [['location']]
+        self.db.put_model(self.definition, self.roles, 'admin-only',
+                          'modelname')
+        paris = (2.2, 48.8, 2.4, 48.9)
+        self.assertFiltered([('location', 'bbox', paris)], ['0', '1'])
+        records = [{'id': '0', 'age': 1},
+                   {'id': '5', 'location': [2.3, 48.85]}]
+        self.db.replace_records('modelname', records, ['author'])
+        self.assertFiltered([('location', 'bbox', paris)], ['5'])
+        self.db.delete_records('modelname')
+        self.assertFiltered([('location', 'bbox', paris)], [])
+
+    def test_model_revision_changes_with_the_model_and_its_records(self):
+        self._create_model()
+        revisions = [self.db.get_model_revision('modelname')]
+        self.db.put_roles('modelname', self.roles)
+        revisions.append(self.db.get_model_revision('modelname'))
+        record_id = self.db.put_record('modelname', self.record, ['Remy'])
+        revisions.append(self.db.get_model_revision('modelname'))
+        self.db.put_records('modelname', [self.record], ['Remy'])
+        revisions.append(self.db.get_model_revision('modelname'))
+        self.db.delete_record('modelname', record_id)
+        revisions.append(self.db.get_model_revision('modelname'))
+        self.db.delete_records('modelname')
+        revisions.append(self.db.get_model_revision('modelname'))
+        # The model and its records are back to a previous state, of which
+        # the revision may be given again.
+        for previous, revision in zip(revisions, revisions[1:]):
+            self.assertNotEqual(previous, revision)
+        self.assertEqual(self.db.get_model_revision('modelname'),
+                         revisions[-1])
+
+    def test_model_revision_does_not_change_with_other_models(self):
+        self._create_model()
+        self.db.put_model(self.definition, self.roles, 'admin-only',
+                          'othermodel')
+        revision = self.db.get_model_revision('modelname')
+        record_id = self.db.put_record('othermodel', self.record, ['Remy'])
+        self.db.delete_record('othermodel', record_id)
+        self.db.put_model(self.definition, self.roles, 'admin-only',
+                          'othermodel')
+        self.assertEqual(self.db.get_model_revision('modelname'), revision)
+
+    def test_record_revision_changes_with_the_record(self):
+        self._create_model()
+        self.db.put_record('modelname', self.record, ['Remy'], 'record')
+        revision = self.db.get_record_revision('modelname', 'record')
+        self.assertEqual(self.db.get_record_revision('modelname', 'record'),
+                         revision)
+        self.db.put_record('modelname', {'age': 8}, ['Remy'], 'record')
+        self.assertNotEqual(
+            self.db.get_record_revision('modelname', 'record'), revision)
+
+    def test_revisions_raise_if_unknown(self):
+        self._create_model()
+        self.assertRaises(ModelNotFound, self.db.get_model_revision,
+                          'unknown')
+        self.assertRaises(RecordNotFound, self.db.get_record_revision,
+                          'modelname', 'unknown')
+        self.assertRaises(RecordNotFound, self.db.get_record_revision,
+                          'unknown', 'unknown')
+
     def test_model_deletion_raises_if_unknwon(self):
         self.assertRaises(ModelNotFound, self.db.delete_model, 'unknown')
 
     def test_policies(self):
+        self.db.set_policy('admin-only', self.policy)
         policies = self.db.get_policies()
         self.assertTrue(isinstance(policies, list))
+        self.assertIn('admin-only', policies)
+
+    def test_policy_is_used(self):
+        self.db.set_policy('unused', self.policy)
+        self._create_model()
+        self.assertTrue(self.db.policy_is_used('admin-only'))
+        self.assertFalse(self.db.policy_is_used('unused'))
+
+    def test_delete_records(self):
+        self._create_model()
+        self.db.put_record('modelname', {'age': 42}, ['Remy'])
+        self.db.put_record('modelname', {'age': 43}, ['Remy'])
+        self.assertEquals(self.db.delete_records('modelname'), 2)
+        self.assertEquals(self.db.get_records('modelname'), [])
+        self.assertEquals(self.db.delete_records('modelname'), 0)
 
 
 class TestCouchDBBackend(BackendTestBase, TestCase):
@@ -187,6 +587,166 @@ class TestCouchDBBackend(BackendTestBase, TestCase):
     def tearDown(self):
         del self.server[self.db_name]
 
+    def test_users_and_policies_have_deterministic_ids(self):
+        self.db.add_user({'name': 'Remy'})
+        self.db.set_policy('admin-only', self.policy)
+        self.assertIn('user/Remy', self.server[self.db_name])
+        self.assertIn('policy/admin-only', self.server[self.db_name])
+
+    def test_users_and_policies_ids_are_not_models_or_records_ids(self):
+        self.db.set_policy('admin-only', self.policy)
+        self.db.put_model(self.definition, self.roles, 'admin-only', 'user')
+        self.db.put_record('user', self.record, ['Remy'], 'Remy')
+        self.db.add_user({'name': 'Remy'})
+        self.assertEqual(self.db.get_user('Remy')['name'], 'Remy')
+        self.db.put_model(self.definition, self.roles, 'admin-only',
+                          'policy-admin-only')
+        self.assertEqual(self.db.get_policy('admin-only'), self.policy)
+        self.assertEqual(self.db.get_record('user', 'Remy'), self.record)
+
+    def test_delete_records_by_batches(self):
+        self.db.batch_size = 2
+        self._create_model()
+        for age in range(5):
+            self.db.put_record('modelname', {'age': age}, ['Remy'])
+        with mock.patch.object(self.db._db, 'update',
+                               wraps=self.db._db.update) as update:
+            self.assertEquals(self.db.delete_records('modelname'), 5)
+            self.assertEquals(update.call_count, 3)
+        self.assertEquals(self.db.get_records('modelname'), [])
+
+    def _create_indexed_records(self):
+        self.definition['fields'].extend([
+            {'name': 'name', 'type': 'string'},
+            {'name': 'tags', 'type': 'choices', 'choices': [u'a', u'b']},
+            {'name': 'notes', 'type': 'text', 'required': False}])
+        self._create_filtered_records()
+
+    def test_records_are_filtered_with_the_values_of_a_field(self):
+        self._create_indexed_records()
+        with mock.patch.object(views, 'records') as records:
+            self.assertFiltered([('age', 'gt', 7), ('age', 'lt', 30)],
+                                ['1'])
+            self.assertFiltered([('name', 'in', [u'Remy', u'remy'])],
+                                ['0', '3'])
+            self.assertFiltered([('age', 'gt', 7), ('tags', 'contains', u'b')],
+                                ['1'])
+            filtered = self.db.iter_records('modelname',
+                                            filters=[('name', 'prefix', u'R')])
+            self.assertEqual([r['id'] for r in filtered], ['0', '1'])
+        self.assertFalse(records.called)
+
+    def test_texts_are_not_in_the_fields_index(self):
+        self._create_indexed_records()
+        self.db.put_record('modelname', {'name': u'Remy', 'notes': u'Notes'},
+                           ['author'], 'notes')
+        index = views.fields_index('modelname', ['age', 'name', 'tags'])
+        keys = [row.key for row in index(self.server[self.db_name])]
+        self.assertEqual(set(key[0] for key in keys),
+                         set(['age', 'name', 'tags']))
+        with mock.patch.object(views, 'records',
+                               wraps=views.records) as records:
+            self.assertFiltered([('notes', 'eq', u'Notes')], ['notes'])
+        self.assertTrue(records.called)
+
+    def test_models_indexes_are_migrated(self):
+        self._create_indexed_records()
+        couchdb = self.server[self.db_name]
+        couchdb.delete(couchdb['_design/indexes-modelname'])
+        self.assertEqual(migrate_models_indexes(couchdb), 1)
+        self.assertFiltered([('name', 'eq', u'Remy')], ['0'])
+
+    def test_unchanged_records_are_not_rewritten(self):
+        self._create_model()
+        record_id = self.db.put_record('modelname', {'age': 42}, ['Remy'])
+        docid = 'modelname-%s' % record_id
+        rev = self.server[self.db_name][docid]['_rev']
+        self.db.replace_records('modelname', [{'id': record_id, 'age': 42}],
+                                ['Remy'])
+        self.assertEqual(self.server[self.db_name][docid]['_rev'], rev)
+
+    def test_records_writes_do_not_rewrite_the_model_document(self):
+        self._create_model()
+        rev = self.server[self.db_name]['modelname']['_rev']
+        revision = self.db.get_model_revision('modelname')
+        self.db.put_records('modelname', [{'age': 42}], ['Remy'])
+        self.assertNotEqual(self.db.get_model_revision('modelname'),
+                            revision)
+        self.db.delete_records('modelname')
+        self.assertEqual(self.server[self.db_name]['modelname']['_rev'], rev)
+
+    def test_users_and_policies_ids_are_migrated(self):
+        couchdb = self.server[self.db_name]
+        couchdb.save({'type': 'user', 'name': 'Remy',
+                      'user': {'name': 'Remy', 'groups': []}})
+        couchdb.save({'type': 'policy', 'name': 'admin-only',
+                      'policy': self.policy})
+        self.assertRaises(UserNotFound, self.db.get_user, 'Remy')
+
+        self.assertEqual(migrate_documents_ids(couchdb), 2)
+        self.assertEqual(self.db.get_user('Remy')['name'], 'Remy')
+        self.assertEqual(self.db.get_policy('admin-only'), self.policy)
+        self.assertEqual(migrate_documents_ids(couchdb), 0)
+
+    def test_users_and_policies_dashed_ids_are_migrated(self):
+        couchdb = self.server[self.db_name]
+        couchdb.save({'_id': 'user-Remy', 'type': 'user', 'name': 'Remy',
+                      'user': {'name': 'Remy', 'groups': []}})
+        self.assertEqual(migrate_documents_ids(couchdb), 1)
+        self.assertNotIn('user-Remy', couchdb)
+        self.assertEqual(self.db.get_user('Remy')['name'], 'Remy')
+
+    def test_backend_shares_a_single_database_handle(self):
+        config = testing.setUp(settings={
+            'backend.db_host': 'http://localhost:5984/',
+            'backend.db_name': self.db_name,
+            'backend.pool_size': '2',
+            'backend.follow_changes': 'false',
+            'daybed.id_generator':
+            'daybed.backends.id_generators.UUID4Generator'})
+        try:
+            backend = CouchDBBackend(config)
+        finally:
+            testing.tearDown()
+        self.assertIs(backend.db(), backend.db())
+
+        backend.db().set_policy('admin-only', self.policy)
+        backend.db().get_policy('admin-only')
+        stats = backend.pool_stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['created'], 1)
+        self.assertGreater(stats['reused'], 0)
+
+    def test_indexes_are_synchronized_with_the_model(self):
+        self.definition['indexes'] = [['age']]
+        self._create_model()
+        couchdb = self.server[self.db_name]
+        design = couchdb['_design/indexes-modelname']
+        self.assertEqual(sorted(design['views'].keys()), ['_fields', 'age'])
+        with mock.patch.object(self.db._db, 'view',
+                               wraps=self.db._db.view) as view:
+            self.db.get_records('modelname', filters=[('age', 'eq', 7)])
+            self.assertEqual(view.call_args[0][0],
+                             'indexes-modelname/age')
+        self.db.delete_model('modelname')
+        self.assertNotIn('_design/indexes-modelname', couchdb)
+
+    def test_spatial_indexes_are_views_of_cells(self):
+        self._create_located_records(indexed=True)
+        couchdb = self.server[self.db_name]
+        design = couchdb['_design/indexes-modelname']
+        self.assertEqual(sorted(design['views'].keys()),
+                         ['_fields', 'area', 'location'])
+        with mock.patch.object(self.db._db, 'view',
+                               wraps=self.db._db.view) as view:
+            self.assertFiltered([('location', 'bbox', (2, 48, 3, 49))],
+                                ['0', '1'])
+            self.assertEqual(view.call_args_list[0][0][0],
+                             'indexes-modelname/location')
+        rows = couchdb.view('indexes-modelname/area', key=None)
+        self.assertEqual([row.id for row in rows], ['modelname-4'])
+
     def test_server_unreachable(self):
         config = mock.Mock()
         config.registry = mock.Mock()
@@ -204,8 +764,548 @@ class TestMemoryBackend(BackendTestBase, TestCase):
         empty = {
             'models': {},
             'data': {},
+            'index': {},
             'users': {},
             'policies': {}
         }
         self.db = MemoryDatabase(empty, lambda: six.text_type(uuid4()))
         super(TestMemoryBackend, self).setUp()
+
+    def test_stored_documents_are_not_modified_by_callers(self):
+        self._create_model()
+        self.definition['fields'].append({'name': 'size', 'type': 'int'})
+        definition = self.db.get_model_definition('modelname')
+        self.assertEqual(len(definition['fields']), 1)
+        self.assertRaises(TypeError, definition['fields'].append, {})
+        self.assertRaises(TypeError, definition.update, {})
+
+    def test_returned_records_can_be_modified_once_copied(self):
+        self._create_model()
+        self.db.put_record('modelname', self.record, ['author'], 'record')
+        record = self.db.get_record('modelname', 'record').copy()
+        record['age'] = 42
+        self.assertEqual(self.db.get_record('modelname', 'record'),
+                         {'age': 7})
+
+    def test_listed_records_can_be_modified(self):
+        self._create_model()
+        self.db.put_record('modelname', self.record, ['author'], 'record')
+        self.db.get_records('modelname')[0]['age'] = 42
+        self.assertEqual(self.db.get_record('modelname', 'record'),
+                         {'age': 7})
+
+
+class SortedIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = SortedIndex(['name', 'age'])
+        self.index.add('a', {'name': 'Remy', 'age': 30})
+        self.index.add('b', {'name': 'Alexis', 'age': 12})
+        self.index.add('c', {'name': 'Remy', 'age': 7})
+        self.index.add('d', {'age': 7})
+
+    def test_lookup_ranges_of_values(self):
+        self.assertEqual(list(self.index.lookup(('Remy',), ('Remy',))),
+                         ['c', 'a'])
+        self.assertEqual(list(self.index.lookup(('Remy', 10), ('Remy',))),
+                         ['a'])
+        self.assertEqual(list(self.index.lookup((), ('Alexis',))),
+                         ['d', 'b'])
+
+    def test_records_are_iterated_in_order(self):
+        self.assertEqual(list(self.index.ids()), ['d', 'b', 'c', 'a'])
+        self.assertEqual(list(self.index.ids(reverse=True)),
+                         ['a', 'c', 'b', 'd'])
+
+    def test_records_are_reindexed_when_updated_or_removed(self):
+        self.index.add('a', {'name': 'Alexis', 'age': 30})
+        self.index.remove('c')
+        self.index.remove('unknown')
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(list(self.index.lookup(('Alexis',), ('Alexis',))),
+                         ['b', 'a'])
+
+
+class GridIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = GridIndex('location')
+        self.index.add('a', {'location': [2.35, 48.85]})
+        self.index.add('b', {'location': [[0, 0], [0.05, 0.05]]})
+        self.index.add('c', {'location': [[-100, -50], [100, 50]]})
+        self.index.add('d', {})
+
+    def test_lookup_records_intersecting_a_box(self):
+        self.assertEqual(self.index.lookup((2, 48, 3, 49)), set(['a', 'c']))
+        self.assertEqual(self.index.lookup((0.06, 0.06, 0.07, 0.07)),
+                         set(['c']))
+        self.assertEqual(self.index.lookup((-180, -90, 180, 90)),
+                         set(['a', 'b', 'c']))
+
+    def test_records_are_reindexed_when_updated_or_removed(self):
+        self.index.add('a', {'location': [0.01, 0.01]})
+        self.index.remove('c')
+        self.index.remove('unknown')
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.lookup((0, 0, 0.02, 0.02)),
+                         set(['a', 'b']))
+        self.assertEqual(self.index.lookup((2, 48, 3, 49)), set())
+
+
+class TestSQLBackend(BackendTestBase, TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp(settings={
+            'backend.db_url': 'sqlite://:memory:',
+            'daybed.id_generator':
+            'daybed.backends.id_generators.UUID4Generator'})
+        self.backend = SQLBackend(self.config)
+        self.db = self.backend.db()
+        super(TestSQLBackend, self).setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_delete_db(self):
+        self._create_model()
+        self.backend.delete_db()
+        self.assertRaises(ModelNotFound, self.db.get_model, 'modelname')
+
+    def test_dialect_from_url(self):
+        self.assertEqual(dialect_from_url('sqlite:///tmp/daybed.db').path,
+                         '/tmp/daybed.db')
+        self.assertTrue(self.backend.dialect.in_memory)
+        self.assertRaises(ValueError, dialect_from_url, 'mysql://localhost')
+
+    def test_policies_modified_by_other_processes_are_not_cached(self):
+        self._test_policies_modified_by_other_processes(
+            self.backend.policies)
+
+    def test_failed_transactions_are_rolled_back(self):
+        self._create_model()
+        self.db.generate_id = lambda: 'same'
+        self.assertRaises(self.backend.dialect.IntegrityError,
+                          self.db.put_records, 'modelname',
+                          [{'age': 1}, {'age': 2}], ['Remy'])
+        self.assertEqual(self.db.get_records('modelname'), [])
+
+    def test_indexes_are_used_by_filters(self):
+        self.definition['indexes'] = [['age']]
+        self._create_model()
+        dialect = self.backend.dialect
+        query, params = dialect.filter_records([('age', 'gt', 7)], None)
+        with self.db._pool.transaction() as connection:
+            plan = connection.execute('EXPLAIN QUERY PLAN ' + query,
+                                      ['modelname', ''] + params).fetchall()
+        self.assertIn('records_', ' '.join(str(row[-1]) for row in plan))
+
+    def test_indexes_are_used_by_sorts(self):
+        self.definition['indexes'] = [['age']]
+        self._create_model()
+        dialect = self.backend.dialect
+        query, params = dialect.filter_records([], limit=True, offset=True,
+                                               sort=[('age', True)])
+        with self.db._pool.transaction() as connection:
+            plan = connection.execute('EXPLAIN QUERY PLAN ' + query,
+                                      ['modelname', 10, 0]).fetchall()
+        plan = ' '.join(str(row[-1]) for row in plan)
+        self.assertIn('records_', plan)
+        self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_projections_keep_the_values_types(self):
+        self.definition['fields'].append({"name": "done",
+                                          "type": "boolean"})
+        self._create_model()
+        self.db.put_record('modelname', {'age': 1, 'done': True},
+                           ['author'], 'a')
+        self.assertEqual(self.db.get_records('modelname', fields=['done']),
+                         [{'id': 'a', 'done': True}])
+
+    def test_spatial_indexes_are_stored_by_cells(self):
+        self._create_located_records(indexed=True)
+        with self.db._pool.transaction() as connection:
+            rows = connection.execute(
+                'SELECT record_id, x, y FROM record_cells '
+                'ORDER BY record_id').fetchall()
+        self.assertEqual(rows, [('0', 23, 488), ('1', 22, 488),
+                                ('2', -6, 448), ('4', None, None)])
+        self.db.delete_model('modelname')
+        with self.db._pool.transaction() as connection:
+            rows = connection.execute(
+                'SELECT * FROM record_cells').fetchall()
+        self.assertEqual(rows, [])
+
+
+class TestRedisBackend(BackendTestBase, TestCase):
+
+    def setUp(self):
+        self.client = fakeredis.FakeStrictRedis(decode_responses=True)
+        self.db = RedisDatabase(self.client, lambda: six.text_type(uuid4()),
+                                prefix='test:')
+        super(TestRedisBackend, self).setUp()
+
+    def tearDown(self):
+        self.client.flushall()
+
+    def test_policies_modified_by_other_processes_are_not_cached(self):
+        self._test_policies_modified_by_other_processes(
+            PoliciesCache(shared=True))
+
+    def test_records_are_stored_in_a_hash(self):
+        self._create_model()
+        self.db.put_record('modelname', self.record, ['Remy'], 'record')
+        self.assertEqual(self.client.hkeys('test:records:modelname'),
+                         ['record'])
+        self.assertEqual(self.client.smembers('test:authors:modelname:record'),
+                         set(['Remy']))
+
+    def test_records_are_deleted_by_batches(self):
+        self.db.batch_size = 2
+        self._create_model()
+        self.db.put_records('modelname', [{'age': i} for i in range(5)],
+                            ['Remy'])
+        self.assertEqual(self.db.delete_records('modelname'), 5)
+        self.assertEqual(self.client.keys('test:authors:*'), [])
+        self.assertEqual(self.db.get_records('modelname'), [])
+
+    def test_indexed_records_are_read_from_sorted_sets(self):
+        self.definition['indexes'] = [['age']]
+        self._create_filtered_records()
+        key = 'test:values:modelname:["age"]'
+        # Records without age are indexed too.
+        self.assertEqual(self.client.zcard(key), 4)
+        with mock.patch('daybed.backends.redis.database.filter_records') \
+                as scan:
+            self.assertFiltered([('age', 'gt', 7)], ['1', '2'])
+            self.assertFiltered([('age', 'lt', 30)], ['1'], start='0')
+            self.db.put_record('modelname', {'age': 40}, ['author'], '1')
+            self.assertFiltered([('age', 'eq', 12)], [])
+            self.assertFiltered([('age', 'in', [7, 40])], ['0', '1'])
+        self.assertFalse(scan.called)
+        self.assertEqual(self.client.zcard(key), 4)
+
+    def test_indexes_are_deleted_with_the_records(self):
+        self.definition['indexes'] = [['age'], ['name', 'age']]
+        self._create_filtered_records()
+        self.db.delete_record('modelname', '0')
+        self.assertEqual(self.client.zcard('test:values:modelname:["age"]'),
+                         3)
+        self.db.delete_records('modelname')
+        self.db.replace_records('modelname', [{'id': '5', 'age': 5}],
+                                ['author'])
+        self.assertEqual(self.client.zrange('test:values:modelname:["age"]',
+                                            0, -1)[0][-1], '5')
+        self.db.delete_model('modelname')
+        self.assertEqual(self.client.keys('test:values:*'), [])
+
+    def test_policy_usage_follows_model_updates(self):
+        self._create_model()
+        self.db.set_policy('other', self.policy)
+        self.db.put_model(self.definition, self.roles, 'other', 'modelname')
+        self.assertFalse(self.db.policy_is_used('admin-only'))
+        self.assertTrue(self.db.policy_is_used('other'))
+
+
+class RedisIndexTest(TestCase):
+
+    def test_values_are_encoded_in_order(self):
+        values = [None, -1e300, -2, Decimal('-1.5'), 0, False, True, 1.5,
+                  12, 2 ** 60, u'', u'\x00', u'\x01b', u'a', u'ab', u'b',
+                  u'\xe9', [1], {'a': 1}]
+        encoded = [encode_value(value) for value in values]
+        self.assertEqual(sorted(encoded), encoded)
+        # 0 and False are equal.
+        self.assertEqual(len(set(encoded)), len(encoded) - 1)
+
+    def test_members_give_the_records_ids(self):
+        fields = ('name', 'age')
+        member = index_member(fields, u'a\x01b', {'name': u'x\x01'})
+        self.assertEqual(member_id(fields, member), u'a\x01b')
+
+    def test_ranges_contain_the_values_beginning_with_their_bounds(self):
+        low, high = lex_range((u'a',), (u'a' + PREFIX_END,))
+        member = index_member(('name', 'age'), u'1', {'name': u'ab'})
+        self.assertTrue(low[1:] <= member.encode('utf-8') <= high[1:])
+        self.assertEqual(lex_range((), ()), (b'-', b'+'))
+
+
+class TestLogBackend(BackendTestBase, TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = LogStore(self.path)
+        self.db = LogDatabase(self.store, lambda: six.text_type(uuid4()))
+        super(TestLogBackend, self).setUp()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def test_documents_are_reloaded_from_the_segments(self):
+        self._create_model()
+        self.db.put_record('modelname', self.record, ['Remy'], 'record')
+        self.db.delete_policy('admin-only')
+        self.store.close()
+        self.store = LogStore(self.path)
+        db = LogDatabase(self.store, self.db.generate_id)
+        self.assertEqual(db.get_record('modelname', 'record'), self.record)
+        self.assertRaises(PolicyNotFound, db.get_policy, 'admin-only')
+
+
+class LogStoreTest(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = LogStore(self.path, segment_size=100)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def reopen(self):
+        self.store.close()
+        self.store = LogStore(self.path, segment_size=100)
+
+    def test_documents_are_overwritten_and_deleted(self):
+        self.store.write([(('a',), {'v': 1}), (('b',), {'v': 1})])
+        self.store.write([(('a',), {'v': 2})], [('b',)])
+        self.assertEqual(self.store.get(('a',)), {'v': 2})
+        self.assertIsNone(self.store.get(('b',)))
+        self.assertEqual(self.store.children(()), ['a'])
+
+    def test_incomplete_entries_are_truncated(self):
+        self.store.write([(('a',), {'v': 1})])
+        segment = os.path.join(self.path, os.listdir(self.path)[0])
+        with open(segment, 'ab') as f:
+            f.write(b'{"k":["b"],"d":')
+        self.reopen()
+        self.assertEqual(self.store.children(()), ['a'])
+        self.store.write([(('b',), {'v': 2})])
+        self.reopen()
+        self.assertEqual(self.store.get(('b',)), {'v': 2})
+
+    def test_segments_are_rotated(self):
+        for i in range(10):
+            self.store.write([(('records', 'model', str(i)), {'v': i})])
+        self.assertTrue(len(os.listdir(self.path)) > 1)
+        self.reopen()
+        self.assertEqual(self.store.children(('records', 'model'), start='4',
+                                             limit=2), ['5', '6'])
+
+    def test_compaction_keeps_live_documents_only(self):
+        for i in range(10):
+            self.store.write([(('a',), {'v': i})])
+        self.store.write([(('b',), {'v': 0})], [('a',)])
+        self.store.write([(('c',), {'v': 0})])
+        self.assertTrue(self.store.dead_ratio() > 0.5)
+        self.store.compact()
+        self.assertEqual(self.store.dead_ratio(), 0.0)
+        self.assertEqual(len(os.listdir(self.path)), 2)
+        self.assertEqual(self.store.get(('b',)), {'v': 0})
+        self.reopen()
+        self.assertIsNone(self.store.get(('a',)))
+        self.assertEqual(self.store.get(('c',)), {'v': 0})
+
+    def test_segments_merged_by_a_compaction_are_ignored(self):
+        for i in range(10):
+            self.store.write([(('a',), {'v': i})])
+        self.store.write([(('c',), {'v': 0})])
+        segments = sorted(os.listdir(self.path))
+        with open(os.path.join(self.path, segments[0]), 'rb') as f:
+            first = f.read()
+        self.store.compact()
+        # As if the compaction had been interrupted before the deletions.
+        with open(os.path.join(self.path, segments[0]), 'wb') as f:
+            f.write(first)
+        self.reopen()
+        self.assertEqual(self.store.get(('a',)), {'v': 9})
+        self.assertFalse(os.path.exists(os.path.join(self.path,
+                                                     segments[0])))
+
+
+class ConnectionPoolTest(TestCase):
+
+    def test_connections_are_reused(self):
+        connect = mock.Mock()
+        pool = ConnectionPool(connect, size=2)
+        with pool.transaction():
+            pass
+        with pool.transaction() as connection:
+            connection.commit.assert_called_once_with()
+        self.assertEqual(connect.call_count, 1)
+
+    def test_changes_are_rolled_back_on_error(self):
+        pool = ConnectionPool(mock.Mock(), size=1)
+        try:
+            with pool.transaction() as connection:
+                raise ValueError
+        except ValueError:
+            pass
+        connection.rollback.assert_called_once_with()
+        self.assertFalse(connection.commit.called)
+
+
+class CouchDBConnectionPoolTest(TestCase):
+
+    url = 'http://localhost:5984/'
+
+    def test_idle_connections_are_limited_to_the_pool_size(self):
+        pool = CouchDBConnectionPool(timeout=None, size=1)
+        first, second = pool.get(self.url), pool.get(self.url)
+        self.assertEqual(pool.stats()['in_use'], 2)
+        pool.release(self.url, first)
+        pool.release(self.url, second)
+        self.assertIs(pool.get(self.url), first)
+        stats = pool.stats()
+        self.assertEqual((stats['in_use'], stats['idle'], stats['peak']),
+                         (1, 0, 2))
+        self.assertEqual((stats['created'], stats['reused'],
+                          stats['discarded']), (2, 1, 1))
+
+    def test_connections_are_closed_without_keep_alive(self):
+        pool = CouchDBConnectionPool(timeout=None, keep_alive=False)
+        conn = pool.get(self.url)
+        with mock.patch.object(conn, 'close') as close:
+            pool.release(self.url, conn)
+            close.assert_called_once_with()
+        self.assertEqual(pool.stats()['idle'], 0)
+
+    def test_failed_requests_are_retried_with_backoff(self):
+        session = couchdb_session(retries=3, retry_delay=0.5)
+        self.assertEqual(session.retry_delays, [0.5, 1.0, 2.0])
+
+
+class TestCachedDatabase(BackendTestBase, TestCase):
+
+    def setUp(self):
+        empty = {
+            'models': {},
+            'data': {},
+            'index': {},
+            'users': {},
+            'policies': {}
+        }
+        database = MemoryDatabase(empty, lambda: six.text_type(uuid4()))
+        self.backend_db = mock.Mock(wraps=database)
+        self.db = CachedDatabase(self.backend_db)
+        super(TestCachedDatabase, self).setUp()
+
+    def test_model_is_fetched_once(self):
+        self._create_model()
+        self.db.get_model_definition('modelname')
+        self.db.get_roles('modelname')
+        self.db.get_model_policy('modelname')
+        self.db.get_model_policy_id('modelname')
+        self.assertEqual(self.backend_db.get_model.call_count, 1)
+        self.assertEqual(self.backend_db.get_policy.call_count, 1)
+
+    def test_model_revision_is_fetched_once(self):
+        self._create_model()
+        revision = self.db.get_model_revision('modelname')
+        self.assertEqual(self.db.get_model_revision('modelname'), revision)
+        self.assertEqual(self.backend_db.get_model_revision.call_count, 1)
+        self.db.put_record('modelname', self.record, ['Remy'])
+        self.assertNotEqual(self.db.get_model_revision('modelname'),
+                            revision)
+
+    def test_record_is_fetched_once(self):
+        self._create_model()
+        self.db.put_record('modelname', self.record, ['Remy'], 'record')
+        self.db.get_record_authors('modelname', 'record')
+        self.db.get_record_revision('modelname', 'record')
+        self.assertEqual(self.db.get_record('modelname', 'record'),
+                         self.record)
+        self.assertEqual(self.backend_db.get_record_document.call_count, 1)
+        self.assertFalse(self.backend_db.get_record.called)
+
+    def test_model_not_found_is_cached(self):
+        self.assertRaises(ModelNotFound, self.db.get_roles, 'unknown')
+        self.assertRaises(ModelNotFound, self.db.get_model_policy, 'unknown')
+        self.assertEqual(self.backend_db.get_model.call_count, 1)
+
+    def test_writes_empty_the_cache(self):
+        self.assertRaises(ModelNotFound, self.db.get_roles, 'modelname')
+        self._create_model()
+        self.assertEqual(self.db.get_roles('modelname'), self.roles)
+        self.db.add_role('modelname', 'authors', ['Benoit'])
+        self.assertIn('authors', self.db.get_roles('modelname'))
+
+    def test_user_is_fetched_once(self):
+        self.db.add_user({'name': 'Remy', 'groups': ['toto']})
+        self.db.get_user('Remy')
+        self.assertEqual(self.db.get_groups('Remy'), ['toto'])
+        self.assertEqual(self.backend_db.get_user.call_count, 1)
+
+    def test_policy_is_fetched_once_by_process(self):
+        self.db.set_policy('admin-only', self.policy)
+        other_request_db = CachedDatabase(self.backend_db, self.db._policies)
+        self.db.get_policy('admin-only')
+        other_request_db.get_policy('admin-only')
+        self.assertEqual(self.backend_db.get_policy.call_count, 1)
+
+    def test_policy_masks(self):
+        self._create_model()
+        self.assertEqual(self.db.get_model_policy_masks('modelname'),
+                         {'role:admins': 0x8000})
+
+    def test_policy_changes_empty_the_process_cache(self):
+        self.db.set_policy('admin-only', self.policy)
+        self.db.get_policy('admin-only')
+        self.db.delete_policy('admin-only')
+        self.assertRaises(PolicyNotFound, self.db.get_policy, 'admin-only')
+
+
+class PoliciesCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = PoliciesCache()
+        self.fetch = mock.Mock(return_value={'role:admins': {}})
+
+    def test_policy_is_fetched_once(self):
+        self.cache.get('read-only', self.fetch)
+        self.cache.get('read-only', self.fetch)
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_policy_is_fetched_again_once_invalidated(self):
+        self.cache.get('read-only', self.fetch)
+        self.cache.invalidate('read-only')
+        self.cache.get('read-only', self.fetch)
+        self.cache.invalidate()
+        self.cache.get('read-only', self.fetch)
+        self.assertEqual(self.fetch.call_count, 3)
+
+    def test_policy_fetched_before_an_invalidation_is_not_cached(self):
+        def fetch(policy_name):
+            # The policy is modified while it is being fetched.
+            self.cache.invalidate(policy_name)
+            return {'role:admins': {}}
+
+        self.cache.get('read-only', fetch)
+        self.assertIsNone(self.cache.peek('read-only'))
+        self.cache.get('read-only', self.fetch)
+        self.assertIsNotNone(self.cache.peek('read-only'))
+
+
+class FrozenTest(TestCase):
+
+    def test_frozen_values_are_still_dicts_and_lists(self):
+        frozen = freeze({'a': [1, {'b': 2}]})
+        self.assertEqual(frozen, {'a': [1, {'b': 2}]})
+        self.assertTrue(isinstance(frozen['a'][1], dict))
+
+    def test_frozen_values_are_immutable(self):
+        frozen = freeze({'a': [1]})
+        self.assertRaises(TypeError, frozen.__setitem__, 'b', 2)
+        self.assertRaises(TypeError, frozen.pop, 'a')
+        self.assertRaises(TypeError, frozen['a'].append, 2)
+
+    def test_frozen_parts_are_shared(self):
+        frozen = freeze({'a': [1]})
+        self.assertIs(freeze({'b': frozen})['b'], frozen)
+
+    def test_copies_are_mutable(self):
+        frozen = freeze({'a': [1]})
+        copied = deepcopy(frozen)
+        copied['a'].append(2)
+        self.assertEqual(copied, {'a': [1, 2]})
+        self.assertEqual(frozen.copy(), {'a': [1]})
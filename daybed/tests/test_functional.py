@@ -79,7 +79,8 @@ class FunctionalTest(object):
                                  {'definition': self.valid_definition},
                                  headers=self.headers)
 
-        self.assertEquals(len(self.db.get_records(model_id)), 0)
+        # Records are kept if not specified.
+        self.assertEquals(len(self.db.get_records(model_id)), 2)
 
     def test_put_model_definition_with_data(self):
         resp = self.app.post_json('/models',
@@ -2,7 +2,7 @@ import json
 
 from pyramid import testing
 
-from daybed.renderers import GeoJSON
+from daybed.renderers import GeoJSON, JSONP
 from .support import BaseWebTest, force_unicode
 
 
@@ -48,6 +48,11 @@ class TestGeoJSONRenderer(BaseWebTest):
         system = {'request': request}
         return self.renderer(data, system)
 
+    def _streamed(self, data, request=None):
+        request = request or self._build_request()
+        self.assertIsNone(self._rendered(data, request))
+        return b''.join(request.response.app_iter).decode('utf-8')
+
     def test_geojson_renderer_with_empty_collection(self):
         geojson = self._rendered({'data': []})
         self.assertJSONEqual(geojson, {'type': 'FeatureCollection',
@@ -102,3 +107,46 @@ class TestGeoJSONRenderer(BaseWebTest):
                              'coordinates': [[0, 0], [1, 1]]},
                 'properties': {}}
             ]})
+
+    def test_geojson_renderer_streams_generators(self):
+        records = (r for r in [{'location': [0, 0]}, {'location': [1, 1]}])
+        geojson = self._streamed({'data': records})
+        features = json.loads(geojson)['features']
+        self.assertEqual(len(features), 2)
+        self.assertDictEqual(features[1]['geometry'],
+                             {'type': 'Point', 'coordinates': [1, 1]})
+
+
+class TestJSONPRenderer(BaseWebTest):
+
+    def setUp(self):
+        super(TestJSONPRenderer, self).setUp()
+        self.renderer = JSONP(param_name='callback')(None)
+
+    def _streamed(self, data, request=None):
+        request = request or testing.DummyRequest()
+        self.assertIsNone(self.renderer(data, {'request': request}))
+        return b''.join(request.response.app_iter).decode('utf-8')
+
+    def test_jsonp_renderer_does_not_stream_lists(self):
+        request = testing.DummyRequest()
+        rendered = self.renderer({'data': [1, 2]}, {'request': request})
+        self.assertEqual(json.loads(rendered), {'data': [1, 2]})
+
+    def test_jsonp_renderer_streams_generators(self):
+        data = {'data': (i for i in range(250)), 'title': 'numbers'}
+        streamed = json.loads(self._streamed(data))
+        self.assertEqual(streamed, {'data': list(range(250)),
+                                    'title': 'numbers'})
+
+    def test_jsonp_renderer_streams_empty_generators(self):
+        streamed = self._streamed({'data': (i for i in [])})
+        self.assertEqual(json.loads(streamed), {'data': []})
+
+    def test_jsonp_renderer_streams_with_callback(self):
+        request = testing.DummyRequest()
+        request.GET['callback'] = 'func'
+        streamed = self._streamed({'data': (i for i in [1])}, request)
+        self.assertEqual(streamed, '/**/func({"data": [1]});')
+        self.assertEqual(request.response.content_type,
+                         'application/javascript')
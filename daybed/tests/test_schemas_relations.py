@@ -1,6 +1,8 @@
 import colander
+import webtest
 
 from daybed import schemas
+from daybed.backends.exceptions import UserAlreadyExist
 from daybed.tests.support import BaseWebTest
 
 
@@ -113,3 +115,30 @@ class AnyOfFieldTest(RelationTest):
                                                           known_id2)))
         self.assertEqual([known_id, known_id2],
                          validator.deserialize([known_id, known_id2]))
+
+
+class RelationsValidationTest(RelationTest):
+    def _create_relation(self, app):
+        definition = {'title': 'choice', 'description': 'choice',
+                      'fields': [{'name': 'simple', 'type': 'oneof',
+                                  'model': 'simple'}]}
+        app.put_json('/models/choice', {'definition': definition},
+                     headers=self.headers)
+
+    def test_records_are_looked_up_in_the_database_of_the_application(self):
+        record_id = self._create_model()
+        self._create_relation(self.app)
+        app = self.app
+        other = webtest.TestApp("config:conf/tests.ini", relative_to='.')
+        try:
+            other.app.registry.backend.db().add_user(
+                {'name': 'admin', 'groups': ['admins'], 'apitoken': 'foo'})
+        except UserAlreadyExist:
+            pass
+        self.app = other
+        other_id = self._create_model()
+        self._create_relation(other)
+        app.post_json('/models/choice/records', {'simple': record_id},
+                      headers=self.headers)
+        other.post_json('/models/choice/records', {'simple': other_id},
+                        headers=self.headers)
@@ -5,7 +5,7 @@ from pyramid.testing import DummyRequest
 from pyramid.security import Authenticated
 
 from daybed.schemas.validators import (validator, RolesValidator,
-                                       PolicyValidator)
+                                       PolicyValidator, RecordValidatorCache)
 from daybed.tests.support import unittest
 from daybed.acl import PERMISSION_FULL
 
@@ -72,3 +72,48 @@ class PolicyValidatorTests(unittest.TestCase):
     def test_can_have_both_title_and_roles(self):
         policy = {'title': 'Open to everyone', 'role:admins': PERMISSION_FULL}
         self.assertEquals(policy, self.schema.deserialize(policy))
+
+
+class RecordValidatorCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = RecordValidatorCache(size=2)
+        self.definition = {
+            'fields': [{'name': 'age', 'type': 'int', 'required': False}]
+        }
+
+    def test_schema_is_reused_for_same_definition(self):
+        schema = self.cache.get('mushroom', self.definition)
+        self.assertIs(schema, self.cache.get('mushroom', self.definition))
+
+    def test_definition_is_not_modified(self):
+        self.cache.get('mushroom', self.definition)
+        self.assertEquals(self.definition['fields'][0]['type'], 'int')
+
+    def test_schema_is_rebuilt_if_definition_changed(self):
+        schema = self.cache.get('mushroom', self.definition)
+        self.definition['fields'][0]['type'] = 'string'
+        changed = self.cache.get('mushroom', self.definition)
+        self.assertIsNot(schema, changed)
+        self.assertEquals(changed.deserialize({'age': 'old'}), {'age': 'old'})
+        self.assertEquals(len(self.cache), 1)
+
+    def test_schema_is_rebuilt_if_invalidated(self):
+        schema = self.cache.get('mushroom', self.definition)
+        self.cache.invalidate('mushroom')
+        self.assertIsNot(schema, self.cache.get('mushroom', self.definition))
+
+    def test_least_recently_used_is_evicted(self):
+        schema = self.cache.get('mushroom', self.definition)
+        self.cache.get('city', self.definition)
+        self.cache.get('mushroom', self.definition)
+        self.cache.get('todo', self.definition)
+        self.assertEquals(len(self.cache), 2)
+        self.assertIs(schema, self.cache.get('mushroom', self.definition))
+
+    def test_auto_now_schemas_are_not_cached(self):
+        definition = {
+            'fields': [{'name': 'day', 'type': 'date', 'auto_now': True}]
+        }
+        schema = self.cache.get('timestamped', definition)
+        self.assertIsNot(schema, self.cache.get('timestamped', definition))
+        self.assertEquals(len(self.cache), 0)
@@ -0,0 +1,275 @@
+try:
+    from unittest2 import TestCase
+except ImportError:
+    from unittest import TestCase  # flake8: noqa
+
+import webtest
+
+from daybed import tiles
+from daybed.views.cache import TilesCache
+from daybed.views.tiles import MVT
+from .support import BaseWebTest
+
+
+def decode_varint(data, position):
+    """Returns the varint of the data at the specified position, and the
+    position following it.
+    """
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        position += 1
+        if not byte & 0x80:
+            return value, position
+
+
+def decode_packed(data):
+    data = bytearray(data)
+    values = []
+    position = 0
+    while position < len(data):
+        value, position = decode_varint(data, position)
+        values.append(value)
+    return values
+
+
+def decode_message(data):
+    """Decodes a protocol buffers message, as a list of ``(field, value)``
+    tuples, length-delimited values being left encoded.
+    """
+    data = bytearray(data)
+    fields = []
+    position = 0
+    while position < len(data):
+        key, position = decode_varint(data, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, position = decode_varint(data, position)
+        elif wire_type == 1:
+            value = bytes(data[position:position + 8])
+            position += 8
+        else:
+            length, position = decode_varint(data, position)
+            value = bytes(data[position:position + length])
+            position += length
+        fields.append((field, value))
+    return fields
+
+
+def decode_tile(data):
+    """Returns the name, extent and features of the single layer of a
+    vector tile, features being ``(properties, type, commands)`` tuples.
+    """
+    [(number, layer)] = decode_message(data)
+    assert number == 3
+    layer = decode_message(layer)
+    keys = [value.decode('utf-8') for number, value in layer if number == 3]
+    values = []
+    for number, value in layer:
+        if number == 4:
+            [(kind, value)] = decode_message(value)
+            values.append(value.decode('utf-8') if kind == 1 else value)
+    features = []
+    for number, feature in layer:
+        if number != 2:
+            continue
+        feature = dict(decode_message(feature))
+        tags = decode_packed(feature[2])
+        properties = dict((keys[k], values[v])
+                          for k, v in zip(tags[::2], tags[1::2]))
+        features.append((properties, feature[3], decode_packed(feature[4])))
+    layer = dict(layer)
+    return layer[1].decode('utf-8'), layer[5], layer[15], features
+
+
+class TileTest(TestCase):
+
+    def test_positions_are_projected_in_tile_units(self):
+        tile = tiles.Tile(1, 1, 0)
+        x, y = tile.project((90, 0))
+        self.assertAlmostEqual(x, 2048)
+        self.assertAlmostEqual(y, 4096)
+        lon, lat = tile.unproject((x, y))
+        self.assertAlmostEqual(lon, 90)
+        self.assertAlmostEqual(lat, 0)
+
+    def test_bounds_include_the_buffer(self):
+        minx, miny, maxx, maxy = tiles.Tile(0, 0, 0).bounds
+        self.assertLess(minx, -180)
+        self.assertGreater(maxx, 180)
+        self.assertLess(miny, -85)
+
+
+class GeometriesTest(TestCase):
+
+    def test_lines_are_simplified(self):
+        line = [(0, 0), (1, 0.1), (2, 0), (3, 50), (4, 0)]
+        self.assertEqual(tiles.simplify(line, 1),
+                         [(0, 0), (2, 0), (3, 50), (4, 0)])
+
+    def test_lines_are_clipped_in_parts(self):
+        line = [(-100, 10), (100, 10), (100, 200), (120, 100), (120, 10)]
+        self.assertEqual(tiles.clip_line(line, 0, 150),
+                         [[(0, 10), (100, 10), (100, 150)],
+                          [(110, 150), (120, 100), (120, 10)]])
+        self.assertEqual(tiles.clip_line([(-10, 0), (-10, 10)], 0, 150), [])
+
+    def test_rings_are_clipped(self):
+        ring = [(-10, -10), (10, -10), (10, 10), (-10, 10), (-10, -10)]
+        clipped = tiles.clip_ring(ring, 0, 100)
+        self.assertEqual(clipped[0], clipped[-1])
+        self.assertEqual(sorted(set(clipped)),
+                         [(0, 0), (0, 10), (10, 0), (10, 10)])
+        self.assertEqual(tiles.clip_ring(ring, 20, 100), [])
+
+    def test_geojson_geometries_are_split_in_shapes(self):
+        collection = {'type': 'GeometryCollection', 'geometries': [
+            {'type': 'Point', 'coordinates': [1, 2]},
+            {'type': 'MultiLineString', 'coordinates': [[[0, 0], [1, 1]],
+                                                        [[2, 2], [3, 3]]]}]}
+        self.assertEqual(tiles.shapes('geojson', collection), [
+            ('point', [[1, 2]]),
+            ('line', [[[0, 0], [1, 1]], [[2, 2], [3, 3]]])])
+        self.assertEqual(tiles.shapes('polygon', [[[0, 0], [1, 1], [0, 1]]]),
+                         [('polygon', [[[[0, 0], [1, 1], [0, 1]]]])])
+
+
+class VectorTileTest(TestCase):
+
+    def setUp(self):
+        self.tile = tiles.Tile(0, 0, 0, extent=100, buffer=0)
+
+    def test_points_are_encoded_with_their_properties(self):
+        features = [({'id': u'a', 'size': 3, 'ok': True}, 'point',
+                     [(10.2, 20.7), (5, 5)])]
+        name, extent, version, decoded = decode_tile(
+            tiles.mvt(u'places', self.tile, features))
+        self.assertEqual((name, extent, version), (u'places', 100, 2))
+        properties, kind, commands = decoded[0]
+        self.assertEqual(properties['id'], u'a')
+        self.assertEqual(kind, 1)
+        # MoveTo of two points, zigzag encoded deltas.
+        self.assertEqual(commands, [1 | 2 << 3, 20, 42, 9, 31])
+
+    def test_polygons_exterior_rings_are_clockwise(self):
+        ring = [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)]
+        features = [({}, 'polygon', [[ring]])]
+        decoded = decode_tile(tiles.mvt(u'areas', self.tile, features))[3]
+        commands = decoded[0][2]
+        self.assertEqual(commands[0], 1 | 1 << 3)
+        self.assertEqual(commands[3], 2 | 3 << 3)
+        self.assertEqual(commands[-1], 7 | 1 << 3)
+        # From the top right corner down to the bottom right one: clockwise,
+        # the y axis pointing down.
+        self.assertEqual(commands[1:3], [20, 0])
+        self.assertEqual(commands[4:6], [0, 20])
+
+    def test_empty_geometries_are_left_out(self):
+        features = [({}, 'line', [[(1.1, 1.1), (1.2, 1.2)]])]
+        decoded = decode_tile(tiles.mvt(u'lines', self.tile, features))[3]
+        self.assertEqual(decoded, [])
+
+
+class TilesCacheTest(TestCase):
+
+    def test_tiles_are_invalidated_by_revision(self):
+        cache = TilesCache(size=2)
+        cache.put('a', '1', b'tile')
+        self.assertEqual(cache.get('a', '1'), b'tile')
+        self.assertIsNone(cache.get('a', '2'))
+        cache.put('a', '2', b'a')
+        cache.put('b', '2', b'b')
+        cache.put('c', '2', b'c')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('a', '2'))
+
+
+class TilesViewsTest(BaseWebTest):
+    model_id = 'places'
+
+    def setUp(self):
+        super(TilesViewsTest, self).setUp()
+        definition = {
+            "title": "places",
+            "description": "Places",
+            "fields": [
+                {"name": "name", "type": "string"},
+                {"name": "location", "type": "point"},
+                {"name": "area", "type": "polygon", "required": False}
+            ],
+            "indexes": [["location"]]
+        }
+        records = [{"id": "paris", "name": "Paris",
+                    "location": [2.35, 48.85],
+                    "area": [[[2.2, 48.8], [2.5, 48.8], [2.5, 48.9]]]},
+                   {"id": "bordeaux", "name": "Bordeaux",
+                    "location": [-0.57, 44.84]}]
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition, 'records': records},
+                          headers=self.headers)
+        self.url = '/models/%s/tiles' % self.model_id
+        self.geojson_headers = dict(self.headers,
+                                    Accept='application/geojson')
+
+    def test_vector_tiles_contain_the_records_of_the_tile(self):
+        resp = self.app.get(self.url + '/5/16/11',
+                            headers=dict(self.headers, Accept=MVT))
+        self.assertEqual(resp.content_type, MVT)
+        name, extent, version, features = decode_tile(resp.body)
+        self.assertEqual(name, self.model_id)
+        self.assertEqual([f[0] for f in features],
+                         [{'id': 'paris', 'name': 'Paris'}])
+
+    def test_geojson_tiles_contain_the_records_of_the_tile(self):
+        resp = self.app.get(self.url + '/5/16/11',
+                            headers=self.geojson_headers)
+        [feature] = resp.json['features']
+        self.assertEqual(feature['id'], 'paris')
+        self.assertEqual(feature['properties'], {'name': 'Paris'})
+        lon, lat = feature['geometry']['coordinates']
+        self.assertAlmostEqual(lon, 2.35, places=3)
+        self.assertAlmostEqual(lat, 48.85, places=3)
+
+        resp = self.app.get(self.url + '/0/0/0', headers=self.geojson_headers)
+        self.assertEqual(len(resp.json['features']), 2)
+        resp = self.app.get(self.url + '/5/0/0', headers=self.geojson_headers)
+        self.assertEqual(resp.json['features'], [])
+
+    def test_tiles_are_rendered_again_once_records_change(self):
+        resp = self.app.get(self.url + '/0/0/0', headers=self.geojson_headers)
+        etag = resp.headers['ETag']
+        self.app.get(self.url + '/0/0/0',
+                     headers=dict(self.geojson_headers, **{
+                         'If-None-Match': etag}),
+                     status=304)
+        self.assertEqual(len(self.app.app.registry.tiles_cache), 1)
+
+        self.app.delete('/models/%s/records/bordeaux' % self.model_id,
+                        headers=self.headers)
+        resp = self.app.get(self.url + '/0/0/0',
+                            headers=dict(self.geojson_headers, **{
+                                'If-None-Match': etag}))
+        self.assertEqual(len(resp.json['features']), 1)
+
+    def test_tiles_are_cached_by_application(self):
+        self.app.get(self.url + '/0/0/0', headers=self.geojson_headers)
+        other = webtest.TestApp("config:conf/tests.ini", relative_to='.')
+        self.assertEqual(len(self.app.app.registry.tiles_cache), 1)
+        self.assertEqual(len(other.app.registry.tiles_cache), 0)
+
+    def test_invalid_tiles_are_rejected(self):
+        for path in ('/1/2/0', '/a/0/0', '/25/0/0', '/1/0/-1'):
+            self.app.get(self.url + path, headers=self.geojson_headers,
+                         status=400)
+        self.app.get('/models/unknown/tiles/0/0/0',
+                     headers=self.geojson_headers, status=404)
+
+    def test_models_without_geometry_have_no_tiles(self):
+        definition = {"title": "todo", "description": "Todo",
+                      "fields": [{"name": "item", "type": "string"}]}
+        self.app.put_json('/models/todo', {'definition': definition},
+                          headers=self.headers)
+        self.app.get('/models/todo/tiles/0/0/0',
+                     headers=self.geojson_headers, status=400)
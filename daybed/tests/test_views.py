@@ -2,6 +2,8 @@ import json
 from uuid import uuid4
 import base64
 
+import mock
+
 from pyramid.security import Authenticated
 
 from daybed import __version__ as VERSION
@@ -49,6 +51,28 @@ class DaybedViewsTest(BaseWebTest):
                                     type="boolean",
                                     label="Gps")])
 
+    def test_fields_are_served_with_cache_headers(self):
+        response = self.app.get('/fields')
+        self.assertEqual(response.cache_control.max_age, 3600)
+        etag = response.headers['ETag']
+        response = self.app.get('/fields', headers={'If-None-Match': etag},
+                                status=304)
+        self.assertEqual(response.body, b'')
+
+    def test_fields_are_built_again_if_registry_changes(self):
+        etag = self.app.get('/fields').headers['ETag']
+        registry.register('custom', registry.type('string'))
+        try:
+            response = self.app.get('/fields', headers={'If-None-Match': etag})
+            self.assertIn('custom', [f['name'] for f in response.json])
+        finally:
+            registry.unregister('custom')
+        self.assertEqual(self.app.get('/fields').headers['ETag'], etag)
+
+    def test_fields_are_served_with_jsonp(self):
+        response = self.app.get('/fields?callback=fields')
+        self.assertTrue(response.body.startswith(b'/**/fields('))
+
     def test_unknown_model_data_creation(self):
         resp = self.app.post_json('/models/unknown/records', {},
                                   headers={'Content-Type': 'application/json'},
@@ -56,6 +80,421 @@ class DaybedViewsTest(BaseWebTest):
         self.assertIn('"status": "error"', resp.body.decode('utf-8'))
 
 
+class RecordsPaginationTest(BaseWebTest):
+    model_id = 'paginated'
+
+    def setUp(self):
+        super(RecordsPaginationTest, self).setUp()
+        definition = {
+            "title": "simple",
+            "description": "One optional field",
+            "fields": [{"name": "age", "type": "int", "required": False}]
+        }
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition,
+                           'records': [{'age': i} for i in range(5)]},
+                          headers=self.headers)
+        self.url = '/models/%s/records' % self.model_id
+
+    def test_records_are_not_paginated_by_default(self):
+        resp = self.app.get(self.url, headers=self.headers)
+        self.assertEqual(len(resp.json['data']), 5)
+        self.assertNotIn('Next-Page', resp.headers)
+
+    def test_next_page_is_given_in_headers(self):
+        resp = self.app.get(self.url, {'_limit': 2}, headers=self.headers)
+        self.assertEqual(len(resp.json['data']), 2)
+        self.assertIn('_limit=2', resp.headers['Next-Page'])
+
+    def test_all_records_are_reached_through_pages(self):
+        resp = self.app.get(self.url, {'_limit': 2}, headers=self.headers)
+        records = resp.json['data']
+        while 'Next-Page' in resp.headers:
+            resp = self.app.get(resp.headers['Next-Page'],
+                                headers=self.headers)
+            records.extend(resp.json['data'])
+        self.assertEqual(sorted([r['age'] for r in records]),
+                         list(range(5)))
+
+    def test_last_page_has_no_next_page(self):
+        resp = self.app.get(self.url, {'_limit': 5}, headers=self.headers)
+        self.assertEqual(len(resp.json['data']), 5)
+        self.assertNotIn('Next-Page', resp.headers)
+
+    def test_invalid_limit_is_rejected(self):
+        self.app.get(self.url, {'_limit': 'abc'}, headers=self.headers,
+                     status=400)
+        self.app.get(self.url, {'_limit': 0}, headers=self.headers,
+                     status=400)
+
+    def test_invalid_token_is_rejected(self):
+        self.app.get(self.url, {'_limit': 2, '_token': '!'},
+                     headers=self.headers, status=400)
+
+
+class RecordsFiltersTest(BaseWebTest):
+    model_id = 'filtered'
+
+    def setUp(self):
+        super(RecordsFiltersTest, self).setUp()
+        definition = {
+            "title": "todo",
+            "description": "Filtered records",
+            "fields": [
+                {"name": "item", "type": "string"},
+                {"name": "priority", "type": "range", "min": 1, "max": 5},
+                {"name": "due", "type": "date", "required": False},
+                {"name": "tags", "type": "choices",
+                 "choices": ["home", "work"], "required": False},
+                {"name": "location", "type": "point", "required": False}
+            ]
+        }
+        records = [
+            {"id": "a", "item": "buy milk", "priority": 1,
+             "due": "2014-01-01", "tags": ["home"]},
+            {"id": "b", "item": "buy bread", "priority": 3,
+             "due": "2014-02-01", "tags": ["home", "work"]},
+            {"id": "c", "item": "write report", "priority": 5,
+             "location": [2.35, 48.85]}
+        ]
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition, 'records': records},
+                          headers=self.headers)
+        self.url = '/models/%s/records' % self.model_id
+
+    def assertFiltered(self, params, expected):
+        resp = self.app.get(self.url, params, headers=self.headers)
+        self.assertEqual([r['id'] for r in resp.json['data']], expected)
+
+    def test_records_are_filtered_by_value(self):
+        self.assertFiltered({'priority': '3'}, ['b'])
+        self.assertFiltered({'in_priority': '1,5'}, ['a', 'c'])
+        self.assertFiltered({'item': 'buy milk'}, ['a'])
+
+    def test_records_are_filtered_by_bounds(self):
+        self.assertFiltered({'gt_priority': '1', 'lt_priority': '5'}, ['b'])
+        self.assertFiltered({'gt_due': '2014-01-15'}, ['b'])
+        # Bounds do not have to be in the range of the field.
+        self.assertFiltered({'lt_priority': '10'}, ['a', 'b', 'c'])
+
+    def test_records_are_filtered_by_prefix_and_items(self):
+        self.assertFiltered({'prefix_item': 'buy'}, ['a', 'b'])
+        self.assertFiltered({'contains_tags': 'work'}, ['b'])
+
+    def test_filtered_records_are_paginated(self):
+        resp = self.app.get(self.url, {'prefix_item': 'buy', '_limit': 1},
+                            headers=self.headers)
+        self.assertEqual([r['id'] for r in resp.json['data']], ['a'])
+        resp = self.app.get(resp.headers['Next-Page'], headers=self.headers)
+        self.assertEqual([r['id'] for r in resp.json['data']], ['b'])
+        self.assertNotIn('Next-Page', resp.headers)
+
+    def test_geojson_records_are_filtered(self):
+        resp = self.app.get(self.url, {'priority': '5'},
+                            headers=dict(self.headers,
+                                         Accept='application/geojson'))
+        self.assertEqual(len(resp.json['features']), 1)
+
+    def test_invalid_filters_are_rejected(self):
+        for params in ({'unknown': '1'},
+                       {'priority': 'high'},
+                       {'priority': '10'},
+                       {'contains_tags': 'school'},
+                       {'gt_item': 'a'},
+                       {'location': '[0, 0]'},
+                       {'foo_priority': '1'}):
+            resp = self.app.get(self.url, params, headers=self.headers,
+                                status=400)
+            self.assertEqual(resp.json['errors'][0]['location'],
+                             'querystring')
+
+    def test_records_are_filtered_by_bounding_box(self):
+        self.assertFiltered({'bbox': '2,48,3,49'}, ['c'])
+        self.assertFiltered({'bbox_location': '2,48,3,49'}, ['c'])
+        self.assertFiltered({'bbox': '0,0,1,1'}, [])
+        resp = self.app.get(self.url, {'bbox': '2,48,3,49'},
+                            headers=dict(self.headers,
+                                         Accept='application/geojson'))
+        self.assertEqual(len(resp.json['features']), 1)
+
+    def test_records_are_ordered_by_distance(self):
+        self.app.post_json(self.url, {"item": "call", "priority": 2,
+                                      "location": [2.3, 48.9]},
+                           headers=self.headers)
+        resp = self.app.get(self.url, {'near': '2.35,48.86', '_limit': '1'},
+                            headers=self.headers)
+        self.assertEqual([r['id'] for r in resp.json['data']], ['c'])
+        self.assertNotIn('Next-Page', resp.headers)
+        resp = self.app.get(self.url, {'near_location': '2.3,48.91',
+                                       'gt_priority': '1'},
+                            headers=self.headers)
+        self.assertEqual([r['item'] for r in resp.json['data']],
+                         ['call', 'write report'])
+
+    def test_invalid_locations_are_rejected(self):
+        for params in ({'bbox': '1,2,3'},
+                       {'bbox': '3,0,1,1'},
+                       {'bbox': 'a,b,c,d'},
+                       {'near': '1,2', '_token': 'YQ=='},
+                       {'near': '1,2', 'near_location': '1,2'},
+                       {'near_item': '1,2'}):
+            resp = self.app.get(self.url, params, headers=self.headers,
+                                status=400)
+            self.assertEqual(resp.json['errors'][0]['location'],
+                             'querystring')
+
+    def test_indexed_records_are_filtered(self):
+        definition = self.app.get('/models/%s/definition' % self.model_id,
+                                  headers=self.headers).json
+        definition['indexes'] = [['priority'], ['item', 'priority'],
+                                 ['location']]
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition}, headers=self.headers)
+        self.assertFiltered({'gt_priority': '1'}, ['b', 'c'])
+        self.assertFiltered({'prefix_item': 'buy'}, ['a', 'b'])
+        self.assertFiltered({'bbox': '2,48,3,49'}, ['c'])
+
+    def test_records_are_sorted(self):
+        self.assertFiltered({'_sort': '-priority'}, ['c', 'b', 'a'])
+        self.assertFiltered({'_sort': 'due'}, ['c', 'a', 'b'])
+        self.assertFiltered({'_sort': '-due', 'prefix_item': 'buy'},
+                            ['b', 'a'])
+
+    def test_sorted_records_are_paginated(self):
+        resp = self.app.get(self.url, {'_sort': '-priority', '_limit': 2},
+                            headers=self.headers)
+        self.assertEqual([r['id'] for r in resp.json['data']], ['c', 'b'])
+        resp = self.app.get(resp.headers['Next-Page'], headers=self.headers)
+        self.assertEqual([r['id'] for r in resp.json['data']], ['a'])
+        self.assertNotIn('Next-Page', resp.headers)
+
+    def test_indexed_records_are_sorted(self):
+        definition = self.app.get('/models/%s/definition' % self.model_id,
+                                  headers=self.headers).json
+        definition['indexes'] = [['priority']]
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition}, headers=self.headers)
+        self.assertFiltered({'_sort': '-priority'}, ['c', 'b', 'a'])
+        self.assertFiltered({'_sort': 'priority', 'prefix_item': 'buy'},
+                            ['a', 'b'])
+
+    def test_records_fields_are_selected(self):
+        resp = self.app.get(self.url, {'_fields': 'item', '_sort': 'item'},
+                            headers=self.headers)
+        self.assertEqual(resp.json['data'], [
+            {'id': 'b', 'item': 'buy bread'},
+            {'id': 'a', 'item': 'buy milk'},
+            {'id': 'c', 'item': 'write report'}])
+        resp = self.app.get(self.url, {'_fields': 'priority,tags',
+                                       '_limit': 1}, headers=self.headers)
+        self.assertEqual(resp.json['data'],
+                         [{'id': 'a', 'priority': 1, 'tags': ['home']}])
+        resp = self.app.get(self.url, {'_fields': 'priority',
+                                       'near': '2.35,48.86'},
+                            headers=self.headers)
+        self.assertEqual(resp.json['data'], [{'id': 'c', 'priority': 5}])
+
+    def test_geojson_records_fields_are_selected(self):
+        headers = dict(self.headers, Accept='application/geojson')
+        resp = self.app.get(self.url, {'_fields': 'item', 'priority': '5'},
+                            headers=headers)
+        [feature] = resp.json['features']
+        self.assertIsNone(feature['geometry'])
+        self.assertEqual(feature['properties'], {'item': 'write report'})
+
+    def test_invalid_sorts_and_fields_are_rejected(self):
+        for params in ({'_sort': 'unknown'},
+                       {'_sort': 'tags'},
+                       {'_sort': '-location'},
+                       {'_sort': 'priority', '_token': 'YQ=='},
+                       {'_sort': 'priority', 'near': '1,2'},
+                       {'_fields': 'item,unknown'}):
+            resp = self.app.get(self.url, params, headers=self.headers,
+                                status=400)
+            self.assertEqual(resp.json['errors'][0]['location'],
+                             'querystring')
+
+    def test_fields_which_cannot_be_indexed_are_rejected(self):
+        definition = self.app.get('/models/%s/definition' % self.model_id,
+                                  headers=self.headers).json
+        for indexes in ([['unknown']], [['tags']], [[]],
+                        [['location', 'priority']]):
+            definition['indexes'] = indexes
+            resp = self.app.put_json('/models/%s' % self.model_id,
+                                     {'definition': definition},
+                                     headers=self.headers, status=400)
+            self.assertIn('indexes', resp.json['errors'][0]['name'])
+
+
+class ConditionalRequestsTest(BaseWebTest):
+    model_id = 'conditional'
+
+    def setUp(self):
+        super(ConditionalRequestsTest, self).setUp()
+        definition = {
+            "title": "simple",
+            "description": "One optional field",
+            "fields": [{"name": "age", "type": "int", "required": False}]
+        }
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition,
+                           'records': [{'id': 'a', 'age': 1}]},
+                          headers=self.headers)
+        self.urls = ['/models/%s' % self.model_id,
+                     '/models/%s/definition' % self.model_id,
+                     '/models/%s/records' % self.model_id,
+                     '/models/%s/records/a' % self.model_id]
+
+    def get(self, url, etag=None, status=200, **params):
+        headers = dict(self.headers)
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        return self.app.get(url, params, headers=headers, status=status)
+
+    def test_responses_have_an_etag(self):
+        for url in self.urls:
+            response = self.get(url)
+            self.assertIn('ETag', response.headers)
+            self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
+    def test_not_modified_is_returned_if_etag_matches(self):
+        for url in self.urls:
+            etag = self.get(url).headers['ETag']
+            response = self.get(url, etag, status=304)
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertEqual(response.body, b'')
+
+    def test_records_are_not_read_if_etag_matches(self):
+        url = '/models/%s/records' % self.model_id
+        etag = self.get(url).headers['ETag']
+        with mock.patch.object(self.backend.db().__class__,
+                               'iter_records') as iter_records:
+            self.get(url, etag, status=304)
+        self.assertFalse(iter_records.called)
+
+    def test_etag_changes_when_records_are_modified(self):
+        etags = [self.get(url).headers['ETag'] for url in self.urls]
+        self.app.put_json('/models/%s/records/a' % self.model_id,
+                          {'age': 2}, headers=self.headers)
+        for url, etag in zip(self.urls, etags):
+            self.assertEqual(self.get(url, etag).status_int, 200)
+
+    def test_etag_depends_on_the_query_string(self):
+        url = '/models/%s/records' % self.model_id
+        etag = self.get(url, _limit=1).headers['ETag']
+        self.assertNotEqual(self.get(url).headers['ETag'], etag)
+        self.get(url, etag, status=200)
+        self.get(url, etag, status=304, _limit=1)
+
+    def test_unknown_record_is_not_found(self):
+        self.get('/models/%s/records/b' % self.model_id, '"abc"',
+                 status=404)
+
+
+class BulkRecordsTest(BaseWebTest):
+    model_id = 'bulk'
+
+    def setUp(self):
+        super(BulkRecordsTest, self).setUp()
+        definition = {
+            "title": "simple",
+            "description": "One optional field",
+            "fields": [{"name": "age", "type": "int", "required": False}]
+        }
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition},
+                          headers=self.headers)
+        self.url = '/models/%s/records' % self.model_id
+
+    def test_records_are_created_in_bulk(self):
+        resp = self.app.post_json(self.url, [{'age': 1}, {'age': 2}],
+                                  headers=self.headers)
+        statuses = resp.json['data']
+        self.assertEqual([s['status'] for s in statuses], ['ok', 'ok'])
+        record = self.db.get_record(self.model_id, statuses[1]['id'])
+        self.assertEqual(record, {'age': 2})
+
+    def test_invalid_records_are_reported_and_not_created(self):
+        resp = self.app.post_json(self.url, [{'age': 'a'}, {'age': 2}, 3],
+                                  headers=self.headers)
+        statuses = resp.json['data']
+        self.assertEqual([s['status'] for s in statuses],
+                         ['error', 'ok', 'error'])
+        self.assertEqual(statuses[0]['errors'][0]['name'], 'age')
+        self.assertNotIn('id', statuses[0])
+        self.assertEqual(len(self.db.get_records(self.model_id)), 1)
+
+    def test_records_are_only_validated_if_asked(self):
+        headers = self.headers.copy()
+        headers['X-Daybed-Validate-Only'] = 'true'
+        resp = self.app.post_json(self.url, [{'age': 1}, {'age': 'a'}],
+                                  headers=headers)
+        statuses = resp.json['data']
+        self.assertEqual([s['status'] for s in statuses], ['ok', 'error'])
+        self.assertEqual(len(self.db.get_records(self.model_id)), 0)
+
+
+class PutModelTest(BaseWebTest):
+    model_id = 'incremental'
+    definition = {
+        "title": "simple",
+        "description": "One optional field",
+        "fields": [{"name": "age", "type": "int", "required": False}]
+    }
+
+    def setUp(self):
+        super(PutModelTest, self).setUp()
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': self.definition,
+                           'records': [{'age': 1}, {'age': 2}]},
+                          headers=self.headers)
+        self.records = self.db.get_records(self.model_id)
+
+    def test_records_are_kept_if_not_specified(self):
+        definition = dict(self.definition, title='renamed')
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': definition},
+                          headers=self.headers)
+        self.assertEqual(self.db.get_model_definition(self.model_id),
+                         definition)
+        self.assertEqual(self.db.get_records(self.model_id), self.records)
+
+    def test_records_are_replaced_if_specified(self):
+        kept = self.records[0]
+        records = [{'id': kept['id'], 'age': 10}, {'age': 3}]
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': self.definition,
+                           'records': records},
+                          headers=self.headers)
+        records = self.db.get_records(self.model_id)
+        self.assertEqual(len(records), 2)
+        self.assertIn({'id': kept['id'], 'age': 10}, records)
+        self.assertNotIn(self.records[1], records)
+
+    def test_records_are_deleted_if_empty(self):
+        self.app.put_json('/models/%s' % self.model_id,
+                          {'definition': self.definition, 'records': []},
+                          headers=self.headers)
+        self.assertEqual(self.db.get_records(self.model_id), [])
+
+
+class LazyDatabaseTest(BaseWebTest):
+
+    def test_metadata_endpoints_do_not_build_a_database(self):
+        with mock.patch.object(self.backend, 'db') as db:
+            self.app.get('/', headers=self.headers)
+            self.app.get('/fields', headers=self.headers)
+            self.app.get('/spore', headers=self.headers)
+        self.assertFalse(db.called)
+
+    def test_database_is_built_once_per_request(self):
+        with mock.patch.object(self.backend, 'db',
+                               wraps=self.backend.db) as db:
+            self.app.get('/models/unknown/definition', headers=self.headers,
+                         status=404)
+        self.assertEqual(db.call_count, 1)
+
+
 class BasicAuthRegistrationTest(BaseWebTest):
     model_id = 'simple'
 
@@ -163,3 +602,10 @@ class SporeTest(BaseWebTest):
         resp = self.app.get('/spore',
                             headers=self.headers, status=200)
         self.assertEqual(resp.json['name'], 'daybed')
+
+    def test_spore_is_served_with_cache_headers(self):
+        etag = self.app.get('/spore').headers['ETag']
+        self.app.get('/spore', headers={'If-None-Match': etag}, status=304)
+        response = self.app.get('/spore', headers={'If-None-Match': etag},
+                                extra_environ={'HTTP_HOST': 'daybed.io'})
+        self.assertEqual(response.json['base_url'], 'http://daybed.io')
@@ -0,0 +1,432 @@
+"""Map tiles of the records of models with geometries, in the Web Mercator
+tiling scheme (``z/x/y``), as Mapbox vector tiles (MVT) or GeoJSON.
+
+Geometries are projected in the coordinates of the tile, clipped to it
+(with a buffer), and simplified to its resolution: a tile is about the same
+size at every zoom level.
+"""
+import json
+import math
+import struct
+
+import six
+
+from daybed.backends.spatial import GEOMETRY_TYPES
+
+
+#: Size of tiles, in tile coordinates units.
+EXTENT = 4096
+
+#: Margin kept around tiles when clipping geometries, in tile units.
+BUFFER = 64
+
+#: Distance under which positions are merged, in tile units (one pixel of a
+#: 256 pixels tile).
+TOLERANCE = EXTENT / 256.0
+
+MAX_ZOOM = 24
+
+#: Latitudes of the Web Mercator projection.
+MAX_LATITUDE = 85.0511287798
+
+
+class Tile(object):
+    """Tile of the specified zoom level and coordinates, projecting WGS84
+    positions into tile units (``y`` axis pointing down).
+    """
+    def __init__(self, z, x, y, extent=EXTENT, buffer=BUFFER):
+        self.z, self.x, self.y = z, x, y
+        self.extent = extent
+        self.buffer = buffer
+
+    def project(self, position):
+        n = 2 ** self.z
+        lon, lat = position[0], position[1]
+        lat = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat)))
+        px = (lon + 180.0) / 360.0 * n
+        py = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2
+        py *= n
+        return (px - self.x) * self.extent, (py - self.y) * self.extent
+
+    def unproject(self, point):
+        n = 2 ** self.z
+        px = point[0] / float(self.extent) + self.x
+        py = point[1] / float(self.extent) + self.y
+        lon = px / n * 360.0 - 180.0
+        lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * py / n))))
+        return [lon, lat]
+
+    @property
+    def bounds(self):
+        """Bounding box of the tile and its buffer, in WGS84."""
+        low = -self.buffer
+        high = self.extent + self.buffer
+        minx, maxy = self.unproject((low, low))
+        maxx, miny = self.unproject((high, high))
+        return minx, miny, maxx, maxy
+
+
+def shapes(fieldtype, value):
+    """Returns the ``(kind, parts)`` shapes of a geometry field value:
+    ``point`` with a list of positions, ``line`` with a list of lines, or
+    ``polygon`` with a list of polygons (lists of rings).
+    """
+    if fieldtype == 'point':
+        return [('point', [value])]
+    if fieldtype == 'line':
+        return [('line', [value])]
+    if fieldtype == 'polygon':
+        return [('polygon', [value])]
+
+    geometry_type = value.get('type')
+    if geometry_type == 'GeometryCollection':
+        result = []
+        for member in value.get('geometries', []):
+            result.extend(shapes('geojson', member))
+        return result
+    coordinates = value.get('coordinates')
+    multiple = geometry_type.startswith('Multi')
+    kind = {'Point': 'point', 'LineString': 'line',
+            'Polygon': 'polygon'}[geometry_type.replace('Multi', '')]
+    return [(kind, coordinates if multiple else [coordinates])]
+
+
+def simplify(points, tolerance):
+    """Simplifies a line with the Douglas-Peucker algorithm, keeping its
+    ends.
+    """
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        farthest, index = 0, None
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if length:
+                distance = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / length
+            else:
+                distance = math.hypot(x - x1, y - y1)
+            if distance > farthest:
+                farthest, index = distance, i
+        if index is not None and farthest > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def clip_line(points, low, high):
+    """Returns the parts of a line inside the square ``[low, high]``."""
+    parts = []
+    current = []
+    for start, end in zip(points, points[1:]):
+        segment = _clip_segment(start, end, low, high)
+        if segment is None:
+            if len(current) > 1:
+                parts.append(current)
+            current = []
+            continue
+        a, b = segment
+        if not current or current[-1] != a:
+            if len(current) > 1:
+                parts.append(current)
+            current = [a]
+        current.append(b)
+    if len(current) > 1:
+        parts.append(current)
+    return parts
+
+
+def _clip_segment(start, end, low, high):
+    """Clips a segment to a square (Liang-Barsky), ``None`` if outside."""
+    (x1, y1), (x2, y2) = start, end
+    dx, dy = x2 - x1, y2 - y1
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, x1 - low), (dx, high - x1),
+                 (-dy, y1 - low), (dy, high - y1)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / float(p)
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return None
+    a = (x1 + t0 * dx, y1 + t0 * dy) if t0 > 0 else (x1, y1)
+    b = (x1 + t1 * dx, y1 + t1 * dy) if t1 < 1 else (x2, y2)
+    return a, b
+
+
+def clip_ring(points, low, high):
+    """Clips a closed ring to the square ``[low, high]``
+    (Sutherland-Hodgman), returning a closed ring, possibly empty.
+    """
+    ring = list(points[:-1]) if points[0] == points[-1] else list(points)
+    for axis, bound, inside in ((0, low, lambda v: v >= low),
+                                (0, high, lambda v: v <= high),
+                                (1, low, lambda v: v >= low),
+                                (1, high, lambda v: v <= high)):
+        if not ring:
+            break
+        clipped = []
+        previous = ring[-1]
+        for point in ring:
+            if inside(point[axis]):
+                if not inside(previous[axis]):
+                    clipped.append(_intersection(previous, point, axis,
+                                                 bound))
+                clipped.append(point)
+            elif inside(previous[axis]):
+                clipped.append(_intersection(previous, point, axis, bound))
+            previous = point
+        ring = clipped
+    if ring:
+        ring.append(ring[0])
+    return ring
+
+
+def _intersection(a, b, axis, bound):
+    t = (bound - a[axis]) / float(b[axis] - a[axis])
+    other = 1 - axis
+    point = [0, 0]
+    point[axis] = bound
+    point[other] = a[other] + t * (b[other] - a[other])
+    return tuple(point)
+
+
+def tile_shapes(tile, kind, parts):
+    """Returns the parts of a shape projected, clipped and simplified in
+    the tile coordinates, or an empty list if nothing is left.
+    """
+    low, high = -tile.buffer, tile.extent + tile.buffer
+    if kind == 'point':
+        points = [tile.project(position) for position in parts]
+        return [point for point in points
+                if low <= point[0] <= high and low <= point[1] <= high]
+
+    if kind == 'line':
+        lines = []
+        for line in parts:
+            projected = [tile.project(position) for position in line]
+            for part in clip_line(projected, low, high):
+                part = simplify(part, TOLERANCE)
+                if len(part) > 1:
+                    lines.append(part)
+        return lines
+
+    polygons = []
+    for polygon in parts:
+        rings = []
+        for ring in polygon:
+            projected = [tile.project(position) for position in ring]
+            ring = simplify(clip_ring(projected, low, high), TOLERANCE)
+            if len(ring) >= 4:
+                rings.append(ring)
+            elif not rings:
+                # The exterior ring vanished, and its holes with it.
+                break
+        if rings:
+            polygons.append(rings)
+    return polygons
+
+
+def geometry_field(definition):
+    """Returns the first geometry field of a model definition, the one
+    rendered in tiles, or ``None``.
+    """
+    for field in definition['fields']:
+        if field['type'] in GEOMETRY_TYPES:
+            return field
+    return None
+
+
+def tile_features(tile, definition, records):
+    """Returns the ``(record, kind, parts)`` features of the records in the
+    tile, from the first geometry field of the definition.
+
+    Records are left without their geometries.
+    """
+    geometries = [field['name'] for field in definition['fields']
+                  if field['type'] in GEOMETRY_TYPES]
+    field = geometry_field(definition)
+    features = []
+    for record in records:
+        value = record.get(field['name'])
+        for name in geometries:
+            record.pop(name, None)
+        if value is None:
+            continue
+        for kind, parts in shapes(field['type'], value):
+            parts = tile_shapes(tile, kind, parts)
+            if parts:
+                features.append((record, kind, parts))
+    return features
+
+
+def geojson(tile, features):
+    """Returns the GeoJSON feature collection of the tile features, with
+    WGS84 coordinates.
+    """
+    types = {'point': 'Point', 'line': 'LineString', 'polygon': 'Polygon'}
+
+    def unproject(parts, depth):
+        if depth == 0:
+            return tile.unproject(parts)
+        return [unproject(part, depth - 1) for part in parts]
+
+    collection = []
+    for record, kind, parts in features:
+        depth = {'point': 1, 'line': 2, 'polygon': 3}[kind]
+        coordinates = unproject(parts, depth)
+        geometry_type = types[kind]
+        if len(coordinates) == 1:
+            coordinates = coordinates[0]
+        else:
+            geometry_type = 'Multi' + geometry_type
+        properties = dict(record)
+        collection.append({'type': 'Feature',
+                           'id': properties.pop('id', None),
+                           'geometry': {'type': geometry_type,
+                                        'coordinates': coordinates},
+                           'properties': properties})
+    return {'type': 'FeatureCollection', 'features': collection}
+
+
+def _varint(value):
+    result = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return result
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, wire_type):
+    return _varint(number << 3 | wire_type)
+
+
+def _message(number, data):
+    return _field(number, 2) + _varint(len(data)) + data
+
+
+def _packed(number, values):
+    data = bytearray()
+    for value in values:
+        data += _varint(value)
+    return _message(number, data)
+
+
+def _value(value):
+    """Encodes a property value of a vector tile layer."""
+    if isinstance(value, bool):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, six.integer_types):
+        return _field(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + bytearray(struct.pack('<d', value))
+    if not isinstance(value, six.string_types):
+        value = json.dumps(value, sort_keys=True)
+    return _message(1, bytearray(value.encode('utf-8')))
+
+
+def _commands(kind, parts):
+    """Encodes geometry parts in vector tiles commands, with integer
+    coordinates. Returns ``None`` if nothing is left once rounded.
+    """
+    commands = []
+    cursor = [0, 0]
+
+    def move(points, command):
+        commands.append(command | len(points) << 3)
+        for x, y in points:
+            commands.append(_zigzag(x - cursor[0]))
+            commands.append(_zigzag(y - cursor[1]))
+            cursor[:] = [x, y]
+
+    def rounded(points):
+        result = []
+        for x, y in points:
+            point = (int(round(x)), int(round(y)))
+            if not result or result[-1] != point:
+                result.append(point)
+        return result
+
+    if kind == 'point':
+        move(rounded(parts), 1)
+        return commands
+
+    for part in parts:
+        rings = part if kind == 'polygon' else [part]
+        for i, ring in enumerate(rings):
+            points = rounded(ring)
+            if kind == 'line':
+                if len(points) < 2:
+                    continue
+                move(points[:1], 1)
+                move(points[1:], 2)
+                continue
+            points = points[:-1]
+            area = _area(points)
+            if len(points) < 3 or area == 0:
+                if i == 0:
+                    break
+                continue
+            # Exterior rings are clockwise, holes counter-clockwise.
+            if (area < 0) == (i == 0):
+                points.reverse()
+            move(points[:1], 1)
+            move(points[1:], 2)
+            commands.append(7 | 1 << 3)
+    return commands or None
+
+
+def _area(points):
+    return sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2)
+               in zip(points, points[1:] + points[:1]))
+
+
+def mvt(name, tile, features):
+    """Encodes the tile features as a vector tile of a single layer."""
+    types = {'point': 1, 'line': 2, 'polygon': 3}
+    keys, values = {}, {}
+    layer = bytearray()
+    for record, kind, parts in features:
+        commands = _commands(kind, parts)
+        if commands is None:
+            continue
+        tags = []
+        for key, value in sorted(record.items()):
+            if value is None:
+                continue
+            encoded = bytes(_value(value))
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(encoded, len(values)))
+        feature = _packed(2, tags)
+        feature += _field(3, 0) + _varint(types[kind])
+        feature += _packed(4, commands)
+        layer += _message(2, feature)
+
+    header = _field(15, 0) + _varint(2)
+    header += _message(1, bytearray(name.encode('utf-8')))
+    for key, _ in sorted(keys.items(), key=lambda item: item[1]):
+        layer += _message(3, bytearray(key.encode('utf-8')))
+    for value, _ in sorted(values.items(), key=lambda item: item[1]):
+        layer += _message(4, bytearray(value))
+    layer += _field(5, 0) + _varint(tile.extent)
+    return bytes(_message(3, header + layer))
@@ -0,0 +1,122 @@
+import hashlib
+import threading
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.renderers import render
+from pyramid.response import Response
+
+
+def revision_etag(revision, query_string, accept):
+    """Returns the ``ETag`` of a response from the specified backend
+    revision, the query string and the ``Accept`` header of the request.
+    """
+    key = u'\n'.join((revision, query_string, accept))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def not_modified(request, revision):
+    """Sets the ``ETag`` of the response from the specified backend
+    revision (see :func:`revision_etag`).
+
+    Returns a ``304 Not Modified`` response if the ``If-None-Match`` header
+    of the request matches it, ``None`` otherwise: it has to be called
+    before the response is built.
+    """
+    etag = revision_etag(revision, request.query_string,
+                         request.headers.get('Accept', u''))
+    if etag in request.if_none_match:
+        return HTTPNotModified(headers={'ETag': '"%s"' % etag,
+                                        'Cache-Control': 'no-cache'})
+    request.response.etag = etag
+    request.response.cache_control = 'no-cache'
+
+
+class ResponsesCache(object):
+    """Cache of JSON responses which do not change once the application
+    is started (e.g. the fields list), served with a strong ``ETag`` and a
+    ``Cache-Control`` header. Requests with a matching ``If-None-Match``
+    header get a ``304 Not Modified``.
+
+    :param build: function returning the value to render for a request.
+    :param size: maximum number of cached responses (e.g. one per host).
+    """
+    def __init__(self, build, size=16):
+        self.build = build
+        self.size = size
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._responses.clear()
+
+    def response(self, request, key):
+        """Returns the response of the request, rendered once by ``key``.
+
+        JSONP requests are rendered as usual.
+        """
+        if 'callback' in request.GET:
+            return self.build(request)
+
+        cached = self._responses.get(key)
+        if cached is None:
+            body = render('json', self.build(request)).encode('utf-8')
+            cached = (body, hashlib.sha1(body).hexdigest())
+            with self._lock:
+                if len(self._responses) >= self.size:
+                    self._responses.clear()
+                self._responses[key] = cached
+
+        body, etag = cached
+        max_age = int(request.registry.settings.get('daybed.cache_max_age',
+                                                    3600))
+        response = Response(body=body, content_type='application/json',
+                            conditional_response=True)
+        response.etag = etag
+        response.cache_control = 'public, max-age=%d' % max_age
+        return response
+
+
+class TilesCache(object):
+    """LRU cache of rendered map tiles, shared by all the requests of an
+    application.
+
+    Tiles are stored along with the revision of their model, so that they
+    are rendered again once its records are modified.
+
+    :param size: maximum number of cached tiles.
+    """
+    def __init__(self, size=512):
+        self.size = size
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, key, revision):
+        """Returns the cached tile of the specified key and revision, or
+        ``None``.
+        """
+        with self._lock:
+            cached = self._tiles.pop(key, None)
+            if cached is None or cached[0] != revision:
+                return None
+            # Mark as most recently used.
+            self._tiles[key] = cached
+            return cached[1]
+
+    def put(self, key, revision, tile):
+        with self._lock:
+            self._tiles.pop(key, None)
+            self._tiles[key] = (revision, tile)
+            while len(self._tiles) > self.size:
+                self._tiles.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
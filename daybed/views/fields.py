@@ -2,6 +2,7 @@ from cornice import Service
 from colander import required, drop
 
 from daybed.schemas import registry
+from daybed.views.cache import ResponsesCache
 
 
 fields = Service(name='fields',
@@ -12,6 +13,14 @@ fields = Service(name='fields',
 
 @fields.get()
 def list_fields(request):
+    """Lists the field types and their parameters.
+
+    The list is built once, until a field type is (un)registered.
+    """
+    return cache.response(request, registry.version)
+
+
+def build_fields(request):
     common_params = ['name', 'type', 'label', 'hint', 'required']
     fields = []
     # Iterate registered field types
@@ -37,3 +46,6 @@ def list_fields(request):
                 field.setdefault('parameters', []).append(extras)
         fields.append(field)
     return fields
+
+
+cache = ResponsesCache(build_fields)
@@ -3,6 +3,7 @@ from pyramid.security import Everyone
 
 from daybed.backends.exceptions import ModelNotFound
 from daybed.schemas.validators import model_validator
+from daybed.views.cache import not_modified
 
 
 models = Service(name='models', path='/models', description='Models',
@@ -28,6 +29,10 @@ def get_definition(request):
     """Retrieves a model definition."""
     model_id = request.matchdict['model_id']
     try:
+        response = not_modified(request,
+                                request.db.get_model_revision(model_id))
+        if response is not None:
+            return response
         return request.db.get_model_definition(model_id)
     except ModelNotFound:
         request.response.status = "404 Not Found"
@@ -47,8 +52,8 @@ def post_models(request):
     else:
         username = Everyone
 
-    for record in request.validated['records']:
-        request.db.put_record(model_id, record, [username])
+    request.db.put_records(model_id, request.validated['records'] or [],
+                           [username])
 
     request.response.status = "201 Created"
     location = '%s/models/%s' % (request.application_url, model_id)
@@ -65,6 +70,7 @@ def delete_model(request):
     except ModelNotFound:
         request.response.status = "404 Not Found"
         return {"msg": "%s: model not found" % model_id}
+    request.registry.record_validators.invalidate(model_id)
     return model
 
 
@@ -73,6 +79,10 @@ def get_model(request):
     """Retrieves the full model, definition and records."""
     model_id = request.matchdict['model_id']
     try:
+        response = not_modified(request,
+                                request.db.get_model_revision(model_id))
+        if response is not None:
+            return response
         definition = request.db.get_model_definition(model_id),
     except ModelNotFound:
         request.response.status = "404 Not Found"
@@ -86,13 +96,12 @@ def get_model(request):
 
 @model.put(validators=(model_validator,), permission='put_model')
 def put_model(request):
-    model_id = request.matchdict['model_id']
+    """Creates or updates a model.
 
-    # DELETE ALL THE THINGS.
-    try:
-        request.db.delete_model(model_id)
-    except ModelNotFound:
-        pass
+    Records are only replaced if specified, existing ones being matched by
+    their ``id``.
+    """
+    model_id = request.matchdict['model_id']
 
     if request.user:
         username = request.user['name']
@@ -103,8 +112,10 @@ def put_model(request):
                          request.validated['roles'],
                          request.validated['policy_id'],
                          model_id)
+    request.registry.record_validators.invalidate(model_id)
 
-    for record in request.validated['records']:
-        request.db.put_record(model_id, record, [username])
+    records = request.validated['records']
+    if records is not None:
+        request.db.replace_records(model_id, records, [username])
 
     return {"id": model_id}
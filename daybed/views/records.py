@@ -1,11 +1,17 @@
 import json
 
+import six
 from cornice import Service
 from pyramid.security import Everyone
 
 from daybed.backends.exceptions import RecordNotFound
-from daybed.schemas.validators import (RecordValidator, record_validator,
-                                       validate_against_schema)
+from daybed.backends.sorting import project
+from daybed.schemas.validators import (record_validator, records_validator,
+                                       validate_against_schema,
+                                       pagination_validator, filters_validator,
+                                       sort_validator, projection_validator,
+                                       encode_token)
+from daybed.views.cache import not_modified
 
 
 records = Service(name='records',
@@ -20,30 +26,84 @@ record = Service(name='record',
                  renderer="jsonp")
 
 
-@records.get(permission='get_records')
+records_validators = (pagination_validator, filters_validator,
+                      sort_validator, projection_validator)
+
+
+@records.get(permission='get_records', validators=records_validators)
 @records.get(accept='application/geojson', renderer='geojson',
-             permission='get_records')
+             permission='get_records', validators=records_validators)
 def get_records(request):
-    """Retrieves all model records."""
+    """Retrieves model records, matching the querystring filters if any.
+
+    Records are ordered by id, or sorted by the ``_sort`` fields, and only
+    the ``_fields`` ones are returned if specified. If ``_limit`` is
+    specified, records are paginated and the URL of the next page is given
+    in the ``Next-Page`` response header. Records near a point are ordered
+    by distance, ``_limit`` being the number of nearest records.
+    """
     model_id = request.matchdict['model_id']
     # Check that model is defined
     exists = request.db.get_model_definition(model_id)
     if not exists:
         request.response.status = "404 Not Found"
         return {"msg": "%s: model not found" % model_id}
-    # Return array of records
-    results = request.db.get_records(model_id)
+
+    response = not_modified(request, request.db.get_model_revision(model_id))
+    if response is not None:
+        return response
+
+    limit = request.validated['limit']
+    filters = request.validated['filters']
+    near = request.validated['near']
+    sort = request.validated['sort']
+    fields = request.validated['fields']
+    if near is not None:
+        field, point = near
+        results = request.db.get_nearest_records(
+            model_id, field, point, limit=limit, filters=filters)
+        return {'data': [project(record, fields) for record in results]}
+
+    # Fetch one more record to know if there is a next page.
+    if sort:
+        results = request.db.get_sorted_records(
+            model_id, sort, limit=None if limit is None else limit + 1,
+            offset=request.validated['offset'], filters=filters,
+            fields=fields)
+    elif limit is None:
+        # Records are streamed by the renderer.
+        return {'data': request.db.iter_records(model_id, filters=filters,
+                                                fields=fields)}
+    else:
+        results = request.db.get_records(model_id, limit=limit + 1,
+                                         start=request.validated['start'],
+                                         filters=filters, fields=fields)
+
+    if limit is not None and len(results) > limit:
+        results = results[:limit]
+        if sort:
+            start = six.text_type(request.validated['offset'] + limit)
+        else:
+            start = results[-1]['id']
+        params = request.GET.copy()
+        params['_token'] = encode_token(start)
+        next_page = '%s?%s' % (request.path_url,
+                               six.moves.urllib.parse.urlencode(params))
+        request.response.headers['Next-Page'] = str(next_page)
     return {'data': results}
 
 
-@records.post(validators=record_validator, permission='post_record')
+@records.post(validators=records_validator, permission='post_record')
 def post_record(request):
-    """Saves a single model record.
+    """Saves a single model record, or a list of records.
 
     Posted record attributes will be matched against the related model
     definition.
 
     """
+    if 'records' in request.validated:
+        return post_records(request)
+
     # if we are asked only for validation, don't do anything more.
     if request.headers.get('X-Daybed-Validate-Only', 'false') == 'true':
         return
@@ -62,6 +122,42 @@ def post_record(request):
     return {'id': record_id}
 
 
+def post_records(request):
+    """Saves the valid records of a list in one batch.
+
+    Returns the status of each posted record, i.e. its id if it was created
+    or its validation errors.
+    """
+    records = request.validated['records']
+    valid = [record for record, errors in records if not errors]
+
+    # if we are asked only for validation, don't store anything.
+    if request.headers.get('X-Daybed-Validate-Only', 'false') == 'true':
+        created = None
+    else:
+        model_id = request.matchdict['model_id']
+        if request.user:
+            username = request.user['name']
+        else:
+            username = Everyone
+        created = iter(request.db.put_records(model_id, valid, [username]))
+
+    results = []
+    for record, errors in records:
+        if not errors and created is not None:
+            record_id = next(created)
+            if record_id is None:
+                errors = [dict(location='body', name='body',
+                               description='Record could not be saved')]
+        if errors:
+            results.append({'status': 'error', 'errors': errors})
+        elif created is None:
+            results.append({'status': 'ok'})
+        else:
+            results.append({'status': 'ok', 'id': record_id})
+    return {'data': results}
+
+
 @records.delete(permission='delete_records')
 def delete_records(request):
     """Deletes all records of model."""
@@ -76,6 +172,10 @@ def get(request):
     model_id = request.matchdict['model_id']
     record_id = request.matchdict['record_id']
     try:
+        revision = request.db.get_record_revision(model_id, record_id)
+        response = not_modified(request, revision)
+        if response is not None:
+            return response
         return request.db.get_record(model_id, record_id)
     except RecordNotFound:
         request.response.status = "404 Not Found"
@@ -110,14 +210,15 @@ def patch(request):
         username = Everyone
 
     try:
-        data = request.db.get_record(model_id, record_id)
+        data = request.db.get_record(model_id, record_id).copy()
     except RecordNotFound:
         request.response.status = "404 Not Found"
         return {"msg": "%s: record not found %s" % (model_id, record_id)}
 
     data.update(json.loads(request.body.decode('utf-8')))
     definition = request.db.get_model_definition(model_id)
-    validate_against_schema(request, RecordValidator(definition), data)
+    schema = request.registry.record_validators.get(model_id, definition)
+    validate_against_schema(request, schema, data)
     if not request.errors:
         request.db.put_record(model_id, data, [username], record_id)
     return {'id': record_id}
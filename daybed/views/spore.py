@@ -3,6 +3,7 @@ from cornice.ext.spore import generate_spore_description
 from cornice.service import get_services
 
 from daybed import __version__ as VERSION
+from daybed.views.cache import ResponsesCache
 
 
 spore = Service(name="spore",
@@ -13,5 +14,14 @@ spore = Service(name="spore",
 
 @spore.get()
 def get_spore(request):
+    """Returns the SPORE description of the API, built once by URL."""
+    return cache.response(request, (request.application_url,
+                                    len(get_services())))
+
+
+def build_spore(request):
     return generate_spore_description(get_services(), 'daybed',
                                       request.application_url, VERSION)
+
+
+cache = ResponsesCache(build_spore)
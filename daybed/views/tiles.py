@@ -0,0 +1,73 @@
+import json
+
+from cornice import Service
+
+from daybed.schemas.validators import tile_validator
+from daybed.tiles import Tile, geojson, geometry_field, mvt, tile_features
+from daybed.views.cache import not_modified
+
+
+MVT = 'application/vnd.mapbox-vector-tile'
+GEOJSON = 'application/geojson'
+
+
+tiles = Service(name='tiles',
+                path='/models/{model_id}/tiles/{z}/{x}/{y}',
+                description='Map tiles of the model records',
+                renderer='jsonp')
+
+
+@tiles.get(permission='get_records', validators=tile_validator)
+def get_tile(request):
+    """Retrieves a vector tile (MVT) of the model records, with the
+    geometries of their first geometry field.
+    """
+    return tile_response(request, MVT)
+
+
+@tiles.get(accept=GEOJSON, permission='get_records',
+           validators=tile_validator)
+def get_geojson_tile(request):
+    """Retrieves a tile of the model records, as a GeoJSON feature
+    collection.
+    """
+    return tile_response(request, GEOJSON)
+
+
+def tile_response(request, content_type):
+    """Returns the response of a tile, rendered once until the model
+    records are modified.
+    """
+    model_id = request.matchdict['model_id']
+    revision = request.db.get_model_revision(model_id)
+    response = not_modified(request, revision)
+    if response is not None:
+        return response
+
+    z, x, y = request.validated['tile']
+    key = (model_id, z, x, y, content_type)
+    cache = request.registry.tiles_cache
+    body = cache.get(key, revision)
+    if body is None:
+        body = build_tile(request, model_id, Tile(z, x, y), content_type)
+        cache.put(key, revision, body)
+
+    # GeoJSON is served as JSON, like records.
+    request.response.content_type = (content_type if content_type == MVT
+                                     else 'application/json')
+    request.response.body = body
+    return request.response
+
+
+def build_tile(request, model_id, tile, content_type):
+    """Renders a tile from the records intersecting it, read from the
+    spatial index of the geometry field if it is declared.
+    """
+    definition = request.db.get_model_definition(model_id)
+    field = geometry_field(definition)['name']
+    records = request.db.iter_records(
+        model_id, filters=[(field, 'bbox', tile.bounds)])
+    features = tile_features(tile, definition, records)
+    if content_type == MVT:
+        return mvt(model_id, tile, features)
+    return json.dumps(geojson(tile, features)).encode('utf-8')
@@ -43,10 +43,18 @@ REQUIREMENTS = ['setuptools',
                 'pyramid_persona',
                 'pyramid_multiauth',
                 'pyramid_mako']
+EXTRAS_REQUIRE = {
+    'postgresql': ['psycopg2'],
+    'redis': ['redis>=3.5'],
+    'asgi': ['aiohttp'],
+}
 DEPENDENCY_LINKS = []
 ENTRY_POINTS = {
     'paste.app_factory': [
         'main = daybed:main',
+    ],
+    'console_scripts': [
+        'daybed-migrate-couchdb = daybed.backends.couchdb.migrations:main',
     ]}
 
 if PY2:
@@ -77,5 +85,6 @@ if __name__ == '__main__':  # Don't run setup() when we import this module.
           include_package_data=True,
           zip_safe=False,
           install_requires=REQUIREMENTS,
+          extras_require=EXTRAS_REQUIRE,
           dependency_links=DEPENDENCY_LINKS,
           entry_points=ENTRY_POINTS)